@@ -10,11 +10,15 @@ Linux specific functions.
 from __future__ import absolute_import
 
 
+from ctypes.util import find_library
 from fcntl import ioctl
 from select import select
 
 import array
+import collections
 import ctypes
+import errno
+import mmap
 import os
 import socket
 import struct
@@ -24,7 +28,7 @@ import time
 
 import scapy.utils
 import scapy.utils6
-from scapy.compat import raw, plain_str
+from scapy.compat import raw, plain_str, orb
 from scapy.consts import LINUX
 from scapy.arch.common import (
     _iff_flags,
@@ -34,7 +38,7 @@ from scapy.arch.common import (
 )
 from scapy.config import conf
 from scapy.data import MTU, ETH_P_ALL, SOL_PACKET, SO_ATTACH_FILTER, \
-    SO_TIMESTAMPNS
+    SO_TIMESTAMPNS, ARPHRD_ETHER, ARPHRD_LOOPBACK
 from scapy.error import (
     ScapyInvalidPlatformException,
     Scapy_Exception,
@@ -44,10 +48,11 @@ from scapy.error import (
 )
 from scapy.interfaces import IFACES, InterfaceProvider, NetworkInterface, \
     network_name
-from scapy.libs.structures import sock_fprog
+from scapy.libs.structures import iovec, mmsghdr, sock_fprog
 from scapy.packet import Packet, Padding
 from scapy.pton_ntop import inet_ntop
-from scapy.supersocket import SuperSocket
+from scapy.supersocket import SuperSocket, ETH_P_8021Q, \
+    TP_STATUS_VLAN_VALID, TP_STATUS_VLAN_TPID_VALID
 
 import scapy.modules.six as six
 from scapy.modules.six.moves import range
@@ -56,7 +61,9 @@ from scapy.modules.six.moves import range
 from scapy.compat import (
     Any,
     Callable,
+    Deque,
     Dict,
+    Iterable,
     List,
     NoReturn,
     Optional,
@@ -98,6 +105,15 @@ PACKET_STATISTICS = 6
 PACKET_MR_MULTICAST = 0
 PACKET_MR_PROMISC = 1
 PACKET_MR_ALLMULTI = 2
+PACKET_VERSION = 10
+PACKET_VNET_HDR = 15
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# From linux/virtio_net.h
+VIRTIO_NET_HDR_F_NEEDS_CSUM = 1
+VIRTIO_NET_HDR_GSO_NONE = 0
 
 # From net/route.h
 RTF_UP = 0x0001  # Route usable
@@ -116,6 +132,17 @@ PACKET_AUXDATA = 8
 PACKET_FASTROUTE = 6  # Fastrouted frame
 # Unused, PACKET_FASTROUTE and PACKET_LOOPBACK are invisible to user space
 
+# sendmmsg() is available since glibc 2.14
+_sendmmsg = None  # type: Optional[Callable[..., int]]
+try:
+    _libc_sendmmsg = ctypes.CDLL(find_library("c"), use_errno=True).sendmmsg
+    _libc_sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                               ctypes.c_uint, ctypes.c_int]
+    _libc_sendmmsg.restype = ctypes.c_int
+    _sendmmsg = _libc_sendmmsg
+except (AttributeError, OSError):
+    pass
+
 # Utils
 
 
@@ -468,6 +495,45 @@ def _flush_fd(fd):
             break
 
 
+# struct virtio_net_hdr: flags, gso_type, hdr_len, gso_size, csum_start,
+# csum_offset
+_VNET_HDR = struct.Struct("=BBHHHH")
+_VNET_HDR_NONE = _VNET_HDR.pack(0, VIRTIO_NET_HDR_GSO_NONE, 0, 0, 0, 0)
+
+
+def _l4_checksum_offsets(frame):
+    # type: (bytes) -> Optional[Tuple[int, int]]
+    """Returns the offset of the TCP or UDP header of an Ethernet frame,
+    and the offset of its checksum in this header, or None"""
+    off = 12
+    while frame[off:off + 2] in (b"\x81\x00", b"\x88\xa8"):
+        # 802.1Q and 802.1ad tags
+        off += 4
+    etype = frame[off:off + 2]
+    off += 2
+    if etype == b"\x08\x00" and len(frame) >= off + 20:
+        ihl = (orb(frame[off]) & 0x0f) * 4
+        if struct.unpack("!H", frame[off + 6:off + 8])[0] & 0x3fff:
+            # Fragments
+            return None
+        proto = orb(frame[off + 9])
+        off += ihl
+    elif etype == b"\x86\xdd" and len(frame) >= off + 40:
+        proto = orb(frame[off + 6])
+        off += 40
+    else:
+        return None
+    if proto == socket.IPPROTO_TCP:
+        csum_offset = 16
+    elif proto == socket.IPPROTO_UDP:
+        csum_offset = 6
+    else:
+        return None
+    if len(frame) < off + csum_offset + 2:
+        return None
+    return off, csum_offset
+
+
 class L2Socket(SuperSocket):
     desc = "read/write packets at layer 2 using Linux PF_PACKET sockets"
 
@@ -478,8 +544,14 @@ class L2Socket(SuperSocket):
                  filter=None,  # type: Optional[Any]
                  nofilter=0,  # type: int
                  monitor=None,  # type: Optional[Any]
+                 checksum_offload=False,  # type: bool
                  ):
         # type: (...) -> None
+        """
+        :param checksum_offload: leave the TCP and UDP checksums to the
+            kernel or the NIC, on Ethernet interfaces. The frames are sent
+            with a virtio_net_hdr, through a PACKET_VNET_HDR socket.
+        """
         self.iface = network_name(iface or conf.iface)
         self.type = type
         self.promisc = conf.sniff_promisc if promisc is None else promisc
@@ -545,6 +617,18 @@ class L2Socket(SuperSocket):
             self.LL = conf.default_l2
             self.lvl = 2
             warning("Unable to guess type (interface=%s protocol=%#x family=%i). Using %s", sa_ll[0], sa_ll[1], sa_ll[3], self.LL.name)  # noqa: E501
+        self.csum_outs = None  # type: Optional[socket.socket]
+        if checksum_offload and self.outs:
+            if sa_ll[3] in [ARPHRD_ETHER, ARPHRD_LOOPBACK]:
+                self.csum_outs = socket.socket(
+                    socket.AF_PACKET, socket.SOCK_RAW, 0)
+                self.csum_outs.setsockopt(SOL_PACKET, PACKET_VNET_HDR, 1)
+                self.csum_outs.bind((self.iface, 0))
+            else:
+                log_runtime.info(
+                    "Checksum offload is only supported on Ethernet "
+                    "interfaces."
+                )
 
     def close(self):
         # type: () -> None
@@ -555,6 +639,8 @@ class L2Socket(SuperSocket):
                 set_promisc(self.ins, self.iface, 0)
         except (AttributeError, OSError):
             pass
+        if self.csum_outs:
+            self.csum_outs.close()
         SuperSocket.close(self)
 
     def recv_raw(self, x=MTU):
@@ -567,8 +653,50 @@ class L2Socket(SuperSocket):
             ts = get_last_packet_timestamp(self.ins)
         return self.LL, pkt, ts
 
+    def _vnet_frame(self, x):
+        # type: (Packet) -> bytes
+        """Builds a frame for csum_outs, after its virtio_net_hdr. The
+        checksum is left to the kernel when the packet has a single TCP or
+        UDP checksum to compute, right above IP or IPv6."""
+        if not isinstance(x, Packet):
+            return _VNET_HDR_NONE + raw(x)
+        offload = scapy.utils.checksum_offload
+        offload.enabled = True
+        del offload.partial[:]
+        try:
+            sx = raw(x)
+        finally:
+            offload.enabled = False
+        if not offload.partial:
+            return _VNET_HDR_NONE + sx
+        offsets = _l4_checksum_offsets(sx)
+        if len(offload.partial) == 1 and offsets is not None:
+            start, csum_offset = offsets
+            pos = start + csum_offset
+            if struct.unpack("!H", sx[pos:pos + 2])[0] == offload.partial[0]:
+                return _VNET_HDR.pack(
+                    VIRTIO_NET_HDR_F_NEEDS_CSUM, VIRTIO_NET_HDR_GSO_NONE,
+                    0, 0, start, csum_offset
+                ) + sx
+        # Tunnels, ICMP errors... the checksums are computed here
+        return _VNET_HDR_NONE + raw(x)
+
     def send(self, x):
         # type: (Packet) -> int
+        if self.csum_outs:
+            sx = self._vnet_frame(x)
+            try:
+                x.sent_time = time.time()
+            except AttributeError:
+                pass
+            try:
+                return self.csum_outs.send(sx) - _VNET_HDR.size
+            except socket.error as msg:
+                ln = len(sx) - _VNET_HDR.size
+                if msg.errno == 22 and ln < conf.min_pkt_size:
+                    padding = b"\x00" * (conf.min_pkt_size - ln)
+                    return self.csum_outs.send(sx + padding) - _VNET_HDR.size
+                raise
         try:
             return SuperSocket.send(self, x)
         except socket.error as msg:
@@ -580,6 +708,57 @@ class L2Socket(SuperSocket):
                     return SuperSocket.send(self, raw(x) + padding)
             raise
 
+    def send_many(self, pkts):
+        # type: (Iterable[Packet]) -> int
+        """Send several packets, using as few sendmmsg() syscalls as
+        possible. Returns the number of packets sent."""
+        if _sendmmsg is None or not self.outs:
+            return SuperSocket.send_many(self, pkts)
+        if self.csum_outs:
+            sock = self.csum_outs
+            build = self._vnet_frame  # type: Callable[[Packet], bytes]
+        else:
+            sock = self.outs
+            build = raw
+        pkts = list(pkts)
+        n = len(pkts)
+        iovs = (iovec * n)()
+        msgs = (mmsghdr * n)()
+        iov_addr = ctypes.addressof(iovs)
+        iov_size = ctypes.sizeof(iovec)
+        for i, p in enumerate(pkts):
+            sx = build(p)
+            iovs[i].iov_base = sx
+            iovs[i].iov_len = len(sx)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_iov = iov_addr + i * iov_size
+            hdr.msg_iovlen = 1
+        sent_time = time.time()
+        for p in pkts:
+            try:
+                p.sent_time = sent_time
+            except AttributeError:
+                pass
+        fd = sock.fileno()
+        msgs_addr = ctypes.addressof(msgs)
+        msg_size = ctypes.sizeof(mmsghdr)
+        i = 0
+        while i < n:
+            res = _sendmmsg(fd, msgs_addr + i * msg_size, n - i, 0)
+            if res >= 0:
+                i += res
+                continue
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if err == errno.EINVAL:
+                # e.g. a frame that is too short: let send() pad it
+                self.send(pkts[i])
+                i += 1
+                continue
+            raise OSError(err, os.strerror(err))
+        return n
+
 
 class L2ListenSocket(L2Socket):
     desc = "read packets at layer 2 using Linux PF_PACKET sockets. Also receives the packets going OUT"  # noqa: E501
@@ -589,6 +768,163 @@ class L2ListenSocket(L2Socket):
         raise Scapy_Exception("Can't send anything with L2ListenSocket")
 
 
+class L2RingListenSocket(L2ListenSocket):
+    """Receive packets at layer 2 through a memory-mapped TPACKET_V3 ring.
+
+    The kernel stores the frames in the blocks of a ring shared with user
+    space, and hands over a whole block at once (when it is full, or after
+    ``timeout`` ms). Reading a block does not require any syscall.
+
+    To use it with sniff(), set ``conf.L2listen = L2RingListenSocket``.
+
+    :param block_size: the size of each block of the ring. Must be a
+        multiple of the page size
+    :param block_nr: the number of blocks of the ring
+    :param frame_size: the maximum size of a frame
+    :param timeout: the delay (in ms) after which the kernel hands over a
+        block that is not full
+    """
+    desc = "read packets at layer 2 using a Linux PF_PACKET TPACKET_V3 ring"  # noqa: E501
+
+    # tpacket_block_desc: block_status, num_pkts, offset_to_first_pkt
+    _block_hdr = struct.Struct("III")
+    # tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len,
+    # tp_status, tp_mac, tp_net, tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+    _frame_hdr = struct.Struct("IIIIIIHHIIH")
+    ring = None  # type: Optional[mmap.mmap]
+
+    def __init__(self,
+                 iface=None,  # type: Optional[Union[str, NetworkInterface]]
+                 type=ETH_P_ALL,  # type: int
+                 promisc=None,  # type: Optional[Any]
+                 filter=None,  # type: Optional[Any]
+                 nofilter=0,  # type: int
+                 monitor=None,  # type: Optional[Any]
+                 block_size=1 << 20,  # type: int
+                 block_nr=64,  # type: int
+                 frame_size=1 << 11,  # type: int
+                 timeout=100,  # type: int
+                 ):
+        # type: (...) -> None
+        L2ListenSocket.__init__(self, iface=iface, type=type,
+                                promisc=promisc, filter=filter,
+                                nofilter=nofilter, monitor=monitor)
+        self.block_size = block_size
+        self.block_nr = block_nr
+        # Frames of the current block: (data, timestamp)
+        self.frames = collections.deque()  # type: Deque[Tuple[bytes, float]]  # noqa: E501
+        self.block_idx = 0
+        try:
+            self.ins.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            # struct tpacket_req3
+            self.ins.setsockopt(SOL_PACKET, PACKET_RX_RING, struct.pack(
+                "IIIIIII",
+                block_size, block_nr,
+                frame_size, block_size * block_nr // frame_size,
+                timeout, 0, 0
+            ))
+            self.ring = mmap.mmap(self.ins.fileno(), block_size * block_nr,
+                                  mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        except (OSError, socket.error, ValueError) as ex:
+            self.ring = None
+            self.close()
+            raise Scapy_Exception("Cannot set up the TPACKET_V3 ring: %s" %
+                                  ex)
+
+    def _block_ready(self, ring):
+        # type: (mmap.mmap) -> bool
+        """Is the current block handed over to user space ?"""
+        return bool(self._block_hdr.unpack_from(
+            ring, self.block_idx * self.block_size + 8
+        )[0] & TP_STATUS_USER)
+
+    def _read_block(self, ring):
+        # type: (mmap.mmap) -> None
+        """Copy the frames of the current block, then release it"""
+        base = self.block_idx * self.block_size
+        _, num_pkts, offset = self._block_hdr.unpack_from(ring, base + 8)
+        offset += base
+        frame_hdr = self._frame_hdr
+        frames = self.frames
+        for _ in range(num_pkts):
+            (next_offset, sec, nsec, snaplen, _, status, mac, _, _,
+             vlan_tci, vlan_tpid) = frame_hdr.unpack_from(ring, offset)
+            pkt = ring[offset + mac:offset + mac + snaplen]
+            if vlan_tci != 0 or status & TP_STATUS_VLAN_VALID:
+                # Insert VLAN tag
+                if not status & TP_STATUS_VLAN_TPID_VALID:
+                    vlan_tpid = ETH_P_8021Q
+                pkt = pkt[:12] + struct.pack("!HH", vlan_tpid,
+                                             vlan_tci) + pkt[12:]
+            frames.append((pkt, sec + nsec * 1e-9))
+            offset += next_offset
+        # Give the block back to the kernel
+        struct.pack_into("I", ring, base + 8, TP_STATUS_KERNEL)
+        self.block_idx = (self.block_idx + 1) % self.block_nr
+
+    def _wait_frames(self):
+        # type: () -> bool
+        """Wait for frames. Returns False if the socket has been closed"""
+        while not self.frames:
+            ring = self.ring
+            if ring is None:
+                return False
+            try:
+                if self._block_ready(ring):
+                    self._read_block(ring)
+                else:
+                    # Bounded, so that a close() from another thread is
+                    # noticed by a blocked reader
+                    select([self.ins], [], [], conf.recv_poll_rate)
+            except (OSError, socket.error, ValueError):
+                if self.closed:
+                    return False
+                raise
+        return True
+
+    def recv_block(self):
+        # type: () -> List[Tuple[bytes, float]]
+        """Wait for the next block, and return its frames as a list of
+        (data, timestamp)"""
+        if not self._wait_frames():
+            return []
+        frames = list(self.frames)
+        self.frames.clear()
+        return frames
+
+    def recv_raw(self, x=MTU):
+        # type: (int) -> Tuple[Optional[Type[Packet]], Optional[bytes], Optional[float]]  # noqa: E501
+        """Receives a packet, then returns a tuple containing (cls, pkt_data, time)"""  # noqa: E501
+        if not self._wait_frames():
+            return None, None, None
+        pkt, ts = self.frames.popleft()
+        return self.LL, pkt[:x], ts
+
+    @staticmethod
+    def select(sockets, remain=conf.recv_poll_rate):
+        # type: (List[SuperSocket], Optional[float]) -> List[SuperSocket]
+        """Returns the sockets that have frames pending in the current
+        block, or the result of select() if there are none"""
+        ready = [
+            sock for sock in sockets
+            if isinstance(sock, L2RingListenSocket) and sock.ring and
+            (sock.frames or sock._block_ready(sock.ring))
+        ]  # type: List[SuperSocket]
+        if ready:
+            return ready
+        return SuperSocket.select(sockets, remain)
+
+    def close(self):
+        # type: () -> None
+        if self.closed:
+            return
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        L2ListenSocket.close(self)
+
+
 class L3PacketSocket(L2Socket):
     desc = "read/write packets at layer 3 using Linux PF_PACKET sockets"
 
@@ -600,6 +936,11 @@ class L3PacketSocket(L2Socket):
             return pkt.payload
         return pkt
 
+    def send_many(self, pkts):
+        # type: (Iterable[Packet]) -> int
+        # Each packet is routed by send()
+        return SuperSocket.send_many(self, pkts)
+
     def send(self, x):
         # type: (Packet) -> int
         iff = x.route()[0]
@@ -12,6 +12,7 @@ TODO:
 """
 
 import ctypes
+import errno
 import itertools
 import logging
 import os
@@ -32,7 +33,7 @@ from scapy.plist import PacketList
 from scapy.data import MTU
 from scapy.supersocket import SuperSocket
 from scapy.packet import Packet
-from scapy.consts import WINDOWS
+from scapy.consts import LINUX, WINDOWS
 import scapy.modules.six as six
 
 from scapy.compat import (
@@ -80,8 +81,16 @@ def select_objects(inputs, remain):
     :param inputs: objects to process
     :param remain: timeout. If 0, return [].
     """
+    if LINUX:
+        return _poll_objects(inputs, remain)
     if not WINDOWS:
-        return select.select(inputs, [], [], remain)[0]
+        try:
+            return select.select(inputs, [], [], remain)[0]
+        except (IOError, select.error) as exc:
+            # select.error has no .errno attribute
+            if not exc.args or exc.args[0] != errno.EINTR:
+                raise
+            return []
     natives = []
     events = []
     results = set()
@@ -127,6 +136,195 @@ def select_objects(inputs, remain):
     return list(results)
 
 
+def _timeout_ms(remain):
+    # type: (Union[float, int, None]) -> int
+    """Converts a select() timeout to a poll() one, in milliseconds"""
+    if remain is None:
+        return -1
+    # Round up, so that small timeouts do not turn into busy loops
+    return max(0, int(remain * 1000 + 0.999))
+
+
+def _poll_objects(inputs, remain):
+    # type: (Iterable[Any], Union[float, int, None]) -> List[Any]
+    """
+    select_objects() implementation using poll(), which is not limited
+    to file descriptors lower than FD_SETSIZE (1024).
+    """
+    inputs = list(inputs)
+    poller = select.poll()
+    for obj in inputs:
+        poller.register(obj, select.POLLIN)
+    try:
+        ready = set(fd for fd, _ in poller.poll(_timeout_ms(remain)))
+    except (IOError, select.error) as exc:
+        if not exc.args or exc.args[0] != errno.EINTR:
+            raise
+        return []
+    if not ready:
+        return []
+    return [obj for obj in inputs
+            if (obj if isinstance(obj, int) else obj.fileno()) in ready]
+
+
+class ObjectSelector(object):
+    """
+    Persistent version of select_objects(): the objects are registered
+    once, then select() returns the ones that are ready to be read.
+
+    On Linux, epoll is used: a call costs O(ready objects) instead of
+    O(registered objects). Objects that epoll can't watch, such as
+    regular files, are always returned, as select() would. If an object
+    has no fileno(), or on other platforms, select() falls back to
+    select_objects() on all the registered objects.
+
+    Example:
+
+        >>> a, b = ObjectPipe("a"), ObjectPipe("b")
+        >>> selector = ObjectSelector([a, b])
+        >>> b.send("test")
+        >>> selector.select(1)
+        [b]
+
+    Objects must be unregistered before being closed.
+    """
+
+    def __init__(self, objects=None):
+        # type: (Optional[Iterable[Any]]) -> None
+        # All the registered objects, in registration order
+        self.objects = []  # type: List[Any]
+        self._epoll = None  # type: Any
+        if LINUX and hasattr(select, "epoll"):
+            self._epoll = select.epoll()
+        # fd -> objects, and object -> fd, of the objects watched by epoll
+        self._fds = {}  # type: Dict[int, List[Any]]
+        self._objects_fd = {}  # type: Dict[Any, int]
+        # Objects that can't be watched by epoll, always ready
+        self._always = []  # type: List[Any]
+        # Number of registered objects that have no usable fileno()
+        self._unsupported = 0
+        if objects is not None:
+            for obj in objects:
+                self.register(obj)
+
+    def register(self, obj):
+        # type: (Any) -> None
+        """Start watching obj"""
+        if obj in self.objects:
+            return
+        self.objects.append(obj)
+        if self._epoll is None:
+            return
+        try:
+            fd = obj if isinstance(obj, int) else obj.fileno()
+        except (AttributeError, IOError, OSError, ValueError):
+            fd = None
+        if not isinstance(fd, int):
+            self._unsupported += 1
+            return
+        if fd < 0:
+            # Not selectable: always included in the output
+            self._always.append(obj)
+            return
+        if fd not in self._fds:
+            try:
+                self._epoll.register(fd, select.EPOLLIN)
+            except (IOError, OSError) as exc:
+                if exc.errno == errno.EEXIST:
+                    # A closed object still had this fd registered
+                    self._epoll.modify(fd, select.EPOLLIN)
+                elif exc.errno == errno.EPERM:
+                    # Regular files: always ready to be read
+                    self._always.append(obj)
+                    return
+                else:
+                    raise
+        self._fds.setdefault(fd, []).append(obj)
+        self._objects_fd[obj] = fd
+
+    def unregister(self, obj):
+        # type: (Any) -> None
+        """Stop watching obj"""
+        if obj not in self.objects:
+            return
+        self.objects.remove(obj)
+        if obj in self._always:
+            self._always.remove(obj)
+            return
+        fd = self._objects_fd.pop(obj, None)
+        if fd is None:
+            if self._epoll is not None:
+                self._unsupported -= 1
+            return
+        objs = self._fds[fd]
+        objs.remove(obj)
+        if not objs:
+            del self._fds[fd]
+            try:
+                self._epoll.unregister(fd)
+            except (IOError, OSError, ValueError):
+                # The file descriptor has already been closed
+                pass
+
+    def update(self, objects):
+        # type: (Iterable[Any]) -> None
+        """Watch exactly the given objects"""
+        objects = list(objects)
+        for obj in [o for o in self.objects if o not in objects]:
+            self.unregister(obj)
+        for obj in objects:
+            self.register(obj)
+
+    def select(self, remain=None):
+        # type: (Union[float, int, None]) -> List[Any]
+        """
+        Returns the registered objects that are ready to be read, in
+        registration order.
+
+        :param remain: timeout. If None, wait until an object is ready.
+        """
+        if self._epoll is None or self._unsupported:
+            return select_objects(self.objects, remain)
+        if self._always:
+            remain = 0
+        elif remain is None:
+            remain = -1
+        else:
+            # A negative timeout would block
+            remain = max(0, remain)
+        try:
+            events = self._epoll.poll(remain)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EINTR:
+                raise
+            events = []
+        results = list(self._always)
+        for fd, _ in events:
+            results.extend(self._fds.get(fd, []))
+        if len(results) > 1:
+            # Same order as select_objects()
+            results.sort(key=self.objects.index)
+        return results
+
+    def close(self):
+        # type: () -> None
+        if self._epoll is not None:
+            self._epoll.close()
+            self._epoll = None
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.objects)
+
+    def __enter__(self):
+        # type: () -> ObjectSelector
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # type: (Any, Any, Any) -> None
+        self.close()
+
+
 _T = TypeVar("_T")
 
 
@@ -951,6 +1149,8 @@ class Automaton:
             self.send_sock = self.send_sock_class(**self.socket_kargs)
             self.listen_sock = self.recv_sock_class(**self.socket_kargs)
             self.packets = PacketList(name="session[%s]" % self.__class__.__name__)  # noqa: E501
+            # Objects watched in the current state
+            self._selector = ObjectSelector()
 
             singlestep = True
             iterator = self._do_iter()
@@ -1000,6 +1200,7 @@ class Automaton:
                 self.debug(3, "Transferring exception from tid=%i:\n%s" % (self.threadid, traceback.format_exception(*exc_info)))  # noqa: E501
                 m = Message(type=_ATMT_Command.EXCEPTION, exception=e, exc_info=exc_info)  # noqa: E501
                 self.cmdout.send(m)
+            self._selector.close()
             self.debug(3, "Stopping control thread (tid=%i)" % self.threadid)
             self.threadid = None
 
@@ -1053,6 +1254,7 @@ class Automaton:
                     fds.append(self.listen_sock)
                 for ioev in self.ioevents[self.state.state]:
                     fds.append(self.ioin[ioev.atmt_ioname])
+                self._selector.update(fds)
                 while True:
                     t = time.time() - t0
                     if next_timeout is not None:
@@ -1065,7 +1267,7 @@ class Automaton:
                         remain = next_timeout - t
 
                     self.debug(5, "Select on %r" % fds)
-                    r = select_objects(fds, remain)
+                    r = self._selector.select(remain)
                     self.debug(5, "Selected %r" % r)
                     for fd in r:
                         self.debug(5, "Looking at %r" % fd)
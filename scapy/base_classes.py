@@ -367,6 +367,12 @@ class Packet_metaclass(_Generic_metaclass):
         for f in newcls.fields_desc:  # type: ignore
             if hasattr(f, "register_owner"):
                 f.register_owner(newcls)
+        # Pre-compile the fixed-width fields used by the fast paths of
+        # do_dissect() and self_build()
+        from scapy.fields import _FixedLayout
+        newcls._fixed_layout = _FixedLayout.compile(  # type: ignore
+            newcls.fields_desc  # type: ignore
+        )
         if newcls.__name__[0] != "_":
             from scapy import config
             config.conf.layers.register(newcls)
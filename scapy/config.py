@@ -781,6 +781,10 @@ class Conf(ConfClass):
     auto_fragment = True
     #: raise exception when a packet dissector raises an exception
     debug_dissector = False
+    #: if True, the payload of a dissected layer is kept as raw bytes and
+    #: only dissected when it is first accessed (payload, getlayer(),
+    #: haslayer(), ...)
+    lazy_dissect = False
     color_theme = Interceptor("color_theme", NoTheme(), _prompt_changer)
     #: how much time between warnings from the same place
     warning_threshold = 5
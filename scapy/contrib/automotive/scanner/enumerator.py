@@ -10,15 +10,16 @@
 import abc
 import time
 import copy
-from collections import defaultdict, OrderedDict
+from collections import defaultdict, deque, OrderedDict
 from itertools import chain
 
-from scapy.compat import Any, Union, List, Optional, Iterable, \
-    Dict, Tuple, Set, Callable, cast, NamedTuple, orb
+from scapy.compat import Any, Union, List, Optional, Iterable, Iterator, \
+    Dict, Tuple, Set, Callable, cast, NamedTuple, orb, Deque
 from scapy.error import Scapy_Exception, log_interactive
 from scapy.utils import make_lined_table, EDecimal
 import scapy.modules.six as six
 from scapy.packet import Packet
+from scapy.supersocket import SuperSocket
 from scapy.contrib.automotive.ecu import EcuState, EcuResponse
 from scapy.contrib.automotive.scanner.test_case import AutomotiveTestCase, \
     StateGenerator, _SocketUnion, _TransitionTuple
@@ -45,6 +46,136 @@ _AutomotiveTestCaseFilteredScanResult = NamedTuple(
      ("resp_ts", Union[EDecimal, float])])
 
 
+class _PendingRequest(object):
+    __slots__ = ["req", "resp", "deadline", "done"]
+
+    def __init__(self, req, deadline):
+        # type: (Packet, float) -> None
+        self.req = req
+        self.resp = None  # type: Optional[Packet]
+        self.deadline = deadline
+        self.done = False
+
+
+class _RequestPipeline(object):
+    """
+    Request/response matcher bound to a socket, which keeps up to `window`
+    requests in flight. Answers are matched to the outstanding requests
+    with hashret() and answers(), and the results are provided in the order
+    of the requests. As negative responses only identify the service of
+    their request, they are matched to the oldest outstanding request of
+    that service: the ECU is expected to answer the requests in order.
+
+    A negative response with the code responsePending (0x78) postpones the
+    timeout of its request by `pending_timeout`, without blocking the other
+    requests.
+    """
+
+    def __init__(self,
+                 socket,  # type: _SocketUnion
+                 window,  # type: int
+                 timeout,  # type: Union[int, float]
+                 pending_timeout,  # type: Union[int, float]
+                 get_nrc,  # type: Callable[[Packet], int]
+                 ):  # type: (...) -> None
+        self.socket = socket
+        # A SingleConversationSocket only guards sr1() and send(): the
+        # answers are received from the wrapped socket
+        self._rx_socket = cast(SuperSocket,
+                               getattr(socket, "_inner", socket))
+        self.window = max(window, 1)
+        self.timeout = timeout
+        self.pending_timeout = pending_timeout
+        self._get_nrc = get_nrc
+        self._queue = deque()  # type: Deque[_PendingRequest]
+        self._by_hash = defaultdict(list)  # type: Dict[bytes, List[_PendingRequest]]  # noqa: E501
+
+    @property
+    def pending_requests(self):
+        # type: () -> List[Packet]
+        """Requests which were sent, but not provided by sr() yet"""
+        return [p.req for p in self._queue]
+
+    def sr(self, requests):
+        # type: (Iterable[Packet]) -> Iterator[Tuple[Packet, Optional[Packet]]]  # noqa: E501
+        """
+        Sends the requests and yields them with their answer, or None,
+        in the order of the requests.
+        """
+        it = iter(requests)
+        while True:
+            while len(self._queue) < self.window:
+                try:
+                    req = next(it)
+                except StopIteration:
+                    break
+                self._send(req)
+            if not self._queue:
+                return
+            head = self._queue[0]
+            while not head.done:
+                self._receive(head.deadline - time.time())
+                if not head.done and head.deadline <= time.time():
+                    self._finish(head, None)
+            self._queue.popleft()
+            yield head.req, head.resp
+
+    def flush(self):
+        # type: () -> List[Packet]
+        """
+        Waits for the answers of the requests in flight, which are dropped,
+        and returns the requests which were not provided by sr().
+        """
+        for p in self._queue:
+            while not p.done:
+                self._receive(p.deadline - time.time())
+                if not p.done and p.deadline <= time.time():
+                    self._finish(p, None)
+        reqs = self.pending_requests
+        self._queue.clear()
+        return reqs
+
+    def _send(self, req):
+        # type: (Packet) -> None
+        p = _PendingRequest(req, time.time() + self.timeout)
+        self._queue.append(p)
+        self._by_hash[req.hashret()].append(p)
+        self.socket.send(req)
+        p.deadline = time.time() + self.timeout
+
+    def _finish(self, p, resp):
+        # type: (_PendingRequest, Optional[Packet]) -> None
+        p.resp = resp
+        p.done = True
+        self._by_hash[p.req.hashret()].remove(p)
+
+    def _receive(self, remain):
+        # type: (float) -> None
+        rx = self._rx_socket
+        for s in rx.select([rx], max(remain, 0)):
+            resp = s.recv()
+            if self.socket.closed:
+                log_interactive.critical("[-] Socket closed during scan.")
+                raise Scapy_Exception("Socket closed during scan")
+            if resp is not None:
+                self._match(resp)
+
+    def _match(self, resp):
+        # type: (Packet) -> None
+        candidates = self._by_hash.get(resp.hashret())
+        if not candidates:
+            return
+        for p in candidates:
+            if resp.answers(p.req):
+                self._finish(p, resp)
+                return
+        if getattr(resp, "service", None) == 0x7f and \
+                self._get_nrc(resp) == 0x78:
+            # responsePending: the oldest request of that service is
+            # still processed by the ECU
+            candidates[0].deadline = time.time() + self.pending_timeout
+
+
 @six.add_metaclass(abc.ABCMeta)
 class ServiceEnumerator(AutomotiveTestCase):
     """
@@ -63,7 +194,9 @@ class ServiceEnumerator(AutomotiveTestCase):
         'exit_scan_on_first_negative_response': bool,
         'retry_if_busy_returncode': bool,
         'debug': bool,
-        'scan_range': (list, tuple, range)
+        'scan_range': (list, tuple, range),
+        'request_window': int,
+        'response_pending_timeout': (int, float)
     })
 
     _supported_kwargs_doc = AutomotiveTestCase._supported_kwargs_doc + """
@@ -101,7 +234,17 @@ class ServiceEnumerator(AutomotiveTestCase):
                                               response code is received.
         :param bool debug: Enables debug functions during execute.
         :param scan_range: Specifies the identifiers to be scanned.
-        :type scan_range: list or tuple or range or iterable"""
+        :type scan_range: list or tuple or range or iterable
+        :param int request_window: Maximum number of requests in flight. If
+                                   provided, the requests are pipelined
+                                   through a request/response matcher bound
+                                   to the socket, instead of being sent one
+                                   by one with sr1().
+        :param response_pending_timeout: Timeout until a response will
+                                         arrive after a 'responsePending'
+                                         negative response, if
+                                         request_window is provided.
+        :type response_pending_timeout: integer or float"""
 
     def __init__(self):
         # type: () -> None
@@ -234,6 +377,8 @@ class ServiceEnumerator(AutomotiveTestCase):
         self.check_kwargs(kwargs)
         timeout = kwargs.pop('timeout', 1)
         execution_time = kwargs.pop("execution_time", 1200)
+        request_window = kwargs.pop("request_window", None)
+        response_pending_timeout = kwargs.pop("response_pending_timeout", 5)
 
         state_block_list = kwargs.get('state_block_list', list())
 
@@ -258,21 +403,21 @@ class ServiceEnumerator(AutomotiveTestCase):
         log_interactive.debug(
             "[i] Start execution of enumerator: %s", time.ctime(start_time))
 
-        for req in it:
-            res = self.sr1_with_retry_on_error(req, socket, state, timeout)
-
-            self._store_result(state, req, res)
-
-            if self._evaluate_response(state, req, res, **kwargs):
-                log_interactive.debug("[i] Stop test_case execution because "
-                                      "of response evaluation")
+        if request_window is not None:
+            if not self._execute_pipelined(
+                    socket, state, it, start_time, execution_time,
+                    _RequestPipeline(socket, request_window, timeout,
+                                     response_pending_timeout,
+                                     self._get_negative_response_code),
+                    **kwargs):
                 return
+        else:
+            for req in it:
+                res = self.sr1_with_retry_on_error(req, socket, state, timeout)
 
-            if (start_time + execution_time) < time.time():
-                log_interactive.debug(
-                    "[i] Finished execution time of enumerator: %s",
-                    time.ctime())
-                return
+                if not self._process_result(state, req, res, start_time,
+                                            execution_time, **kwargs):
+                    return
 
         log_interactive.info("[i] Finished iterator execution")
         self._state_completed[state] = True
@@ -281,6 +426,67 @@ class ServiceEnumerator(AutomotiveTestCase):
 
     execute.__doc__ = _supported_kwargs_doc
 
+    def _process_result(self,
+                        state,  # type: EcuState
+                        req,  # type: Packet
+                        res,  # type: Optional[Packet]
+                        start_time,  # type: float
+                        execution_time,  # type: int
+                        **kwargs  # type: Any
+                        ):  # type: (...) -> bool
+        """
+        Stores and evaluates a result.
+        :return: True, if the execution can proceed with the next request
+        """
+        self._store_result(state, req, res)
+
+        if self._evaluate_response(state, req, res, **kwargs):
+            log_interactive.debug("[i] Stop test_case execution because "
+                                  "of response evaluation")
+            return False
+
+        if (start_time + execution_time) < time.time():
+            log_interactive.debug(
+                "[i] Finished execution time of enumerator: %s",
+                time.ctime())
+            return False
+        return True
+
+    def _execute_pipelined(self,
+                           socket,  # type: _SocketUnion
+                           state,  # type: EcuState
+                           it,  # type: Iterable[Packet]
+                           start_time,  # type: float
+                           execution_time,  # type: int
+                           pipeline,  # type: _RequestPipeline
+                           **kwargs  # type: Any
+                           ):  # type: (...) -> bool
+        """
+        Sends the requests of `it` through `pipeline`. Once the execution is
+        stopped, the requests in flight are not evaluated: they are sent
+        again during the next execution in this state, like the requests
+        which were not sent yet.
+        :return: True, if all requests were processed
+        """
+        try:
+            for req, res in pipeline.sr(it):
+                if not self._process_result(state, req, res, start_time,
+                                            execution_time, **kwargs):
+                    self._requeue_requests(state, pipeline.flush())
+                    return False
+        except (OSError, ValueError, Scapy_Exception):
+            self._requeue_requests(state, pipeline.pending_requests)
+            raise
+        return True
+
+    def _requeue_requests(self, state, requests):
+        # type: (EcuState, List[Packet]) -> None
+        if not requests:
+            return
+        log_interactive.debug("[i] Requeue %d requests", len(requests))
+        self._request_iterators[state] = chain(
+            requests, self._request_iterators.get(state, []))
+
     def sr1_with_retry_on_error(self, req, socket, state, timeout):
         # type: (Packet, _SocketUnion, EcuState, int) -> Optional[Packet]
         try:
@@ -9,10 +9,12 @@
 import abc
 import time
 
+from collections import OrderedDict
 from itertools import product
+from threading import Thread, Lock
 
 from scapy.compat import Any, Union, List, Optional, \
-    Dict, Callable, Type, cast
+    Dict, Callable, Type, Tuple, cast
 from scapy.contrib.automotive.scanner.graph import Graph
 from scapy.error import Scapy_Exception, log_interactive
 from scapy.supersocket import SuperSocket
@@ -200,7 +202,7 @@ class AutomotiveTestCaseExecutor:
                 self.configuration.add_test_case(new_test_case)
 
     def scan(self, timeout=None):
-        # type: (Optional[int]) -> None
+        # type: (Optional[float]) -> None
         """
         Executes all testcases for a given time.
         :param timeout: Time for execution.
@@ -358,3 +360,139 @@ class AutomotiveTestCaseExecutor:
 
         supported_responses.sort(key=Ecu.sort_key_func)
         return supported_responses
+
+
+class ParallelAutomotiveTestCaseExecutor(object):
+    """
+    Scans several targets concurrently, e.g. all ECUs behind one CAN
+    interface (one ISOTP address pair per ECU) or all logical addresses
+    behind one DoIP gateway. Every target is handled by its own
+    AutomotiveTestCaseExecutor, which owns the socket, the state graph and
+    the reset and reconnect handlers of this target. Each executor scans
+    in a worker thread of its own, so a slow, resetting or reconnecting
+    target does not stall the others.
+
+    Usage:
+        >>> scanners = {
+        ...     "0x7e0": UDS_Scanner(ISOTPSocket("can0", tx_id=0x7e0, rx_id=0x7e8)),  # noqa: E501
+        ...     "0x7e1": UDS_Scanner(ISOTPSocket("can0", tx_id=0x7e1, rx_id=0x7e9))}  # noqa: E501
+        >>> p = ParallelAutomotiveTestCaseExecutor(scanners)
+        >>> p.scan(timeout=3600)
+        >>> p.show_testcases()
+
+    :param executors: A dict, which maps a target name to the
+                      AutomotiveTestCaseExecutor of this target, or a list of
+                      executors, which get named by their index. The
+                      targets are scanned in this order
+    :param max_workers: Maximum number of targets scanned at the same time.
+                        All targets are scanned at once by default
+    """
+    def __init__(
+            self,
+            executors,  # type: Union[Dict[str, AutomotiveTestCaseExecutor], List[AutomotiveTestCaseExecutor]]  # noqa: E501
+            max_workers=None  # type: Optional[int]
+    ):  # type: (...) -> None
+        if not isinstance(executors, dict):
+            executors = OrderedDict(
+                (str(i), e) for i, e in enumerate(executors))
+        self.executors = executors
+        if max_workers is not None and max_workers < 1:
+            raise Scapy_Exception("max_workers has to be at least 1")
+        self.max_workers = max_workers
+
+        test_cases = [id(t) for e in self.executors.values()
+                      for t in e.configuration.test_cases]
+        if len(test_cases) != len(set(test_cases)):
+            raise Scapy_Exception(
+                "TestCase instances can't be shared between targets")
+
+        self.errors = dict()  # type: Dict[str, Exception]
+
+    def __getitem__(self, item):
+        # type: (str) -> AutomotiveTestCaseExecutor
+        return self.executors[item]
+
+    @property
+    def targets(self):
+        # type: () -> List[str]
+        return list(self.executors.keys())
+
+    def _worker(self, pending, lock, kill_time):
+        # type: (List[Tuple[str, AutomotiveTestCaseExecutor]], Lock, float) -> None  # noqa: E501
+        while True:
+            with lock:
+                if not pending:
+                    return
+                name, executor = pending.pop(0)
+            remaining = kill_time - time.time()
+            if remaining <= 0:
+                log_interactive.debug(
+                    "[-] Execution time exceeded. Skip target %s", name)
+                continue
+            log_interactive.info("[i] Scan target %s", name)
+            try:
+                executor.scan(remaining)
+            except Exception as e:
+                # The other targets are scanned nevertheless
+                log_interactive.critical(
+                    "[-] Scan of target %s failed: %s", name, e)
+                with lock:
+                    self.errors[name] = e
+            else:
+                log_interactive.info("[+] Scan of target %s finished", name)
+
+    def scan(self, timeout=None):
+        # type: (Optional[float]) -> None
+        """
+        Executes all testcases of all targets for a given time.
+        Exceptions raised by the scan of a target are stored in ``errors``.
+        :param timeout: Time for execution.
+        :return: None
+        """
+        kill_time = time.time() + (timeout or 0xffffffff)
+        pending = [(n, self.executors[n]) for n in self.targets]
+        lock = Lock()
+        self.errors.clear()
+        workers = [Thread(target=self._worker, args=(pending, lock, kill_time))
+                   for _ in range(min(self.max_workers or len(pending),
+                                      len(pending)))]
+        for w in workers:
+            w.daemon = True
+            w.start()
+        for w in workers:
+            w.join()
+
+    @property
+    def scan_completed(self):
+        # type: () -> bool
+        return all(e.scan_completed for e in self.executors.values())
+
+    def show_testcases(self):
+        # type: () -> None
+        for name in self.targets:
+            print("\n========== Target %s ==========" % name)
+            if name in self.errors:
+                print("Scan failed: %s" % self.errors[name])
+            self.executors[name].show_testcases()
+
+    def show_testcases_status(self):
+        # type: () -> None
+        data = list()
+        for name in self.targets:
+            e = self.executors[name]
+            for t in e.configuration.test_cases:
+                for s in e.state_graph.nodes:
+                    data += [("%s %r" % (name, s), t.__class__.__name__,
+                              t.has_completed(s))]
+        make_lined_table(data, lambda tup: (tup[0], tup[1], tup[2]))
+
+    @property
+    def supported_responses(self):
+        # type: () -> Dict[str, List[EcuResponse]]
+        """
+        Returns the supported responses of every target.
+        :return: A dict, which maps a target name to its sorted list of
+                 EcuResponse objects
+        """
+        return dict((n, e.supported_responses)
+                    for n, e in self.executors.items())
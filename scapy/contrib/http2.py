@@ -31,16 +31,18 @@ from __future__ import absolute_import
 from __future__ import print_function
 import abc
 import re
+from collections import deque
 from io import BytesIO
 import struct
 import scapy.modules.six as six
-from scapy.compat import raw, plain_str, hex_bytes, orb, chb, bytes_encode
+from scapy.compat import raw, plain_str, hex_bytes, bytes_hex, orb, chb, \
+    bytes_encode
 
 # Only required if using mypy-lang for static typing
 # Most symbols are used in mypy-interpreted "comments".
 # Sized must be one of the superclasses of a class implementing __len__
 from scapy.compat import Optional, List, Union, Callable, Any, \
-    Tuple, Sized, Pattern  # noqa: F401
+    Tuple, Sized, Pattern, Dict, Deque  # noqa: F401
 from scapy.base_classes import Packet_metaclass  # noqa: F401
 
 import scapy.fields as fields
@@ -1002,6 +1004,17 @@ class HPackZString(HPackStringsInterface):
 
     static_huffman_tree = None  # type: HuffmanNode
 
+    # The byte-at-a-time decoding tables, built from static_huffman_tree by
+    # huffman_compute_decode_table. The decoder states are the internal nodes
+    # of the tree, the root being state 0. Reading the byte b in state st
+    # leads to the state static_huffman_next[st << 8 | b] (-1 if the EOS
+    # symbol is met) and outputs static_huffman_syms[st << 8 | b].
+    static_huffman_next = None  # type: List[int]
+    static_huffman_syms = None  # type: List[bytes]
+    # (depth, whether all the bits from the root are 1s) of each state,
+    # to check the padding
+    static_huffman_padding = None  # type: List[Tuple[int, bool]]
+
     @classmethod
     def _huffman_encode_char(cls, c):
         # type: (Union[str, EOS]) -> Tuple[int, int]
@@ -1028,23 +1041,33 @@ class HPackZString(HPackStringsInterface):
         :return: (int, int): the bitstring of s and its bitlength
         :raises: AssertionError
         """
-        i = 0
-        ibl = 0
-        for c in s:
-            val, bl = cls._huffman_encode_char(c)
-            i = (i << bl) + val
-            ibl += bl
-
-        padlen = 8 - (ibl % 8)
-        if padlen != 8:
-            val, bl = cls._huffman_encode_char(EOS())
-            i = (i << padlen) + (val >> (bl - padlen))
-            ibl += padlen
+        return cls.huffman_conv2bitstring(cls.huffman_compress(s))
 
-        ret = i, ibl
-        assert(ret[0] >= 0)
-        assert (ret[1] >= 0)
-        return ret
+    @classmethod
+    def huffman_compress(cls, s):
+        # type: (str) -> bytes
+        """ huffman_compress returns the huffman-encoded bytestring of the
+        string provided as a parameter, padded with the MSB of the EOS symbol
+
+        :param str s: the string to encode
+        :return: bytes: the encoded string
+        """
+        code = cls.static_huffman_code
+        out = bytearray()
+        acc = 0
+        acc_bl = 0
+        for c in bytearray(bytes_encode(s)):
+            val, bl = code[c]
+            acc = (acc << bl) | val
+            acc_bl += bl
+            while acc_bl >= 8:
+                acc_bl -= 8
+                out.append((acc >> acc_bl) & 0xFF)
+            acc &= (1 << acc_bl) - 1
+        if acc_bl:
+            padlen = 8 - acc_bl
+            out.append(((acc << padlen) | ((1 << padlen) - 1)) & 0xFF)
+        return bytes(out)
 
     @classmethod
     def huffman_decode(cls, i, ibl):
@@ -1059,6 +1082,9 @@ class HPackZString(HPackStringsInterface):
         assert(i >= 0)
         assert(ibl >= 0)
 
+        if ibl % 8 == 0:
+            return cls.huffman_decompress(cls.huffman_conv2str(i, ibl))
+
         if isinstance(cls.static_huffman_tree, type(None)):
             cls.huffman_compute_decode_tree()
         assert(not isinstance(cls.static_huffman_tree, type(None)))
@@ -1104,6 +1130,40 @@ class HPackZString(HPackStringsInterface):
                 raise InvalidEncodingException('Huffman decoder is detecting unexpected padding format')  # noqa: E501
         return b''.join(s)
 
+    @classmethod
+    def huffman_decompress(cls, s):
+        # type: (bytes) -> bytes
+        """ huffman_decompress decodes the huffman-encoded bytestring provided
+        as parameter, one byte at a time.
+
+        :param bytes s: the bytestring to decode
+        :return: bytes: the decoded string
+        :raises: InvalidEncodingException
+        """
+        if cls.static_huffman_next is None:
+            cls.huffman_compute_decode_table()
+        nxt = cls.static_huffman_next
+        syms = cls.static_huffman_syms
+
+        out = []
+        st = 0
+        for c in bytearray(s):
+            idx = (st << 8) | c
+            st = nxt[idx]
+            if st < 0:
+                raise InvalidEncodingException('Huffman decoder met the full EOS symbol')  # noqa: E501
+            if syms[idx]:
+                out.append(syms[idx])
+
+        # The last state must be the MSB of the EOS symbol, see RFC7541
+        # par5.2
+        depth, ones = cls.static_huffman_padding[st]
+        if depth > 7:
+            raise InvalidEncodingException('Huffman decoder is detecting padding longer than 7 bits')  # noqa: E501
+        if not ones:
+            raise InvalidEncodingException('Huffman decoder is detecting unexpected padding format')  # noqa: E501
+        return b''.join(out)
+
     @classmethod
     def huffman_conv2str(cls, bit_str, bit_len):
         # type: (int, int) -> str
@@ -1124,14 +1184,9 @@ class HPackZString(HPackStringsInterface):
             bit_str <<= 8 - rem_bit
             byte_len += 1
 
-        # As usual the list/join tricks is a performance trick to build
-        # efficiently a Python string
-        s = []  # type: List[str]
-        i = 0
-        while i < byte_len:
-            s.insert(0, chb((bit_str >> (i * 8)) & 0xFF))
-            i += 1
-        return b''.join(s)
+        if not byte_len:
+            return b''
+        return hex_bytes('%0*x' % (byte_len * 2, bit_str))
 
     @classmethod
     def huffman_conv2bitstring(cls, s):
@@ -1144,10 +1199,8 @@ class HPackZString(HPackStringsInterface):
         :return: (int, int): the bitstring of s, and its bitlength.
         :raises: AssertionError
         """
-        i = 0
         ibl = len(s) * 8
-        for c in s:
-            i = (i << 8) + orb(c)
+        i = int(bytes_hex(s), 16) if s else 0
 
         ret = i, ibl
         assert(ret[0] >= 0)
@@ -1177,11 +1230,76 @@ class HPackZString(HPackStringsInterface):
                 parent = parent[b]
             i += 1
 
-    def __init__(self, s):
-        # type: (str) -> None
+    @classmethod
+    def huffman_compute_decode_table(cls):
+        # type: () -> None
+        """ huffman_compute_decode_table builds the byte-at-a-time decoding
+        tables (static_huffman_next, static_huffman_syms and
+        static_huffman_padding) from the static_huffman_tree
+
+        :return: None
+        """
+        if isinstance(cls.static_huffman_tree, type(None)):
+            cls.huffman_compute_decode_tree()
+        root = cls.static_huffman_tree
+
+        # Number the internal nodes, breadth-first
+        nodes = [root]
+        state_of = {id(root): 0}
+        padding = [(0, True)]
+        for node in nodes:
+            depth, ones = padding[state_of[id(node)]]
+            for b in (0, 1):
+                child = node[b]
+                if isinstance(child, HuffmanNode):
+                    state_of[id(child)] = len(nodes)
+                    nodes.append(child)
+                    padding.append((depth + 1, ones and b == 1))
+
+        # Transitions for a nibble, then for a byte
+        nibbles = []  # type: List[Tuple[int, bytes]]
+        for node in nodes:
+            for n in range(16):
+                cur = node
+                out = b''
+                for k in (3, 2, 1, 0):
+                    elmt = cur[(n >> k) & 1]
+                    if isinstance(elmt, HuffmanNode):
+                        cur = elmt
+                    elif isinstance(elmt, bytes):
+                        out += elmt
+                        cur = root
+                    else:
+                        cur = None
+                        break
+                nibbles.append((-1 if cur is None else state_of[id(cur)],
+                                out))
+        nxt = []  # type: List[int]
+        syms = []  # type: List[bytes]
+        for st in range(len(nodes)):
+            for c in range(256):
+                st1, out1 = nibbles[(st << 4) | (c >> 4)]
+                if st1 < 0:
+                    nxt.append(-1)
+                    syms.append(b'')
+                    continue
+                st2, out2 = nibbles[(st1 << 4) | (c & 0xF)]
+                nxt.append(st2)
+                syms.append(out1 + out2)
+        cls.static_huffman_padding = padding
+        cls.static_huffman_syms = syms
+        cls.static_huffman_next = nxt
+
+    def __init__(self, s, encoded=None):
+        # type: (str, Optional[bytes]) -> None
+        """
+        :param str s: the string
+        :param bytes encoded: its huffman encoding, if already known
+        """
         self._s = s
-        i, ibl = type(self).huffman_encode(s)
-        self._encoded = type(self).huffman_conv2str(i, ibl)
+        if encoded is None:
+            encoded = type(self).huffman_compress(s)
+        self._encoded = encoded
 
     def __str__(self):
         # type: () -> str
@@ -1223,8 +1341,7 @@ class HPackStrLenField(fields.Field):
         :raises: InvalidEncodingException
         """
         if t:
-            i, ibl = HPackZString.huffman_conv2bitstring(s)
-            return HPackZString(HPackZString.huffman_decode(i, ibl))
+            return HPackZString(HPackZString.huffman_decompress(s), s)
         return HPackLiteralString(s)
 
     def getfield(self, pkt, s):
@@ -2179,19 +2296,31 @@ class HPackHdrTable(Sized):
     """
     __slots__ = [
         '_dynamic_table',
+        '_dynamic_table_size',
         '_dynamic_table_max_size',
         '_dynamic_table_cap_size',
+        '_dynamic_count',
+        '_dynamic_name_idx',
+        '_dynamic_name_value_idx',
         '_regexp'
     ]
     """
-    :var _dynamic_table: the list containing entries requested to be added by
-        the peer and registered with a register() call
+    :var _dynamic_table: the deque containing entries requested to be added by
+        the peer and registered with a register() call, the most recent first
+    :var _dynamic_table_size: the summed length of the dynamic entries
     :var _dynamic_table_max_size: the current maximum size of the dynamic table
         in bytes. This value is updated with the Dynamic Table Size Update
         messages defined in RFC 7541 par6.3
     :var _dynamic_table_cap_size: the maximum size of the dynamic table in
         bytes. This value is updated with the SETTINGS_HEADER_TABLE_SIZE HTTP/2
         setting.
+    :var _dynamic_count: the number of entries ever added to the dynamic
+        table. The n-th added entry, while it is not evicted, is at the
+        dynamic index _dynamic_count - 1 - n.
+    :var _dynamic_name_idx: the most recently added entry (its n) for each
+        header name of the dynamic table
+    :var _dynamic_name_value_idx: the most recently added entry (its n) for
+        each header (name, value) of the dynamic table
     """
 
     # Manually imported from RFC 7541 Appendix A
@@ -2262,10 +2391,19 @@ class HPackHdrTable(Sized):
     # The value of this variable cannot be determined at declaration time. It is  # noqa: E501
     # initialized by an init_static_table call
     _static_entries_last_idx = None  # type: int
+    # The lowest static index of each header name, and (name, value)
+    _static_name_idx = None  # type: Dict[str, int]
+    _static_name_value_idx = None  # type: Dict[Tuple[str, str], int]
 
     @classmethod
     def init_static_table(cls):
         # type: () -> None
+        cls._static_name_idx = {}
+        cls._static_name_value_idx = {}
+        for idx in sorted(cls._static_entries, reverse=True):
+            entry = cls._static_entries[idx]
+            cls._static_name_idx[entry.name()] = idx
+            cls._static_name_value_idx[entry.name(), entry.value()] = idx
         cls._static_entries_last_idx = max(cls._static_entries)
 
     def __init__(self, dynamic_table_max_size=4096, dynamic_table_cap_size=4096):  # noqa: E501
@@ -2282,9 +2420,13 @@ class HPackHdrTable(Sized):
         assert dynamic_table_max_size <= dynamic_table_cap_size, \
             'EINVAL: dynamic_table_max_size too large; expected value is less or equal to dynamic_table_cap_size'  # noqa: E501
 
-        self._dynamic_table = []  # type: List[HPackHdrEntry]
+        self._dynamic_table = deque()  # type: Deque[HPackHdrEntry]
+        self._dynamic_table_size = 0
         self._dynamic_table_max_size = dynamic_table_max_size
         self._dynamic_table_cap_size = dynamic_table_cap_size
+        self._dynamic_count = 0
+        self._dynamic_name_idx = {}  # type: Dict[str, int]
+        self._dynamic_name_value_idx = {}  # type: Dict[Tuple[str, str], int]
 
     def __getitem__(self, idx):
         # type: (int) -> HPackHdrEntry
@@ -2351,13 +2493,17 @@ class HPackHdrTable(Sized):
         :raises: AssertionError
         """
         assert(new_entry_size >= 0)
-        cur_sz = len(self)
-        dyn_tbl_sz = len(self._dynamic_table)
-        while dyn_tbl_sz > 0 and cur_sz + new_entry_size > self._dynamic_table_max_size:  # noqa: E501
-            last_elmt_sz = len(self._dynamic_table[-1])
-            self._dynamic_table.pop()
-            dyn_tbl_sz -= 1
-            cur_sz -= last_elmt_sz
+        while self._dynamic_table and self._dynamic_table_size + new_entry_size > self._dynamic_table_max_size:  # noqa: E501
+            # The n of the oldest entry
+            n = self._dynamic_count - len(self._dynamic_table)
+            entry = self._dynamic_table.pop()
+            self._dynamic_table_size -= len(entry)
+            # Newer entries with the same name (and value) are kept indexed
+            if self._dynamic_name_idx.get(entry.name()) == n:
+                del self._dynamic_name_idx[entry.name()]
+            key = (entry.name(), entry.value())
+            if self._dynamic_name_value_idx.get(key) == n:
+                del self._dynamic_name_value_idx[key]
 
     def register(self, hdrs):
         # type: (Union[HPackLitHdrFldWithIncrIndexing, H2Frame, List[HPackHeaders]]) -> None  # noqa: E501
@@ -2403,7 +2549,12 @@ class HPackHdrTable(Sized):
             new_entry_len = len(entry)
             self._reduce_dynamic_table(new_entry_len)
             assert(new_entry_len <= self._dynamic_table_max_size)
-            self._dynamic_table.insert(0, entry)
+            self._dynamic_table.appendleft(entry)
+            self._dynamic_table_size += new_entry_len
+            self._dynamic_name_idx[entry.name()] = self._dynamic_count
+            self._dynamic_name_value_idx[entry.name(), entry.value()] = \
+                self._dynamic_count
+            self._dynamic_count += 1
 
     def get_idx_by_name(self, name):
         # type: (str) -> Optional[int]
@@ -2416,12 +2567,12 @@ class HPackHdrTable(Sized):
         If no matching header is found, this method returns None.
         """
         name = name.lower()
-        for key, val in six.iteritems(type(self)._static_entries):
-            if val.name() == name:
-                return key
-        for idx, val in enumerate(self._dynamic_table):
-            if val.name() == name:
-                return type(self)._static_entries_last_idx + idx + 1
+        idx = type(self)._static_name_idx.get(name)
+        if idx is not None:
+            return idx
+        n = self._dynamic_name_idx.get(name)
+        if n is not None:
+            return self._dynamic_idx(n)
         return None
 
     def get_idx_by_name_and_value(self, name, value):
@@ -2434,20 +2585,27 @@ class HPackHdrTable(Sized):
         the lowest index is returned
         If no matching header is found, this method returns None.
         """
-        name = name.lower()
-        for key, val in six.iteritems(type(self)._static_entries):
-            if val.name() == name and val.value() == value:
-                return key
-        for idx, val in enumerate(self._dynamic_table):
-            if val.name() == name and val.value() == value:
-                return type(self)._static_entries_last_idx + idx + 1
+        key = (name.lower(), value)
+        idx = type(self)._static_name_value_idx.get(key)
+        if idx is not None:
+            return idx
+        n = self._dynamic_name_value_idx.get(key)
+        if n is not None:
+            return self._dynamic_idx(n)
         return None
 
+    def _dynamic_idx(self, n):
+        # type: (int) -> int
+        """ _dynamic_idx returns the index of the n-th entry added to the
+        dynamic table
+        """
+        return type(self)._static_entries_last_idx + self._dynamic_count - n
+
     def __len__(self):
         # type: () -> int
         """ __len__ returns the summed length of all dynamic entries
         """
-        return sum(len(x) for x in self._dynamic_table)
+        return self._dynamic_table_size
 
     def gen_txt_repr(self, hdrs, register=True):
         # type: (Union[H2Frame, List[HPackHeaders]], Optional[bool]) -> str
@@ -11,6 +11,17 @@ import os
 import subprocess
 from scapy.error import log_loading
 
+__all__ = [
+    "Line2D",
+    "MATPLOTLIB",
+    "MATPLOTLIB_DEFAULT_PLOT_KARGS",
+    "MATPLOTLIB_INLINED",
+    "NUMPY",
+    "PYX",
+    "numpy",
+    "plt",
+]
+
 # Notice: this file must not be called before main.py, if started
 # in interactive mode, because it needs to be called after the
 # logger has been setup, to be able to print the warning messages
@@ -62,3 +73,13 @@ try:
 except ImportError:
     log_loading.info("Can't import PyX. Won't be able to use psdump() or pdfdump().")  # noqa: E501
     PYX = 0
+
+# NUMPY
+
+try:
+    import numpy
+    NUMPY = 1
+except ImportError:
+    numpy = None
+    NUMPY = 0
+    log_loading.info("Can't import numpy. Won't be able to use NumPy arrays.")  # noqa: E501
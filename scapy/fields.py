@@ -51,6 +51,7 @@ from scapy.compat import (
     List,
     Generic,
     Optional,
+    Sequence,
     Set,
     Tuple,
     Type,
@@ -2314,6 +2315,145 @@ class XBitField(BitField):
         return lhex(self.i2h(pkt, x))
 
 
+_Field_getfield = six.get_unbound_function(Field.getfield)
+_Field_addfield = six.get_unbound_function(Field.addfield)
+_Field_m2i = six.get_unbound_function(Field.m2i)
+_BitField_getfield = six.get_unbound_function(_BitField.getfield)
+_BitField_addfield = six.get_unbound_function(_BitField.addfield)
+
+
+class _FixedLayout(object):
+    """
+    Pre-compiled layout of the fixed-width fields that start a fields_desc.
+
+    The longest prefix of big endian fields that use the default
+    getfield()/addfield() (ByteField, ShortField, IntField, IPField,
+    MACField, ...) and of byte-aligned groups of BitFields is packed
+    into a single struct.Struct, so that it can be dissected and built
+    with a single unpack()/pack() call. It is created by the
+    Packet_metaclass and used by Packet.do_dissect() and
+    Packet.self_build().
+    """
+    __slots__ = ["fields_desc", "count", "size", "struct", "items", "groups"]
+
+    # struct codes used to unpack a group of bitfields, by size in bytes
+    _BITS_FMT = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+    def __init__(self, fields_desc):
+        # type: (Sequence[AnyField]) -> None
+        self.fields_desc = fields_desc
+        # (field, m2i, position in the struct, shift, mask)
+        self.items = []  # type: List[Tuple[Field[Any, Any], Optional[Callable[[Optional[Packet], Any], Any]], int, int, int]]  # noqa: E501
+        # groups of fields packed together: (field, is_bitfield) lists
+        self.groups = []  # type: List[List[Tuple[Field[Any, Any], bool]]]
+        fmt = "!"
+        bits = []  # type: List[_BitField[Any]]
+        nbits = 0
+        count = 0
+        for f in fields_desc:
+            if isinstance(f, Emph):
+                f = f.fld
+            if not isinstance(f, Field) or f.islist or f.holds_packets:
+                break
+            getfield = six.get_unbound_function(type(f).getfield)
+            addfield = six.get_unbound_function(type(f).addfield)
+            if isinstance(f, _BitField):
+                if getfield is not _BitField_getfield or \
+                        addfield is not _BitField_addfield or \
+                        f.rev or not f.size:
+                    break
+                bits.append(f)
+                nbits += f.size
+                if nbits % 8:
+                    continue
+                code = self._BITS_FMT.get(nbits // 8)
+                if code is None:
+                    break
+                fmt += code
+                shift = nbits
+                for bf in bits:
+                    shift -= bf.size
+                    self.items.append((bf, self._m2i(bf),
+                                       len(self.groups), shift,
+                                       (1 << bf.size) - 1))
+                self.groups.append([(bf, True) for bf in bits])
+                count += len(bits)
+                bits = []
+                nbits = 0
+                continue
+            if bits or getfield is not _Field_getfield or \
+                    addfield is not _Field_addfield or \
+                    f.fmt[0] not in "!>":
+                break
+            fmt += f.fmt[1:]
+            self.items.append((f, self._m2i(f), len(self.groups), 0, 0))
+            self.groups.append([(f, False)])
+            count += 1
+        self.count = count
+        self.struct = struct.Struct(fmt)
+        self.size = self.struct.size
+
+    @staticmethod
+    def _m2i(fld):
+        # type: (Field[Any, Any]) -> Optional[Callable[[Optional[Packet], Any], Any]]  # noqa: E501
+        # Skip the call when m2i() is the identity
+        if six.get_unbound_function(type(fld).m2i) is _Field_m2i:
+            return None
+        return fld.m2i
+
+    @classmethod
+    def compile(cls, fields_desc):
+        # type: (Sequence[AnyField]) -> Optional[_FixedLayout]
+        """Return the layout of fields_desc, or None if not worth it"""
+        layout = cls(fields_desc)
+        if layout.count < 2:
+            return None
+        return layout
+
+    def dissect(self, pkt, s):
+        # type: (Packet, bytes) -> None
+        """Set the fields of pkt from the first self.size bytes of s"""
+        values = self.struct.unpack_from(s)
+        fields = pkt.fields
+        cache = pkt.raw_packet_cache_fields
+        if cache is None:
+            cache = pkt.raw_packet_cache_fields = {}
+        for f, m2i, pos, shift, mask in self.items:
+            val = values[pos]
+            if mask:
+                val = (val >> shift) & mask
+            if m2i is not None:
+                val = m2i(pkt, val)
+            if f.ismutable:
+                # See Packet.do_dissect()
+                cache[f.name] = f.do_copy(val)
+            fields[f.name] = val
+
+    def build(self, pkt):
+        # type: (Packet) -> Optional[bytes]
+        """Build the fields of pkt, or return None if the generic
+        (field by field) method must be used"""
+        values = []
+        try:
+            for group in self.groups:
+                v = 0
+                for f, is_bits in group:
+                    val = pkt.getfieldval(f.name)
+                    if isinstance(val, RawVal):
+                        return None
+                    val = f.i2m(pkt, val)
+                    if is_bits:
+                        size = cast(_BitField[Any], f).size
+                        v = (v << size) | (int(val) & ((1 << size) - 1))
+                    else:
+                        v = val
+                values.append(v)
+            return self.struct.pack(*values)
+        except Exception:
+            # Let the generic method report the error
+            return None
+
+
 class _EnumField(Field[Union[List[I], I], I]):
     def __init__(self,
                  name,  # type: str
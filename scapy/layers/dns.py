@@ -18,7 +18,7 @@ from scapy.fields import BitEnumField, BitField, ByteEnumField, ByteField, \
     ConditionalField, Field, FieldLenField, FlagsField, IntField, \
     PacketListField, ShortEnumField, ShortField, StrField, \
     StrLenField, MultipleTypeField, UTCTimeField
-from scapy.compat import orb, raw, chb, bytes_encode
+from scapy.compat import orb, chb, bytes_encode
 from scapy.ansmachine import AnsweringMachine
 from scapy.sendrecv import sr1
 from scapy.layers.inet import IP, DestIPField, IPField, UDP, TCP
@@ -53,7 +53,7 @@ dnsqtypes.update(dnstypes)
 dnsclasses = {1: 'IN', 2: 'CS', 3: 'CH', 4: 'HS', 255: 'ANY'}
 
 
-def dns_get_str(s, pointer=0, pkt=None, _fullpacket=False):
+def dns_get_str(s, pointer=0, pkt=None, _fullpacket=False, _names=None):
     """This function decompresses a string s, starting
     from the given pointer.
 
@@ -67,18 +67,26 @@ def dns_get_str(s, pointer=0, pkt=None, _fullpacket=False):
     # that the string provided is the full dns packet, and thus
     # will be the same than pkt._orig_str. The "Cannot decompress"
     # error will not be prompted if True.
+    # The _names parameter is also reserved for scapy. It is a dict,
+    # shared by all the names of a same DNS message, that maps the
+    # targets of the pointers already followed to the decoded suffix.
     max_length = len(s)
-    # The result = the extracted name
-    name = b""
+    # The result = the extracted labels
+    labels = []
     # Will contain the index after the pointer, to be returned
     after_pointer = None
-    processed_pointers = []  # Used to check for decompression loops
+    processed_pointers = set()  # Used to check for decompression loops
+    # The pointers followed, with the number of labels read before them
+    targets = []
     # Analyse given pkt
     if pkt and hasattr(pkt, "_orig_s") and pkt._orig_s:
         s_full = pkt._orig_s
+        if _names is None:
+            _names = getattr(pkt, "_orig_names", None)
     else:
         s_full = None
     bytes_left = None
+    complete = False
     while True:
         if abs(pointer) >= max_length:
             log_runtime.info(
@@ -114,14 +122,28 @@ def dns_get_str(s, pointer=0, pkt=None, _fullpacket=False):
                     # No -> abort
                     raise Scapy_Exception("DNS message can't be compressed " +
                                           "at this point!")
-            processed_pointers.append(pointer)
+            processed_pointers.add(pointer)
+            if _names is not None:
+                suffix = _names.get(pointer)
+                if suffix is not None:
+                    # This suffix has already been decoded
+                    labels.append(suffix)
+                    complete = True
+                    break
+                targets.append((pointer, len(labels)))
             continue
         elif cur > 0:  # Label
             # cur = length of the string
-            name += s[pointer:pointer + cur] + b"."
+            labels.append(s[pointer:pointer + cur] + b".")
             pointer += cur
         else:
+            complete = True
             break
+    name = b"".join(labels)
+    if complete and targets:
+        # Remember the suffixes found at the followed pointers
+        for target, start in targets:
+            _names[target] = b"".join(labels[start:])
     if after_pointer is not None:
         # Return the real end index (not the one we followed)
         pointer = after_pointer
@@ -131,6 +153,14 @@ def dns_get_str(s, pointer=0, pkt=None, _fullpacket=False):
     return name, pointer, bytes_left, len(processed_pointers) != 0
 
 
+def _dns_is_built(x):
+    """Returns True if x is an already encoded DNS string"""
+    return b"." not in x and (
+        (x and orb(x[-1]) == 0) or
+        (len(x) >= 2 and (orb(x[-2]) & 0xc0) == 0xc0)
+    )
+
+
 def dns_encode(x, check_built=False):
     """Encodes a bytes string into the DNS format
 
@@ -141,10 +171,7 @@ def dns_encode(x, check_built=False):
     if not x or x == b".":
         return b"\x00"
 
-    if check_built and b"." not in x and (
-        (x and orb(x[-1]) == 0) or
-        (len(x) >= 2 and (orb(x[-2]) & 0xc0) == 0xc0)
-    ):
+    if check_built and _dns_is_built(x):
         # The value has already been processed. Do not process it again
         return x
 
@@ -164,6 +191,44 @@ def DNSgetstr(*args, **kwargs):
     return dns_get_str(*args, **kwargs)[:-1]
 
 
+def _dns_compress_name(x, offset, suffixes):
+    """Compresses the DNS string x, located at the given offset of the
+    DNS message, using the suffixes already present in the message.
+
+    :param x: the string
+    :param offset: the offset of the string in the DNS message
+    :param suffixes: dict mapping the names already present in the message
+                     to their offset. It is updated with the suffixes of x.
+    :returns: the compressed encoded string, or None if x can't be
+              compressed
+    """
+    if not x or x == b"." or _dns_is_built(x):
+        return None
+    labels = [k[:63] for k in x.split(b".")]
+    if not labels[-1]:
+        labels.pop()
+    if b"" in labels:
+        return None
+    # All the suffixes of x, from the longest to the shortest
+    parts = [b""] * len(labels)
+    suffix = b""
+    for i in range(len(labels) - 1, -1, -1):
+        suffix = labels[i] + b"." + suffix
+        parts[i] = suffix
+    encoded = []
+    for label, part in zip(labels, parts):
+        index = suffixes.get(part)
+        if index is not None:
+            encoded.append(struct.pack("!H", 0xc000 | index))
+            return b"".join(encoded)
+        if offset < 0x4000:
+            # Only the first 16383 bytes can be pointed at
+            suffixes[part] = offset
+        encoded.append(chb(len(label)) + label)
+        offset += len(label) + 1
+    return None
+
+
 def dns_compress(pkt):
     """This function compresses a DNS packet according to compression rules.
     """
@@ -172,77 +237,40 @@ def dns_compress(pkt):
     pkt = pkt.copy()
     dns_pkt = pkt.getlayer(DNS)
     dns_pkt.clear_cache()
-    build_pkt = raw(dns_pkt)
-
-    def field_gen(dns_pkt):
-        """Iterates through all DNS strings that can be compressed"""
-        for lay in [dns_pkt.qd, dns_pkt.an, dns_pkt.ns, dns_pkt.ar]:
-            if lay is None:
-                continue
-            current = lay
-            while not isinstance(current, NoPayload):
-                if isinstance(current, InheritOriginDNSStrPacket):
-                    for field in current.fields_desc:
-                        if isinstance(field, DNSStrField) or \
-                           (isinstance(field, MultipleTypeField) and
-                           current.type in [2, 3, 4, 5, 12, 15]):
-                            # Get the associated data and store it accordingly  # noqa: E501
-                            dat = current.getfieldval(field.name)
-                            yield current, field.name, dat
+    # Offsets are relative to the start of the DNS message: the records
+    # are located after the 12 bytes header.
+    offset = 12
+    suffixes = {}
+    for lay in [dns_pkt.qd, dns_pkt.an, dns_pkt.ns, dns_pkt.ar]:
+        current = lay
+        while current is not None and not isinstance(current, NoPayload):
+            if not isinstance(current, InheritOriginDNSStrPacket):
+                offset += len(current.self_build())
                 current = current.payload
-
-    def possible_shortens(dat):
-        """Iterates through all possible compression parts in a DNS string"""
-        yield dat
-        for x in range(1, dat.count(b".")):
-            yield dat.split(b".", x)[x]
-    data = {}
-    for current, name, dat in field_gen(dns_pkt):
-        for part in possible_shortens(dat):
-            # Encode the data
-            encoded = dns_encode(part, check_built=True)
-            if part not in data:
-                # We have no occurrence of such data, let's store it as a
-                # possible pointer for future strings.
-                # We get the index of the encoded data
-                index = build_pkt.index(encoded)
-                # The following is used to build correctly the pointer
-                fb_index = ((index >> 8) | 0xc0)
-                sb_index = index - (256 * (fb_index - 0xc0))
-                pointer = chb(fb_index) + chb(sb_index)
-                data[part] = [(current, name, pointer, index + 1)]
-            else:
-                # This string already exists, let's mark the current field
-                # with it, so that it gets compressed
-                data[part].append((current, name))
-                _in = data[part][0][3]
-                build_pkt = build_pkt[:_in] + build_pkt[_in:].replace(
-                    encoded,
-                    b"\0\0",
-                    1
-                )
-                break
-    # Apply compression rules
-    for ck in data:
-        # compression_key is a DNS string
-        replacements = data[ck]
-        # replacements is the list of all tuples (layer, field name)
-        # where this string was found
-        replace_pointer = replacements.pop(0)[2]
-        # replace_pointer is the packed pointer that should replace
-        # those strings. Note that pop remove it from the list
-        for rep in replacements:
-            # setfieldval edits the value of the field in the layer
-            val = rep[0].getfieldval(rep[1])
-            assert val.endswith(ck)
-            kept_string = dns_encode(val[:-len(ck)], check_built=True)[:-1]
-            new_val = kept_string + replace_pointer
-            rep[0].setfieldval(rep[1], new_val)
-            try:
-                del(rep[0].rdlen)
-            except AttributeError:
-                pass
-    # End of the compression algorithm
+                continue
+            # Build the record field by field, to know the offset
+            # of each DNS string
+            built = b""
+            compressed = False
+            for field in current.fields_desc:
+                val = current.getfieldval(field.name)
+                if isinstance(field, DNSStrField) or \
+                   (isinstance(field, MultipleTypeField) and
+                   current.type in [2, 3, 4, 5, 12, 15]):
+                    new_val = _dns_compress_name(val, offset + len(built),
+                                                 suffixes)
+                    if new_val is not None:
+                        current.setfieldval(field.name, new_val)
+                        val = new_val
+                        compressed = True
+                built = field.addfield(current, built, val)
+            if compressed:
+                try:
+                    del current.rdlen
+                except AttributeError:
+                    pass
+            offset += len(built)
+            current = current.payload
     # Destroy the previous DNS layer if needed
     if not isinstance(pkt, DNS) and pkt.getlayer(DNS).underlayer:
         pkt.getlayer(DNS).underlayer.remove_payload()
@@ -251,11 +279,13 @@ def dns_compress(pkt):
 
 
 class InheritOriginDNSStrPacket(Packet):
-    __slots__ = Packet.__slots__ + ["_orig_s", "_orig_p"]
+    __slots__ = Packet.__slots__ + ["_orig_s", "_orig_p", "_orig_names"]
 
-    def __init__(self, _pkt=None, _orig_s=None, _orig_p=None, *args, **kwargs):
+    def __init__(self, _pkt=None, _orig_s=None, _orig_p=None,
+                 _orig_names=None, *args, **kwargs):
         self._orig_s = _orig_s
         self._orig_p = _orig_p
+        self._orig_names = _orig_names
         Packet.__init__(self, _pkt=_pkt, *args, **kwargs)
 
 
@@ -332,13 +362,14 @@ class DNSRRField(StrField):
             return b""
         return bytes_encode(x)
 
-    def decodeRR(self, name, s, p):
+    def decodeRR(self, name, s, p, names=None):
         ret = s[p:p + 10]
         # type, cls, ttl, rdlen
         typ, cls, _, rdlen = struct.unpack("!HHIH", ret)
         p += 10
         cls = DNSRR_DISPATCHER.get(typ, DNSRR)
-        rr = cls(b"\x00" + ret + s[p:p + rdlen], _orig_s=s, _orig_p=p)
+        rr = cls(b"\x00" + ret + s[p:p + rdlen], _orig_s=s, _orig_p=p,
+                 _orig_names=names)
 
         # Reset rdlen if DNS compression was used
         for fname in rr.fieldtype.keys():
@@ -355,9 +386,11 @@ class DNSRRField(StrField):
 
     def getfield(self, pkt, s):
         if isinstance(s, tuple):
-            s, p = s
+            s, p, names = s
         else:
             p = 0
+            # Suffixes decoded in this DNS message, by offset
+            names = {}
         ret = None
         c = getattr(pkt, self.countfld)
         if c > len(s):
@@ -365,23 +398,24 @@ class DNSRRField(StrField):
             return s, b""
         while c:
             c -= 1
-            name, p, _, _ = dns_get_str(s, p, _fullpacket=True)
-            rr, p = self.decodeRR(name, s, p)
+            name, p, _, _ = dns_get_str(s, p, _fullpacket=True,
+                                        _names=names)
+            rr, p = self.decodeRR(name, s, p, names)
             if ret is None:
                 ret = rr
             else:
                 ret.add_payload(rr)
         if self.passon:
-            return (s, p), ret
+            return (s, p, names), ret
         else:
             return s[p:], ret
 
 
 class DNSQRField(DNSRRField):
-    def decodeRR(self, name, s, p):
+    def decodeRR(self, name, s, p, names=None):
         ret = s[p:p + 4]
         p += 4
-        rr = DNSQR(b"\x00" + ret, _orig_s=s, _orig_p=p)
+        rr = DNSQR(b"\x00" + ret, _orig_s=s, _orig_p=p, _orig_names=names)
         rr.qname = name
         return rr, p
 
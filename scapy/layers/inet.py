@@ -15,10 +15,10 @@ import re
 import random
 import select
 import socket
-from collections import defaultdict
+from collections import OrderedDict
 
-from scapy.utils import checksum, do_graph, incremental_label, \
-    linehexdump, strxor, whois, colgen
+from scapy.utils import checksum, checksum_offload, do_graph, \
+    incremental_label, linehexdump, strxor, whois, colgen
 from scapy.ansmachine import AnsweringMachine
 from scapy.base_classes import Gen, Net
 from scapy.data import ETH_P_IP, ETH_P_ALL, DLT_RAW, DLT_RAW_ALT, DLT_IPV4, \
@@ -531,6 +531,12 @@ class IP(Packet, IPTools):
             p = p[:10] + chb(ck >> 8) + chb(ck & 0xff) + p[12:]
         return p + pay
 
+    def template_checksums(self, offsets):
+        if self.chksum is not None:
+            return []
+        start, pay, _ = offsets[id(self)]
+        return [(start + 10, [(start, pay)], False)]
+
     def extract_padding(self, s):
         tmp_len = self.len - (self.ihl << 2)
         if tmp_len < 0:
@@ -632,7 +638,7 @@ class IP(Packet, IPTools):
         return lst
 
 
-def in4_chksum(proto, u, p):
+def in4_chksum(proto, u, p, partial=False):
     """
     As Specified in RFC 2460 - 8.1 Upper-Layer Checksums
 
@@ -640,6 +646,8 @@ def in4_chksum(proto, u, p):
     - 'proto' : value of upper layer protocol
     - 'u'  : IP upper layer instance
     - 'p'  : the payload of the upper layer provided as a string
+    - 'partial' : if True, only the sum of the pseudo-header is returned,
+      for the kernel or the NIC to complete it (checksum offload)
     """
     if not isinstance(u, IP):
         warning("No IP underlayer to compute checksum. Leaving null.")
@@ -672,9 +680,37 @@ def in4_chksum(proto, u, p):
                          inet_pton(socket.AF_INET, u.dst),
                          proto,
                          ln)
+    if partial:
+        return ~checksum(psdhdr) & 0xffff
     return checksum(psdhdr + p)
 
 
+def _template_l4_checksums(pkt, offsets, pos, zero_as_ffff):
+    """
+    Returns the upper layer checksum of pkt, located at offset pos, for
+    Packet.template_checksums(): it covers pkt and the addresses of the
+    IP or IPv6 pseudo-header.
+    """
+    u = pkt.underlayer
+    start, _, end = offsets[id(pkt)]
+    if isinstance(u, IP):
+        if any(isinstance(opt, (IPOption_LSRR, IPOption_SSRR))
+               for opt in u.options):
+            # The final destination is used
+            return None
+        ustart = offsets[id(u)][0]
+        pseudo = (ustart + 12, ustart + 20)
+    elif conf.ipv6_enabled and isinstance(u, scapy.layers.inet6.IPv6):
+        ustart = offsets[id(u)][0]
+        pseudo = (ustart + 8, ustart + 40)
+    elif conf.ipv6_enabled and isinstance(u, scapy.layers.inet6._IPv6ExtHdr):
+        # The addresses may come from the extension headers
+        return None
+    else:
+        return []
+    return [(start + pos, [(start, end), pseudo], zero_as_ffff)]
+
+
 class TCP(Packet):
     name = "TCP"
     fields_desc = [ShortEnumField("sport", 20, TCP_SERVICES),
@@ -698,18 +734,27 @@ class TCP(Packet):
             dataofs = (dataofs << 4) | orb(p[12]) & 0x0f
             p = p[:12] + chb(dataofs & 0xff) + p[13:]
         if self.chksum is None:
+            offload = checksum_offload.enabled
             if isinstance(self.underlayer, IP):
-                ck = in4_chksum(socket.IPPROTO_TCP, self.underlayer, p)
-                p = p[:16] + struct.pack("!H", ck) + p[18:]
+                ck = in4_chksum(socket.IPPROTO_TCP, self.underlayer, p,
+                                offload)
             elif conf.ipv6_enabled and isinstance(self.underlayer, scapy.layers.inet6.IPv6) or isinstance(self.underlayer, scapy.layers.inet6._IPv6ExtHdr):  # noqa: E501
-                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_TCP, self.underlayer, p)  # noqa: E501
-                p = p[:16] + struct.pack("!H", ck) + p[18:]
+                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_TCP, self.underlayer, p, offload)  # noqa: E501
             else:
                 log_runtime.info(
                     "No IP underlayer to compute checksum. Leaving null."
                 )
+                return p
+            if offload:
+                checksum_offload.partial.append(ck)
+            p = p[:16] + struct.pack("!H", ck) + p[18:]
         return p
 
+    def template_checksums(self, offsets):
+        if self.chksum is not None:
+            return []
+        return _template_l4_checksums(self, offsets, 16, False)
+
     def hashret(self):
         if conf.checkIPsrc:
             return struct.pack("H", self.sport ^ self.dport) + self.payload.hashret()  # noqa: E501
@@ -770,24 +815,34 @@ class UDP(Packet):
             tmp_len = len(p)
             p = p[:4] + struct.pack("!H", tmp_len) + p[6:]
         if self.chksum is None:
+            offload = checksum_offload.enabled
             if isinstance(self.underlayer, IP):
-                ck = in4_chksum(socket.IPPROTO_UDP, self.underlayer, p)
+                ck = in4_chksum(socket.IPPROTO_UDP, self.underlayer, p,
+                                offload)
                 # According to RFC768 if the result checksum is 0, it should be set to 0xFFFF  # noqa: E501
                 if ck == 0:
                     ck = 0xFFFF
-                p = p[:6] + struct.pack("!H", ck) + p[8:]
             elif isinstance(self.underlayer, scapy.layers.inet6.IPv6) or isinstance(self.underlayer, scapy.layers.inet6._IPv6ExtHdr):  # noqa: E501
-                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_UDP, self.underlayer, p)  # noqa: E501
+                ck = scapy.layers.inet6.in6_chksum(socket.IPPROTO_UDP, self.underlayer, p, offload)  # noqa: E501
                 # According to RFC2460 if the result checksum is 0, it should be set to 0xFFFF  # noqa: E501
                 if ck == 0:
                     ck = 0xFFFF
-                p = p[:6] + struct.pack("!H", ck) + p[8:]
             else:
                 log_runtime.info(
                     "No IP underlayer to compute checksum. Leaving null."
                 )
+                return p
+            if offload:
+                checksum_offload.partial.append(ck)
+            p = p[:6] + struct.pack("!H", ck) + p[8:]
         return p
 
+    def template_checksums(self, offsets):
+        if self.chksum is not None:
+            return []
+        # A null checksum is sent as 0xFFFF
+        return _template_l4_checksums(self, offsets, 6, True)
+
     def extract_padding(self, s):
         tmp_len = self.len - 8
         return s[:tmp_len], s[tmp_len:]
@@ -905,6 +960,12 @@ class ICMP(Packet):
             p = p[:2] + chb(ck >> 8) + chb(ck & 0xff) + p[4:]
         return p
 
+    def template_checksums(self, offsets):
+        if self.chksum is not None:
+            return []
+        start, _, end = offsets[id(self)]
+        return [(start + 2, [(start, end)], False)]
+
     def hashret(self):
         if self.type in [0, 8, 13, 14, 15, 16, 17, 18, 33, 34, 35, 36, 37, 38]:
             return struct.pack("HH", self.id, self.seq) + self.payload.hashret()  # noqa: E501
@@ -1103,77 +1164,300 @@ overlap_fragsize: the fragment size of the overlapping packet"""
     return qfrag + fragment(p, fragsize)
 
 
-def _defrag_list(lst, defrag, missfrag):
-    """Internal usage only. Part of the _defrag_logic"""
-    p = lst[0]
-    lastp = lst[-1]
-    if p.frag > 0 or lastp.flags.MF:  # first or last fragment missing
-        missfrag.extend(lst)
-        return
-    p = p.copy()
-    if conf.padding_layer in p:
-        del(p[conf.padding_layer].underlayer.payload)
-    ip = p[IP]
-    if ip.len is None or ip.ihl is None:
-        clen = len(ip.payload)
-    else:
-        clen = ip.len - (ip.ihl << 2)
-    txt = conf.raw_layer()
-    for q in lst[1:]:
-        if clen != q.frag << 3:  # Wrong fragmentation offset
-            if clen > q.frag << 3:
-                warning("Fragment overlap (%i > %i) %r || %r ||  %r" % (clen, q.frag << 3, p, txt, q))  # noqa: E501
-            missfrag.extend(lst)
-            break
-        if q[IP].len is None or q[IP].ihl is None:
-            clen += len(q[IP].payload)
+class _IPDatagram(object):
+    """Internal usage only. A datagram being reassembled by IPDefragmenter"""
+    __slots__ = ["data", "ranges", "total", "head", "time", "first_seen",
+                 "fragments", "bad"]
+
+    def __init__(self, now, keep_fragments):
+        self.data = bytearray()
+        # The received (start, end) ranges, sorted and merged
+        self.ranges = []
+        # The length of the payload, known once the last fragment is seen
+        self.total = None
+        # (class, bytes before the IP header, IP header, next header offset)
+        # taken from the first fragment
+        self.head = None
+        self.time = now
+        self.first_seen = now
+        self.fragments = [] if keep_fragments else None
+        self.bad = False
+
+
+class IPDefragmenter(object):
+    """Reassembles IPv4 and IPv6 fragments, one packet at a time.
+
+    The payloads of the fragments are copied into a buffer per datagram,
+    and the reassembled datagram is dissected once, when it is complete.
+    The datagrams are identified by their (src, dst, id, proto) for IPv4,
+    and (src, dst, id) for IPv6.
+
+    >>> d = IPDefragmenter(timeout=10)
+    >>> for p in fragment(IP(dst="1.2.3.4")/ICMP()/("X" * 3000)):
+    ...     p = d.process(p)
+    ...     if p is not None:
+    ...         p.show()
+
+    :param timeout: the time (in s) after the first fragment of a datagram
+                    after which it expires. The timeout is compared to the
+                    timestamps of the packets. None to disable.
+    :param max_bytes: the maximum number of bytes buffered in all the
+                      datagrams. The oldest datagrams are evicted first.
+                      None to disable.
+    :param max_datagrams: the maximum number of datagrams being reassembled.
+                          None to disable.
+    :param overlap: what to do with overlapping fragments: "first" keeps the
+                    data received first, "last" overwrites it, and "drop"
+                    discards the whole datagram (RFC 5722).
+    :param keep_fragments: keep the fragments of the pending datagrams, to
+                           be returned by flush().
+
+    The numbers of datagrams that were evicted, expired, or dropped
+    because of inconsistent fragments, are kept in the ``evicted``,
+    ``expired`` and ``dropped`` attributes.
+    """
+
+    def __init__(self, timeout=30, max_bytes=1 << 24, max_datagrams=4096,
+                 overlap="first", keep_fragments=False):
+        if overlap not in ["first", "last", "drop"]:
+            raise ValueError("overlap must be 'first', 'last' or 'drop' !")
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.max_datagrams = max_datagrams
+        self.overlap = overlap
+        self.keep_fragments = keep_fragments
+        self.evicted = 0
+        self.expired = 0
+        self.dropped = 0
+        # The datagrams, from the oldest to the most recent
+        self.datagrams = OrderedDict()
+        # The bytes buffered in all the datagrams
+        self.buffered = 0
+        from scapy.layers.inet6 import IPv6, IPv6ExtHdrFragment
+        self._ipv6 = IPv6
+        self._ipv6_frag = IPv6ExtHdrFragment
+
+    def _parse(self, pkt):
+        """Returns (key, offset, more fragments, data, head getter) for a
+        fragment, or None."""
+        ip = pkt.getlayer(IP)
+        if ip is not None:
+            s = raw(ip)
+            flags_frag = struct.unpack("!H", s[6:8])[0]
+            if not flags_frag & 0x3fff:
+                return None
+            hl = (orb(s[0]) & 0xf) << 2
+            end = struct.unpack("!H", s[2:4])[0]
+            if end < hl or end > len(s):
+                end = len(s)
+
+            def head():
+                return pkt.__class__, raw(pkt)[:-len(s)], s[:hl], None
+            return ((s[12:20], s[4:6], s[9:10]), (flags_frag & 0x1fff) << 3,
+                    flags_frag & 0x2000, s[hl:end], head)
+        fh = pkt.getlayer(self._ipv6_frag)
+        if fh is None:
+            return None
+        under = fh.underlayer
+        ip6 = under
+        while ip6 is not None and not isinstance(ip6, self._ipv6):
+            ip6 = ip6.underlayer
+        if ip6 is None:
+            return None
+        s = raw(ip6)
+        f = raw(fh)
+        offset_m = struct.unpack("!H", f[2:4])[0]
+        if not offset_m & 0xfff9:
+            # Atomic fragment (RFC 6946)
+            return None
+        unfrag = len(s) - len(f)
+        end = 40 + struct.unpack("!H", s[4:6])[0]
+        if end < unfrag + 8 or end > len(s):
+            end = len(s)
+
+        def head():
+            if under is ip6:
+                nh_offset = 6
+            else:
+                nh_offset = len(s) - len(raw(under))
+            return (pkt.__class__, raw(pkt)[:-len(s)],
+                    s[:unfrag] + f[:1], nh_offset)
+        return ((s[8:40], f[4:8]), offset_m & 0xfff8, offset_m & 1,
+                s[unfrag + 8:end], head)
+
+    def _drop(self, key):
+        dg = self.datagrams.pop(key)
+        self.buffered -= len(dg.data)
+        return dg
+
+    def _set_bad(self, dg):
+        self.buffered -= len(dg.data)
+        dg.data = bytearray()
+        dg.ranges = []
+        dg.bad = True
+        self.dropped += 1
+
+    def _expire(self, now):
+        """Drops the datagrams whose first fragment is older than the
+        timeout, at the time <now>"""
+        if self.timeout is None:
+            return
+        limit = now - self.timeout
+        while self.datagrams:
+            key, dg = next(six.iteritems(self.datagrams))
+            if dg.first_seen >= limit:
+                break
+            self._drop(key)
+            self.expired += 1
+
+    def _evict(self):
+        """Drops the oldest datagrams, until the table fits in the limits.
+        The most recent datagram is kept."""
+        while len(self.datagrams) > 1 and (
+                (self.max_datagrams is not None and
+                 len(self.datagrams) > self.max_datagrams) or
+                (self.max_bytes is not None and
+                 self.buffered > self.max_bytes)):
+            self._drop(next(iter(self.datagrams)))
+            self.evicted += 1
+
+    def _write(self, dg, offset, data):
+        """Copies <data> at <offset> in the buffer of the datagram, following
+        the overlap policy. Returns False if the datagram must be dropped."""
+        end = offset + len(data)
+        if end > 0xffff or (dg.total is not None and end > dg.total):
+            return False
+        ranges = dg.ranges
+        overlaps = [(s, e) for s, e in ranges if s < end and offset < e]
+        if end > len(dg.data):
+            self.buffered += end - len(dg.data)
+            dg.data.extend(b"\x00" * (end - len(dg.data)))
+        buf = dg.data
+        if not overlaps or self.overlap == "last":
+            buf[offset:end] = data
+        elif self.overlap == "drop":
+            return False
         else:
-            clen += q[IP].len - (q[IP].ihl << 2)
-        if conf.padding_layer in q:
-            del(q[conf.padding_layer].underlayer.payload)
-        txt.add_payload(q[IP].payload.copy())
-        if q.time > p.time:
-            p.time = q.time
-    else:
-        ip.flags.MF = False
-        del(ip.chksum)
-        del(ip.len)
-        p = p / txt
-        p._defrag_pos = max(x._defrag_pos for x in lst)
-        defrag.append(p)
+            # Only fill the holes
+            pos = offset
+            for s, e in overlaps:
+                if s > pos:
+                    buf[pos:s] = data[pos - offset:s - offset]
+                pos = max(pos, e)
+            if pos < end:
+                buf[pos:end] = data[pos - offset:]
+        # Merge the new range
+        start = offset
+        new_ranges = []
+        for s, e in ranges:
+            if e < start or s > end:
+                new_ranges.append((s, e))
+            else:
+                start = min(start, s)
+                end = max(end, e)
+        new_ranges.append((start, end))
+        new_ranges.sort()
+        dg.ranges = new_ranges
+        return True
+
+    def _build(self, dg):
+        cls, prefix, header, nh_offset = dg.head
+        header = bytearray(header)
+        if nh_offset is None:
+            # IPv4: set the length, clear MF and the offset, keep DF
+            length = len(header) + dg.total
+            struct.pack_into("!H", header, 2, length)
+            header[6] = orb(header[6]) & 0x40
+            header[7] = 0
+            header[10:12] = b"\x00\x00"
+            struct.pack_into("!H", header, 10, checksum(bytes(header)))
+        else:
+            # IPv6: remove the fragment header
+            nh = header.pop()
+            header[nh_offset] = nh
+            length = len(header) + dg.total
+            struct.pack_into("!H", header, 4, length - 40)
+        if length > 0xffff:
+            return None
+        pkt = cls(bytes(prefix) + bytes(header) + bytes(dg.data))
+        pkt.time = dg.time
+        return pkt
+
+    def process(self, pkt):
+        """Processes a packet. Returns it unchanged if it is not a fragment,
+        the reassembled packet if it was the missing fragment of a datagram,
+        or None."""
+        parsed = self._parse(pkt)
+        if parsed is None:
+            return pkt
+        key, offset, more, data, head = parsed
+        now = pkt.time
+        self._expire(now)
+        dg = self.datagrams.get(key)
+        if dg is None:
+            dg = self.datagrams[key] = _IPDatagram(now, self.keep_fragments)
+        if dg.fragments is not None:
+            dg.fragments.append(pkt)
+        if dg.bad:
+            return None
+        if now > dg.time:
+            dg.time = now
+        if not more:
+            end = offset + len(data)
+            if (dg.total is not None and dg.total != end) or \
+                    (dg.ranges and dg.ranges[-1][1] > end):
+                self._set_bad(dg)
+                return None
+            dg.total = end
+        if offset == 0 and (dg.head is None or self.overlap == "last"):
+            dg.head = head()
+        if not self._write(dg, offset, data):
+            self._set_bad(dg)
+            return None
+        if dg.head is not None and dg.total is not None and \
+                dg.ranges == [(0, dg.total)]:
+            self._drop(key)
+            res = self._build(dg)
+            if res is None:
+                self.dropped += 1
+            return res
+        self._evict()
+        return None
+
+    def flush(self):
+        """Drops all the pending datagrams. Returns their fragments, if
+        keep_fragments is set."""
+        fragments = []
+        for dg in six.itervalues(self.datagrams):
+            if dg.fragments:
+                fragments.extend(dg.fragments)
+        self.datagrams.clear()
+        self.buffered = 0
+        return fragments
 
 
 def _defrag_logic(plist, complete=False):
     """Internal function used to defragment a list of packets.
     It contains the logic behind the defrag() and defragment() functions
     """
-    frags = defaultdict(lambda: [])
+    defragmenter = IPDefragmenter(timeout=None, max_bytes=None,
+                                  max_datagrams=None, overlap="drop",
+                                  keep_fragments=True)
     final = []
+    defrag = []
     pos = 0
     for p in plist:
         p._defrag_pos = pos
         pos += 1
-        if IP in p:
-            ip = p[IP]
-            if ip.frag != 0 or ip.flags.MF:
-                uniq = (ip.id, ip.src, ip.dst, ip.proto)
-                frags[uniq].append(p)
-                continue
-        final.append(p)
-
-    defrag = []
-    missfrag = []
-    for lst in six.itervalues(frags):
-        lst.sort(key=lambda x: x.frag)
-        _defrag_list(lst, defrag, missfrag)
-    defrag2 = []
-    for p in defrag:
-        q = p.__class__(raw(p))
-        q._defrag_pos = p._defrag_pos
-        q.time = p.time
-        defrag2.append(q)
+        q = defragmenter.process(p)
+        if q is p:
+            final.append(p)
+        elif q is not None:
+            q._defrag_pos = p._defrag_pos
+            defrag.append(q)
+    missfrag = defragmenter.flush()
     if complete:
-        final.extend(defrag2)
+        final.extend(defrag)
         final.extend(missfrag)
         final.sort(key=lambda x: x._defrag_pos)
         if hasattr(plist, "listname"):
@@ -1182,7 +1466,7 @@ def _defrag_logic(plist, complete=False):
             name = "Defragmented"
         return PacketList(final, name=name)
     else:
-        return PacketList(final), PacketList(defrag2), PacketList(missfrag)
+        return PacketList(final), PacketList(defrag), PacketList(missfrag)
 
 
 @conf.commands.register
@@ -47,7 +47,7 @@ from scapy.fields import BitEnumField, BitField, ByteEnumField, ByteField, \
     ShortField, SourceIP6Field, StrField, StrFixedLenField, StrLenField, \
     X3BytesField, XBitField, XIntField, XShortField
 from scapy.layers.inet import IP, IPTools, TCP, TCPerror, TracerouteResult, \
-    UDP, UDPerror
+    UDP, UDPerror, _template_l4_checksums
 from scapy.layers.l2 import CookedLinux, Ether, GRE, Loopback, SNAP
 import scapy.modules.six as six
 from scapy.packet import bind_layers, Packet, Raw
@@ -559,14 +559,14 @@ class PseudoIPv6(Packet):  # IPv6 Pseudo-header for checksum computation
                    ByteField("nh", 0)]
 
 
-def in6_chksum(nh, u, p):
+def in6_chksum(nh, u, p, partial=False):
     """
     As Specified in RFC 2460 - 8.1 Upper-Layer Checksums
 
     Performs IPv6 Upper Layer checksum computation.
 
-    This function operates by filling a pseudo header class instance
-    (PseudoIPv6) with:
+    This function operates by building a pseudo header (see PseudoIPv6)
+    with:
     - Next Header value
     - the address of _final_ destination (if some Routing Header with non
     segleft field is present in underlayer classes, last address is used.)
@@ -581,10 +581,10 @@ def in6_chksum(nh, u, p):
         provided with all under layers (IPv6 and all extension headers,
         for example)
     :param p: the payload of the upper layer provided as a string
+    :param partial: if True, only the sum of the pseudo-header is returned,
+        for the kernel or the NIC to complete it (checksum offload)
     """
 
-    ph6 = PseudoIPv6()
-    ph6.nh = nh
     rthdr = 0
     hahdr = 0
     final_dest_addr_found = 0
@@ -606,16 +606,16 @@ def in6_chksum(nh, u, p):
     if u is None:
         warning("No IPv6 underlayer to compute checksum. Leaving null.")
         return 0
-    if hahdr:
-        ph6.src = hahdr
-    else:
-        ph6.src = u.src
-    if rthdr:
-        ph6.dst = rthdr
-    else:
-        ph6.dst = u.dst
-    ph6.uplen = len(p)
-    ph6s = raw(ph6)
+    src = hahdr or u.src
+    dst = rthdr or u.dst
+    # Same layout as PseudoIPv6, without building a packet
+    ph6s = struct.pack("!16s16sI3xB",
+                       inet_pton(socket.AF_INET6, plain_str(src or "::")),
+                       inet_pton(socket.AF_INET6, plain_str(dst or "::")),
+                       len(p),
+                       nh)
+    if partial:
+        return ~checksum(ph6s) & 0xffff
     return checksum(ph6s + p)
 
 
@@ -1338,6 +1338,11 @@ class _ICMPv6(Packet):
             p = p[:2] + struct.pack("!H", chksum) + p[4:]
         return p
 
+    def template_checksums(self, offsets):
+        if self.cksum is not None:
+            return []
+        return _template_l4_checksums(self, offsets, 2, False)
+
     def hashret(self):
         return self.payload.hashret()
 
@@ -49,12 +49,13 @@ import socket
 import struct
 
 from scapy.config import conf, crypto_validator
-from scapy.compat import orb, raw
+from scapy.compat import chb, orb, raw
 from scapy.data import IP_PROTOS
 from scapy.error import log_loading
 from scapy.fields import ByteEnumField, ByteField, IntField, PacketField, \
     ShortField, StrField, XIntField, XStrField, XStrLenField
 from scapy.packet import Packet, bind_layers, Raw
+from scapy.utils import checksum
 from scapy.layers.inet import IP, UDP
 import scapy.modules.six as six
 from scapy.modules.six.moves import range
@@ -171,6 +172,7 @@ if conf.crypto_valid:
     from cryptography.hazmat.backends import default_backend
     from cryptography.hazmat.primitives.ciphers import (
         Cipher,
+        CipherAlgorithm,
         algorithms,
         modes,
     )
@@ -179,7 +181,7 @@ else:
                      "Disabled IPsec encryption/authentication.")
     default_backend = None
     InvalidTag = Exception
-    Cipher = algorithms = modes = None
+    Cipher = CipherAlgorithm = algorithms = modes = None
 
 ###############################################################################
 
@@ -194,6 +196,10 @@ def _lcm(a, b):
         return abs(a * b) // gcd(a, b)
 
 
+# RFC4303, section 2.4: the padding bytes are 1, 2, 3...
+_ESP_PADDING = struct.pack("B" * 255, *range(1, 256))
+
+
 class CryptAlgo(object):
     """
     IPsec encryption algorithm
@@ -279,9 +285,20 @@ class CryptAlgo(object):
         return os.urandom(self.iv_size)
 
     @crypto_validator
-    def new_cipher(self, key, mode_iv, digest=None):
+    def new_cipher_algo(self, key):
         """
         :param key:     the secret key, a byte string
+        :returns:    the cipher algorithm initialized with this key. It can be
+                     given to `new_cipher` instead of the key, so that the key
+                     is only checked once.
+        """
+        return self.cipher(key)
+
+    @crypto_validator
+    def new_cipher(self, key, mode_iv, digest=None):
+        """
+        :param key:     the secret key, a byte string, or the cipher algorithm
+                        returned by `new_cipher_algo`
         :param mode_iv: the initialization vector or nonce, a byte string.
                         Formatted by `format_mode_iv`.
         :param digest:  also known as tag or icv. A byte string containing the
@@ -290,20 +307,33 @@ class CryptAlgo(object):
 
         :returns:    an initialized cipher object for this algo
         """
+        if not isinstance(key, CipherAlgorithm):
+            key = self.cipher(key)
         if self.is_aead and digest is not None:
             # With AEAD, the mode needs the digest during decryption.
             return Cipher(
-                self.cipher(key),
+                key,
                 self.mode(mode_iv, digest, len(digest)),
                 default_backend(),
             )
         else:
             return Cipher(
-                self.cipher(key),
+                key,
                 self.mode(mode_iv),
                 default_backend(),
             )
 
+    def padding(self, data_len):
+        """
+        :param data_len: the length of the data to encrypt, without the
+                         padlen and nh bytes
+        :returns: the padding bytes to append to this data, so that it
+                  complies with the algorithm's block size and the 32 bits
+                  alignment of the ESP payload
+        """
+        # 2 extra bytes for padlen and nh
+        return _ESP_PADDING[:-(data_len + 2) % _lcm(self.block_size, 4)]
+
     def pad(self, esp):
         """
         Add the correct amount of padding so that the data to encrypt is
@@ -352,26 +382,47 @@ class CryptAlgo(object):
         :esn:        extended sequence number (32 MSB)
         :return:    a valid ESP packet encrypted with this algorithm
         """
-        data = esp.data_for_encryption()
-
-        if self.cipher:
-            mode_iv = self._format_mode_iv(algo=self, sa=sa, iv=esp.iv)
-            cipher = self.new_cipher(key, mode_iv)
-            encryptor = cipher.encryptor()
-
-            if self.is_aead:
-                if esn_en:
-                    aad = struct.pack('!LLL', esp.spi, esn, esp.seq)
-                else:
-                    aad = struct.pack('!LL', esp.spi, esp.seq)
-                encryptor.authenticate_additional_data(aad)
-                data = encryptor.update(data) + encryptor.finalize()
-                data += encryptor.tag[:self.icv_size]
-            else:
-                data = encryptor.update(data) + encryptor.finalize()
+        data = self.encrypt_data(sa, key, esp.spi, esp.seq, esp.iv,
+                                 esp.data_for_encryption(),
+                                 esn_en=esn_en, esn=esn)
 
         return ESP(spi=esp.spi, seq=esp.seq, data=esp.iv + data)
 
+    def encrypt_data(self, sa, key, spi, seq, iv, data, esn_en=False, esn=0):
+        """
+        Encrypt the payload of an ESP packet
+
+        :param sa:   the SecurityAssociation associated with the ESP packet.
+        :param key:  the secret key used for encryption, or the cipher
+                     algorithm returned by `new_cipher_algo`
+        :param spi:  the SPI of the ESP packet
+        :param seq:  the sequence number of the ESP packet (32 LSB)
+        :param iv:   the initialization vector
+        :param data: the padded data to encrypt, followed by padlen and nh
+        :param esn_en: extended sequence number enable
+        :param esn:  extended sequence number (32 MSB)
+        :returns: the encrypted data, followed by the ICV with an AEAD
+                  algorithm
+        """
+        if not self.cipher:
+            return data
+
+        mode_iv = self._format_mode_iv(algo=self, sa=sa, iv=iv)
+        cipher = self.new_cipher(key, mode_iv)
+        encryptor = cipher.encryptor()
+
+        if self.is_aead:
+            if esn_en:
+                aad = struct.pack('!LLL', spi, esn, seq)
+            else:
+                aad = struct.pack('!LL', spi, seq)
+            encryptor.authenticate_additional_data(aad)
+            data = encryptor.update(data) + encryptor.finalize()
+            data += encryptor.tag[:self.icv_size]
+        else:
+            data = encryptor.update(data) + encryptor.finalize()
+        return data
+
     def decrypt(self, sa, esp, key, icv_size=None, esn_en=False, esn=0):
         """
         Decrypt an ESP packet
@@ -395,23 +446,8 @@ class CryptAlgo(object):
         data = esp.data[self.iv_size:len(esp.data) - icv_size]
         icv = esp.data[len(esp.data) - icv_size:]
 
-        if self.cipher:
-            mode_iv = self._format_mode_iv(sa=sa, iv=iv)
-            cipher = self.new_cipher(key, mode_iv, icv)
-            decryptor = cipher.decryptor()
-
-            if self.is_aead:
-                # Tag value check is done during the finalize method
-                if esn_en:
-                    decryptor.authenticate_additional_data(
-                        struct.pack('!LLL', esp.spi, esn, esp.seq))
-                else:
-                    decryptor.authenticate_additional_data(
-                        struct.pack('!LL', esp.spi, esp.seq))
-            try:
-                data = decryptor.update(data) + decryptor.finalize()
-            except InvalidTag as err:
-                raise IPSecIntegrityError(err)
+        data = self.decrypt_data(sa, key, esp.spi, esp.seq, iv, data, icv,
+                                 esn_en=esn_en, esn=esn)
 
         # extract padlen and nh
         padlen = orb(data[-2])
@@ -430,6 +466,45 @@ class CryptAlgo(object):
                          nh=nh,
                          icv=icv)
 
+    def decrypt_data(self, sa, key, spi, seq, iv, data, icv,
+                     esn_en=False, esn=0):
+        """
+        Decrypt the payload of an ESP packet
+
+        :param sa:   the SecurityAssociation associated with the ESP packet.
+        :param key:  the secret key used for encryption, or the cipher
+                     algorithm returned by `new_cipher_algo`
+        :param spi:  the SPI of the ESP packet
+        :param seq:  the sequence number of the ESP packet (32 LSB)
+        :param iv:   the initialization vector
+        :param data: the encrypted data
+        :param icv:  the ICV of an AEAD algorithm
+        :param esn_en: extended sequence number enable
+        :param esn:  extended sequence number (32 MSB)
+        :returns: the decrypted data, followed by padlen and nh
+        :raise scapy.layers.ipsec.IPSecIntegrityError: if the integrity check
+            fails with an AEAD algorithm
+        """
+        if not self.cipher:
+            return data
+
+        mode_iv = self._format_mode_iv(sa=sa, iv=iv)
+        cipher = self.new_cipher(key, mode_iv, icv)
+        decryptor = cipher.decryptor()
+
+        if self.is_aead:
+            # Tag value check is done during the finalize method
+            if esn_en:
+                decryptor.authenticate_additional_data(
+                    struct.pack('!LLL', spi, esn, seq))
+            else:
+                decryptor.authenticate_additional_data(
+                    struct.pack('!LL', spi, seq))
+        try:
+            return decryptor.update(data) + decryptor.finalize()
+        except InvalidTag as err:
+            raise IPSecIntegrityError(err)
+
 ###############################################################################
 # The names of the encryption algorithms are the same than in scapy.contrib.ikev2  # noqa: E501
 # see http://www.iana.org/assignments/ikev2-parameters/ikev2-parameters.xhtml
@@ -504,6 +579,13 @@ class IPSecIntegrityError(Exception):
     pass
 
 
+class IPSecReplayError(IPSecIntegrityError):
+    """
+    Error risen when a packet is rejected by the anti-replay window.
+    """
+    pass
+
+
 class AuthAlgo(object):
     """
     IPsec integrity algorithm
@@ -538,14 +620,29 @@ class AuthAlgo(object):
     @crypto_validator
     def new_mac(self, key):
         """
-        :param key:    a byte string
+        :param key:    a byte string, or a mac object returned by this method
+                       that has not been finalized. It is then copied, which
+                       saves the computation of the inner and outer keys.
         :returns:       an initialized mac object for this algo
         """
+        if isinstance(key, (HMAC, CMAC)):
+            return key.copy()
         if self.mac is CMAC:
             return self.mac(self.digestmod(key), default_backend())
         else:
             return self.mac(key, self.digestmod(), default_backend())
 
+    def compute_icv(self, data, key):
+        """
+        :param data:   the authenticated bytes
+        :param key:    the authentication key, or a mac object returned by
+                       `new_mac`
+        :returns: the truncated integrity check value of data
+        """
+        mac = self.new_mac(key)
+        mac.update(data)
+        return mac.finalize()[:self.icv_size]
+
     def sign(self, pkt, key, esn_en=False, esn=0):
         """
         Sign an IPsec (ESP or AH) packet with this algo.
@@ -808,7 +905,8 @@ class SecurityAssociation(object):
     SUPPORTED_PROTOS = (IP, IPv6)
 
     def __init__(self, proto, spi, seq_num=1, crypt_algo=None, crypt_key=None,
-                 auth_algo=None, auth_key=None, tunnel_header=None, nat_t_header=None, esn_en=False, esn=0):   # noqa: E501
+                 auth_algo=None, auth_key=None, tunnel_header=None, nat_t_header=None, esn_en=False, esn=0,   # noqa: E501
+                 replay_window=0):
         """
         :param proto: the IPsec proto to use (ESP or AH)
         :param spi: the Security Parameters Index of this SA
@@ -826,6 +924,10 @@ class SecurityAssociation(object):
                        64-bit sequence number instead of 32-bit when using an
                        AEAD algorithm
         :param esn: extended sequence number (32 MSB)
+        :param replay_window: the size of the anti-replay window used to
+                              check the sequence numbers of the decrypted
+                              packets (see RFC 4303, section 3.4.3).
+                              0 disables the check.
         """
 
         if proto not in (ESP, AH, ESP.name, AH.name):
@@ -880,6 +982,116 @@ class SecurityAssociation(object):
                 raise TypeError('nat_t_header must be %s' % UDP.name)
         self.nat_t_header = nat_t_header
 
+        self.replay_window = replay_window
+        # Highest sequence number received (64 bits) and bitmap of the
+        # received sequence numbers, bit 0 being the highest one. The
+        # sequence numbers before the initial one are never valid.
+        self._replay_top = seq_num - 1
+        if esn_en:
+            self._replay_top |= esn << 32
+        self._replay_bitmap = 1
+
+        # Cipher and mac contexts, built with the keys on first use
+        self._crypt_ctx = None
+        self._auth_ctx = None
+
+    def _crypt_context(self):
+        """
+        :returns: the cipher algorithm initialized with the encryption key,
+                  or the key itself if there is no cipher
+        """
+        if not self.crypt_algo.cipher or not self.crypt_key:
+            return self.crypt_key
+        if self._crypt_ctx is None or self._crypt_ctx[0] != self.crypt_key:
+            self._crypt_ctx = (
+                self.crypt_key,
+                self.crypt_algo.new_cipher_algo(self.crypt_key)
+            )
+        return self._crypt_ctx[1]
+
+    def _auth_context(self):
+        """
+        :returns: a mac object initialized with the authentication key, to be
+                  copied for each packet, or the key itself if there is no mac
+        """
+        if not self.auth_algo.mac or self.auth_key is None:
+            return self.auth_key
+        if self._auth_ctx is None or self._auth_ctx[0] != self.auth_key:
+            self._auth_ctx = (
+                self.auth_key,
+                self.auth_algo.new_mac(self.auth_key)
+            )
+        return self._auth_ctx[1]
+
+    def _replay_check(self, seq):
+        """
+        Check a sequence number against the anti-replay window.
+        See RFC 4303, Appendix A.
+
+        :param seq: the sequence number of a received packet (32 LSB)
+        :returns: the sequence number on 64 bits. With ESN, the 32 MSB are
+                  guessed from the window position.
+        :raise scapy.layers.ipsec.IPSecReplayError: if the packet is a
+            replayed or a too old one
+        """
+        window = self.replay_window
+        top = self._replay_top
+        if self.esn_en:
+            top_low = top & 0xffffffff
+            high = top >> 32
+            if top_low >= window - 1:
+                # The window does not wrap: a lower sequence number
+                # belongs to the next subspace
+                if seq < top_low - window + 1:
+                    high += 1
+            elif seq >= (top_low - window + 1) & 0xffffffff:
+                # The window spans two subspaces, and the sequence number
+                # is in the previous one
+                high -= 1
+            if high < 0:
+                raise IPSecReplayError('seq=%d is outside of the window' %
+                                       seq)
+            seq |= high << 32
+        if seq > top:
+            return seq
+        if top - seq >= window:
+            raise IPSecReplayError('seq=%d is outside of the window' % seq)
+        if (self._replay_bitmap >> (top - seq)) & 1:
+            raise IPSecReplayError('seq=%d has already been received' % seq)
+        return seq
+
+    def _replay_update(self, seq):
+        """
+        Mark a sequence number returned by `_replay_check` as received, once
+        the packet has been authenticated.
+        """
+        top = self._replay_top
+        if seq > top:
+            if seq - top >= self.replay_window:
+                self._replay_bitmap = 1
+            else:
+                self._replay_bitmap = ((self._replay_bitmap << (seq - top)) |
+                                       1) & ((1 << self.replay_window) - 1)
+            self._replay_top = seq
+        else:
+            self._replay_bitmap |= 1 << (top - seq)
+
+    def _next_seq(self):
+        """
+        :returns: the (seq, esn) couple to use for the next packet, and
+                  increment the sequence number
+        """
+        seq = self.seq_num
+        if seq > 0xffffffff:
+            if not self.esn_en:
+                raise ValueError('sequence number overflow, the SA must be '
+                                 'rekeyed')
+            # Carry over to the 32 MSB of the extended sequence number
+            self.esn += seq >> 32
+            seq &= 0xffffffff
+        self.seq_num = seq + 1
+        return seq, self.esn
+
     def check_spi(self, pkt):
         if pkt.spi != self.spi:
             raise TypeError('packet spi=0x%x does not match the SA spi=0x%x' %
@@ -893,7 +1105,11 @@ class SecurityAssociation(object):
             if len(iv) != self.crypt_algo.iv_size:
                 raise TypeError('iv length must be %s' % self.crypt_algo.iv_size)  # noqa: E501
 
-        esp = _ESPPlain(spi=self.spi, seq=seq_num or self.seq_num, iv=iv)
+        if seq_num is None:
+            seq = self.seq_num
+        else:
+            seq = seq_num
+        esp = _ESPPlain(spi=self.spi, seq=seq, iv=iv)
 
         if self.tunnel_header:
             tunnel = self.tunnel_header.copy()
@@ -913,11 +1129,11 @@ class SecurityAssociation(object):
         esp.nh = nh
 
         esp = self.crypt_algo.pad(esp)
-        esp = self.crypt_algo.encrypt(self, esp, self.crypt_key,
+        esp = self.crypt_algo.encrypt(self, esp, self._crypt_context(),
                                       esn_en=esn_en or self.esn_en,
                                       esn=esn or self.esn)
 
-        self.auth_algo.sign(esp, self.auth_key)
+        self.auth_algo.sign(esp, self._auth_context())
 
         if self.nat_t_header:
             nat_t_header = self.nat_t_header.copy()
@@ -944,7 +1160,11 @@ class SecurityAssociation(object):
 
     def _encrypt_ah(self, pkt, seq_num=None, esn_en=False, esn=0):
 
-        ah = AH(spi=self.spi, seq=seq_num or self.seq_num,
+        if seq_num is None:
+            seq = self.seq_num
+        else:
+            seq = seq_num
+        ah = AH(spi=self.spi, seq=seq,
                 icv=b"\x00" * self.auth_algo.icv_size)
 
         if self.tunnel_header:
@@ -985,7 +1205,7 @@ class SecurityAssociation(object):
             ip_header.plen = len(ip_header.payload) + len(ah) + len(payload)
 
         signed_pkt = self.auth_algo.sign(ip_header / ah / payload,
-                                         self.auth_key,
+                                         self._auth_context(),
                                          esn_en=esn_en or self.esn_en,
                                          esn=esn or self.esn)
 
@@ -1029,9 +1249,9 @@ class SecurityAssociation(object):
 
         if verify:
             self.check_spi(pkt)
-            self.auth_algo.verify(encrypted, self.auth_key)
+            self.auth_algo.verify(encrypted, self._auth_context())
 
-        esp = self.crypt_algo.decrypt(self, encrypted, self.crypt_key,
+        esp = self.crypt_algo.decrypt(self, encrypted, self._crypt_context(),
                                       self.crypt_algo.icv_size or
                                       self.auth_algo.icv_size,
                                       esn_en=esn_en or self.esn_en,
@@ -1072,7 +1292,7 @@ class SecurityAssociation(object):
 
         if verify:
             self.check_spi(pkt)
-            self.auth_algo.verify(pkt, self.auth_key,
+            self.auth_algo.verify(pkt, self._auth_context(),
                                   esn_en=esn_en or self.esn_en,
                                   esn=esn or self.esn)
 
@@ -1119,9 +1339,243 @@ class SecurityAssociation(object):
                             % (pkt.__class__, self.SUPPORTED_PROTOS))
 
         if self.proto is ESP and pkt.haslayer(ESP):
-            return self._decrypt_esp(pkt, verify=verify,
-                                     esn_en=esn_en, esn=esn)
+            decrypt = self._decrypt_esp
         elif self.proto is AH and pkt.haslayer(AH):
-            return self._decrypt_ah(pkt, verify=verify, esn_en=esn_en, esn=esn)
+            decrypt = self._decrypt_ah
         else:
             raise TypeError('%s has no %s layer' % (pkt, self.proto.name))
+
+        if not verify or not self.replay_window:
+            return decrypt(pkt, verify=verify, esn_en=esn_en, esn=esn)
+
+        self.check_spi(pkt)
+        seq = self._replay_check(pkt[self.proto].seq)
+        if esn is None:
+            esn = seq >> 32
+        ret = decrypt(pkt, verify=verify, esn_en=esn_en, esn=esn)
+        self._replay_update(seq)
+        return ret
+
+    def _outer_header(self):
+        """
+        :returns: the raw (version, header) used to encapsulate the ESP
+                  packets in tunnel mode, including the NAT-Traversal header.
+                  The lengths and the checksum are left to 0.
+        """
+        tunnel = self.tunnel_header.copy()
+        if self.nat_t_header:
+            proto = socket.IPPROTO_UDP
+        else:
+            proto = socket.IPPROTO_ESP
+        if tunnel.version == 4:
+            tunnel.proto = proto
+            tunnel.len = 0
+            tunnel.chksum = 0
+        else:
+            tunnel.nh = proto
+            tunnel.plen = 0
+        return tunnel.version, raw(tunnel)
+
+    def _nat_t_bytes(self, length):
+        """
+        :returns: the raw NAT-Traversal UDP header for a payload of length
+                  bytes
+        """
+        return struct.pack('!HHHH', self.nat_t_header.sport,
+                           self.nat_t_header.dport, length + 8, 0)
+
+    def _encrypt_esp_raw(self, data, iv, outer):
+        """
+        Encrypt a raw IP(v6) packet with ESP.
+
+        :returns: the raw encrypted packet, or None if the packet has to go
+                  through `encrypt`
+        """
+        version = orb(data[0]) >> 4
+        if outer is not None:
+            payload = data
+            nh = socket.IPPROTO_IPIP if version == 4 else socket.IPPROTO_IPV6
+            version, header = outer
+        elif version == 4:
+            ihl = (orb(data[0]) & 0xf) * 4
+            header = data[:ihl]
+            nh = orb(data[9])
+            payload = data[ihl:struct.unpack('!H', data[2:4])[0]]
+        elif version == 6:
+            nh = orb(data[6])
+            if nh in (socket.IPPROTO_HOPOPTS, socket.IPPROTO_ROUTING,
+                      socket.IPPROTO_DSTOPTS):
+                # Let split_for_transport() handle the extension headers
+                return None
+            header = data[:40]
+            payload = data[40:40 + struct.unpack('!H', data[4:6])[0]]
+        else:
+            return None
+
+        seq, esn = self._next_seq()
+        padding = self.crypt_algo.padding(len(payload))
+        esp = struct.pack('!LL', self.spi, seq) + iv
+        esp += self.crypt_algo.encrypt_data(
+            self, self._crypt_context(), self.spi, seq, iv,
+            payload + padding + struct.pack('BB', len(padding), nh),
+            esn_en=self.esn_en, esn=esn
+        )
+        if self.auth_algo.mac:
+            esp += self.auth_algo.compute_icv(esp, self._auth_context())
+
+        if self.nat_t_header:
+            esp = self._nat_t_bytes(len(esp)) + esp
+            proto = socket.IPPROTO_UDP
+        else:
+            proto = socket.IPPROTO_ESP
+        if version == 4:
+            header = (header[:2] + struct.pack('!H', len(header) + len(esp)) +
+                      header[4:9] + chb(proto) + b'\x00\x00' + header[12:])
+            header = (header[:10] + struct.pack('!H', checksum(header)) +
+                      header[12:])
+        else:
+            header = (header[:4] + struct.pack('!HB', len(esp), proto) +
+                      header[7:])
+        return header + esp
+
+    def encrypt_many(self, pkts):
+        """
+        Encrypt (and encapsulate) a list of IP(v6) packets according to this
+        SecurityAssociation, using consecutive sequence numbers.
+
+        ESP packets are processed from their raw bytes, without building
+        intermediate layers. With ESN, the sequence number carries over to
+        the 32 MSB.
+
+        :param pkts: a list of packets or raw IP(v6) packets
+        :returns: the list of the raw encrypted/encapsulated packets
+        """
+        result = []
+        outer = None
+        if self.proto is ESP and self.tunnel_header:
+            if self.tunnel_header.payload:
+                outer = False
+            else:
+                outer = self._outer_header()
+        iv_size = self.crypt_algo.iv_size
+        ivs = os.urandom(iv_size * len(pkts))
+        for i, pkt in enumerate(pkts):
+            data = None
+            if self.proto is ESP and outer is not False:
+                data = self._encrypt_esp_raw(
+                    raw(pkt), ivs[i * iv_size:(i + 1) * iv_size], outer
+                )
+            if data is None:
+                if not isinstance(pkt, Packet):
+                    pkt = (IP if orb(pkt[0]) >> 4 == 4 else IPv6)(pkt)
+                seq, esn = self._next_seq()
+                data = raw(self.encrypt(pkt, seq_num=seq, esn=esn))
+            result.append(data)
+        return result
+
+    def _decrypt_esp_raw(self, data, verify=True):
+        """
+        Decrypt a raw IP(v6) packet containing ESP.
+
+        :returns: the raw decrypted packet, or None if the packet has to go
+                  through `decrypt`
+        """
+        version = orb(data[0]) >> 4
+        if version == 4:
+            ihl = (orb(data[0]) & 0xf) * 4
+            proto = orb(data[9])
+            end = struct.unpack('!H', data[2:4])[0]
+        elif version == 6:
+            ihl = 40
+            proto = orb(data[6])
+            end = 40 + struct.unpack('!H', data[4:6])[0]
+        else:
+            return None
+        offset = ihl
+        if proto == socket.IPPROTO_UDP and self.nat_t_header:
+            offset += 8
+        elif proto != socket.IPPROTO_ESP:
+            return None
+
+        spi, seq = struct.unpack('!LL', data[offset:offset + 8])
+        esn = self.esn
+        if verify:
+            if spi != self.spi:
+                raise TypeError('packet spi=0x%x does not match the SA '
+                                'spi=0x%x' % (spi, self.spi))
+            if self.replay_window:
+                full_seq = self._replay_check(seq)
+                if self.esn_en:
+                    esn = full_seq >> 32
+
+        algo = self.crypt_algo
+        auth_icv_size = self.auth_algo.icv_size if self.auth_algo.mac else 0
+        if verify and auth_icv_size:
+            pkt_icv = data[end - auth_icv_size:end]
+            computed_icv = self.auth_algo.compute_icv(
+                data[offset:end - auth_icv_size], self._auth_context()
+            )
+            if pkt_icv != computed_icv:
+                raise IPSecIntegrityError('pkt_icv=%r, computed_icv=%r' %
+                                          (pkt_icv, computed_icv))
+
+        icv_size = algo.icv_size or auth_icv_size
+        iv = data[offset + 8:offset + 8 + algo.iv_size]
+        icv = data[end - icv_size:end]
+        plain = algo.decrypt_data(
+            self, self._crypt_context(), spi, seq, iv,
+            data[offset + 8 + algo.iv_size:end - icv_size], icv,
+            esn_en=self.esn_en, esn=esn
+        )
+        if verify and self.replay_window:
+            self._replay_update(full_seq)
+
+        padlen = orb(plain[-2])
+        nh = orb(plain[-1])
+        payload = plain[:len(plain) - padlen - 2]
+        if self.tunnel_header:
+            return payload
+        if version == 4:
+            header = (data[:2] + struct.pack('!H', ihl + len(payload)) +
+                      data[4:9] + chb(nh) + b'\x00\x00' + data[12:ihl])
+            header = (header[:10] + struct.pack('!H', checksum(header)) +
+                      header[12:])
+        else:
+            header = (data[:4] + struct.pack('!HB', len(payload), nh) +
+                      data[7:40])
+        return header + payload
+
+    def decrypt_many(self, pkts, verify=True, drop_invalid=False):
+        """
+        Decrypt (and decapsulate) a list of IP(v6) packets containing ESP or
+        AH.
+
+        ESP packets are processed from their raw bytes, without dissecting
+        them.
+
+        :param pkts: a list of packets or raw IP(v6) packets
+        :param verify: if False, do not perform the integrity and anti-replay
+                       checks
+        :param drop_invalid: if True, the packets that fail the integrity or
+                             anti-replay checks are replaced by None in the
+                             result instead of raising an exception
+        :returns: the list of the raw decrypted/decapsulated packets
+        :raise scapy.layers.ipsec.IPSecIntegrityError: if the integrity
+            check fails
+        """
+        result = []
+        for pkt in pkts:
+            try:
+                data = None
+                if self.proto is ESP:
+                    data = self._decrypt_esp_raw(raw(pkt), verify=verify)
+                if data is None:
+                    if not isinstance(pkt, Packet):
+                        pkt = (IP if orb(pkt[0]) >> 4 == 4 else IPv6)(pkt)
+                    data = raw(self.decrypt(pkt, verify=verify))
+            except IPSecIntegrityError:
+                if not drop_invalid:
+                    raise
+                data = None
+            result.append(data)
+        return result
@@ -29,12 +29,18 @@ Using the netflowv9_defragment/ipfix_defragment commands:
 
 """
 
+import array
+import pickle
 import socket
 import struct
+import time
+from collections import OrderedDict
 
+from scapy.compat import raw
 from scapy.config import conf
 from scapy.data import IP_PROTOS
 from scapy.error import warning, Scapy_Exception
+from scapy.extlib import NUMPY, numpy
 from scapy.fields import (
     BitEnumField,
     BitField,
@@ -60,12 +66,15 @@ from scapy.fields import (
     XByteField,
     XShortField,
 )
+from scapy.modules import six
 from scapy.packet import Packet, bind_layers, bind_bottom_up
 from scapy.plist import PacketList
+from scapy.sendrecv import sniff
 from scapy.sessions import IPSession, DefaultSession
+from scapy.supersocket import SimpleSocket
 
-from scapy.layers.inet import UDP
-from scapy.layers.inet6 import IP6Field
+from scapy.layers.inet import IP, UDP
+from scapy.layers.inet6 import IP6Field, IPv6
 
 
 class NetflowHeader(Packet):
@@ -1334,9 +1343,199 @@ class _CustomStrFixedLenField(StrFixedLenField):
 def _GenNetflowRecordV9(cls, lengths_list):
     """Internal function used to generate the Records from
     their template.
+
+    The generated classes are cached by field layout, so that identical
+    templates share the same class.
+    """
+    return _GetNetflowTemplateV9(cls, lengths_list).cls
+
+
+_Field_getfield = six.get_unbound_function(Field.getfield)
+_Field_m2i = six.get_unbound_function(Field.m2i)
+
+
+class _NetflowTemplateV9(object):
+    """Internal class: a NetflowV9/10 template, holding the record class
+    generated from it, and a pre-compiled struct that decodes all the
+    records of a DataFlowset at once.
+    """
+    __slots__ = ["cls", "length", "names", "types", "codes", "fmt",
+                 "converters", "exact", "_columns", "_structs"]
+
+    # struct codes of the integers, by size in bytes
+    _INT_FMT = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+    def __init__(self, cls, lengths_list):
+        self.cls = _NewNetflowRecordV9(cls, lengths_list)
+        self.length = sum(x[0] for x in lengths_list)
+        self.names = [f.name for f in self.cls.fields_desc]
+        self.types = [x[1] for x in lengths_list]
+        # The struct code of each field
+        self.codes = []
+        # (index, m2i) of the values that need to be converted
+        self.converters = []
+        # Whether the decoded values are exactly what the fields would
+        # dissect, so that records can be created from them
+        self.exact = True
+        fmt = ""
+        for i, (f, (length, _)) in enumerate(zip(self.cls.fields_desc,
+                                                 lengths_list)):
+            if isinstance(f, StrFixedLenField):
+                fmt += "%ds" % length
+                self.codes.append("%ds" % length)
+                self.exact &= (f.length_from(None) == length)
+                continue
+            code = f.fmt[1:]
+            if six.get_unbound_function(type(f).getfield) is not \
+                    _Field_getfield:
+                # e.g. ThreeBytesField: its format isn't what it dissects
+                code = None
+            elif code[-1:] in "bBhHiIlLqQ":
+                # Integers: always use the length from the template
+                self.exact &= (struct.calcsize(f.fmt) == length)
+                code = self._INT_FMT.get(length)
+            elif struct.calcsize(f.fmt) != length:
+                code = None
+            if code is None:
+                fmt += "%ds" % length
+                self.codes.append("%ds" % length)
+                self.exact = False
+                continue
+            fmt += code
+            self.codes.append(code)
+            if six.get_unbound_function(type(f).m2i) is not _Field_m2i:
+                self.converters.append((i, f.m2i))
+        self.fmt = fmt
+        self._columns = None
+        # Pre-compiled structs, by number of records
+        self._structs = {}
+
+    def _compile_columns(self):
+        """Compiles the layout used by unpack_columns()"""
+        fmt = ""
+        columns = []
+        converters = dict(self.converters)
+        for i, (f, ftype, code) in enumerate(zip(self.cls.fields_desc,
+                                                 self.types, self.codes)):
+            length = struct.calcsize("!" + code)
+            if ftype == 210:  # paddingOctets
+                fmt += "%dx" % length
+                continue
+            m2i = converters.get(i)
+            if isinstance(f, _CustomStrFixedLenField) and \
+                    length in self._INT_FMT:
+                # Unknown fields: most of them are counters
+                code = self._INT_FMT[length]
+            fmt += code
+            columns.append((f.name, code if code in "BHIQ" else None, m2i))
+        self._columns = (fmt, columns)
+
+    def unpack_columns(self, data):
+        """Decodes all the records in data, column by column.
+
+        Returns the number of records, and a list of (name, code, values)
+        for each column: code is the struct code of the integer columns,
+        None otherwise. The fields of unknown types that fit in an integer
+        are decoded as unsigned integers, and the padding is skipped.
+        """
+        if self._columns is None:
+            self._compile_columns()
+        fmt, columns = self._columns
+        count = len(data) // self.length if self.length else 0
+        if not count or not columns:
+            return 0, []
+        key = (count, True)
+        try:
+            st = self._structs[key]
+        except KeyError:
+            st = self._structs[key] = struct.Struct("!" + fmt * count)
+        values = st.unpack_from(data)
+        width = len(columns)
+        return count, [
+            (name, code, values[i::width] if m2i is None else
+             [m2i(None, x) for x in values[i::width]])
+            for i, (name, code, m2i) in enumerate(columns)
+        ]
+
+    def unpack(self, data):
+        """Decodes all the records in data. Returns the list of the tuples
+        of their values, in the order of self.names"""
+        if not self.length:
+            return []
+        count = len(data) // self.length
+        if not count:
+            return []
+        try:
+            st = self._structs[count]
+        except KeyError:
+            st = self._structs[count] = struct.Struct(
+                "!" + self.fmt * count
+            )
+        values = st.unpack_from(data)
+        width = len(self.names)
+        if self.converters:
+            values = list(values)
+            for i, m2i in self.converters:
+                values[i::width] = [m2i(None, x) for x in values[i::width]]
+        return [tuple(values[i:i + width])
+                for i in range(0, len(values), width)]
+
+    def records(self, data):
+        """Returns the list of the records in data"""
+        length = self.length
+        cls = self.cls
+        if not length:
+            return []
+        if not self.exact:
+            return [cls(data[i:i + length])
+                    for i in range(0, len(data) - length + 1, length)]
+        res = []
+        names = self.names
+        for i, values in enumerate(self.unpack(data)):
+            rec = cls()
+            rec.fields = dict(zip(names, values))
+            rec.raw_packet_cache = data[i * length:(i + 1) * length]
+            rec.raw_packet_cache_fields = {}
+            rec.explicit = 1
+            res.append(rec)
+        return res
+
+
+# Cache of the templates, by (class, field layout)
+_netflow_templates_cache = OrderedDict()
+_NETFLOW_TEMPLATES_CACHE_SIZE = 4096
+
+
+def _GetNetflowTemplateV9(cls, lengths_list):
+    """Internal function used to get the _NetflowTemplateV9 for a field
+    layout, from the cache if possible."""
+    key = (cls, tuple(lengths_list))
+    try:
+        tmpl = _netflow_templates_cache.pop(key)
+    except KeyError:
+        tmpl = _NetflowTemplateV9(cls, lengths_list)
+        if len(_netflow_templates_cache) >= _NETFLOW_TEMPLATES_CACHE_SIZE:
+            _netflow_templates_cache.popitem(last=False)
+    _netflow_templates_cache[key] = tmpl
+    return tmpl
+
+
+def _NewNetflowRecordV9(cls, lengths_list):
+    """Internal function used to generate the Records from
+    their template.
     """
     _fields_desc = []
+    _names = set()
     for j, k in lengths_list:
+        # The same field type can be used several times
+        _f_name = NetflowV910TemplateFieldTypes.get(k, "unknown_data")
+        _i = 1
+        while _f_name in _names:
+            _f_name = "%s_%d" % (
+                NetflowV910TemplateFieldTypes.get(k, "unknown_data"), _i
+            )
+            _i += 1
+        _names.add(_f_name)
         _f_data = NetflowV9TemplateFieldDecoders.get(k, None)
         _f_type, _f_args = (
             _f_data if isinstance(_f_data, tuple) else (_f_data, [])
@@ -1346,17 +1545,11 @@ def _GenNetflowRecordV9(cls, lengths_list):
             if issubclass(_f_type, _AdjustableNetflowField):
                 _f_kwargs["length"] = j
             _fields_desc.append(
-                _f_type(
-                    NetflowV910TemplateFieldTypes.get(k, "unknown_data"),
-                    0, *_f_args, **_f_kwargs
-                )
+                _f_type(_f_name, 0, *_f_args, **_f_kwargs)
             )
         else:
             _fields_desc.append(
-                _CustomStrFixedLenField(
-                    NetflowV910TemplateFieldTypes.get(k, "unknown_data"),
-                    b"", length=j
-                )
+                _CustomStrFixedLenField(_f_name, b"", length=j)
             )
 
     # This will act exactly like a NetflowRecordV9, but has custom fields
@@ -1439,8 +1632,32 @@ class NetflowDataflowsetV9(Packet):
         return pkt + pay
 
 
-def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
-    """Used internally to process a single packet during defragmenting"""
+def _netflowv9_source(pkt):
+    """Internal function: returns the (exporter address, observation domain)
+    of a NetflowV9/10 packet, that scope its template IDs"""
+    if IP in pkt:
+        exporter = pkt[IP].src
+    elif IPv6 in pkt:
+        exporter = pkt[IPv6].src
+    else:
+        exporter = None
+    if NetflowHeaderV9 in pkt:
+        return exporter, pkt[NetflowHeaderV9].SourceID
+    if NetflowHeaderV10 in pkt:
+        return exporter, pkt[NetflowHeaderV10].ObservationDomainID
+    return exporter, None
+
+
+def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored,
+                                 source=None, decoder=None):
+    """Used internally to process a single packet during defragmenting.
+
+    The templates are stored by (exporter address, observation domain,
+    templateID). If a decoder is provided, it is called with the template
+    and the data of each DataFlowset, instead of dissecting its records.
+    """
+    if source is None:
+        source = _netflowv9_source(pkt)
     # Dataflowset definitions
     if NetflowFlowsetV9 in pkt:
         current = pkt
@@ -1451,9 +1668,9 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
                 for tmpl in ntv9.template_fields:
                     llist.append((tmpl.fieldLength, tmpl.fieldType))
                 if llist:
-                    tot_len = sum(x[0] for x in llist)
-                    cls = _GenNetflowRecordV9(NetflowRecordV9, llist)
-                    definitions[ntv9.templateID] = (tot_len, cls)
+                    definitions[source + (ntv9.templateID,)] = (
+                        _GetNetflowTemplateV9(NetflowRecordV9, llist)
+                    )
             current = current.payload
     # Options definitions
     if NetflowOptionsFlowsetV9 in pkt:
@@ -1467,8 +1684,7 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
                     scope.scopeFieldlength,
                     scope.scopeFieldType
                 ))
-            scope_tot_len = sum(x[0] for x in llist)
-            scope_cls = _GenNetflowRecordV9(
+            scope_tmpl = _GetNetflowTemplateV9(
                 NetflowOptionsRecordScopeV9,
                 llist
             )
@@ -1479,15 +1695,13 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
                     opt.optionFieldlength,
                     opt.optionFieldType
                 ))
-            option_tot_len = sum(x[0] for x in llist)
-            option_cls = _GenNetflowRecordV9(
+            option_tmpl = _GetNetflowTemplateV9(
                 NetflowOptionsRecordOptionV9,
                 llist
             )
             # Storage
-            definitions_opts[current.templateID] = (
-                scope_tot_len, scope_cls,
-                option_tot_len, option_cls
+            definitions_opts[source + (current.templateID,)] = (
+                scope_tmpl, option_tmpl
             )
             current = current.payload
     # Dissect flowsets
@@ -1495,9 +1709,9 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
         current = pkt
         while NetflowDataflowsetV9 in current:
             datafl = current[NetflowDataflowsetV9]
-            tid = datafl.templateID
+            tid = source + (datafl.templateID,)
             if tid not in definitions and tid not in definitions_opts:
-                ignored.add(tid)
+                ignored.add(datafl.templateID)
                 return
             # All data is stored in one record, awaiting to be split
             # If fieldValue is available, the record has not been
@@ -1512,10 +1726,15 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
             # Now, according to the flow/option data,
             # let's re-dissect NetflowDataflowsetV9
             if tid in definitions:
-                tot_len, cls = definitions[tid]
-                while len(data) >= tot_len:
-                    res.append(cls(data[:tot_len]))
-                    data = data[tot_len:]
+                tmpl = definitions[tid]
+                if decoder is not None:
+                    decoder(tmpl, data)
+                    current = datafl.payload
+                    continue
+                if tmpl.length:
+                    end = len(data) - len(data) % tmpl.length
+                    res = tmpl.records(data[:end])
+                    data = data[end:]
                 # Inject dissected data
                 datafl.records = res
                 if data:
@@ -1525,14 +1744,17 @@ def _netflowv9_defragment_packet(pkt, definitions, definitions_opts, ignored):
                         datafl.do_dissect_payload(data)
             # Options
             elif tid in definitions_opts:
-                (scope_len, scope_cls,
-                    option_len, option_cls) = definitions_opts[tid]
+                scope_tmpl, option_tmpl = definitions_opts[tid]
+                scope_len = scope_tmpl.length
+                option_len = option_tmpl.length
                 # Dissect scopes
                 if scope_len:
-                    res.append(scope_cls(data[:scope_len]))
+                    res.append(scope_tmpl.cls(data[:scope_len]))
                 if option_len:
                     res.append(
-                        option_cls(data[scope_len:scope_len + option_len])
+                        option_tmpl.cls(
+                            data[scope_len:scope_len + option_len]
+                        )
                     )
                 if len(data) > scope_len + option_len:
                     res.append(
@@ -1578,6 +1800,10 @@ def ipfix_defragment(*args, **kwargs):
 class NetflowSession(IPSession):
     """Session used to defragment NetflowV9/10 packets on the flow.
     See help(scapy.layers.netflow) for more infos.
+
+    The templates are stored by (exporter address, observation domain,
+    templateID), and the record classes generated from identical templates
+    are shared.
     """
     def __init__(self, *args, **kwargs):
         IPSession.__init__(self, *args, **kwargs)
@@ -1719,3 +1945,314 @@ bind_layers(NetflowFlowsetV9, NetflowDataflowsetV9)
 # https://tools.ietf.org/html/rfc5655#appendix-B.1.2
 bind_layers(NetflowHeader, NetflowHeaderV10, version=10)
 bind_layers(NetflowHeaderV10, NetflowDataflowsetV9)
+
+
+###########################################
+# Netflow collector
+###########################################
+
+# The NetflowV5 record, as a NetflowV9 template. It is used to decode the
+# NetflowV5 records with the same columns as their NetflowV9 counterparts
+_NETFLOW_V5_LAYOUT = [
+    (4, 8),  # IPV4_SRC_ADDR
+    (4, 12),  # IPV4_DST_ADDR
+    (4, 15),  # IPV4_NEXT_HOP
+    (2, 10),  # INPUT_SNMP
+    (2, 14),  # OUTPUT_SNMP
+    (4, 2),  # IN_PKTS
+    (4, 1),  # IN_BYTES
+    (4, 22),  # FIRST_SWITCHED
+    (4, 21),  # LAST_SWITCHED
+    (2, 7),  # L4_SRC_PORT
+    (2, 11),  # L4_DST_PORT
+    (1, 210),  # paddingOctets
+    (1, 6),  # TCP_FLAGS
+    (1, 4),  # PROTOCOL
+    (1, 5),  # TOS
+    (2, 16),  # SRC_AS
+    (2, 17),  # DST_AS
+    (1, 9),  # SRC_MASK
+    (1, 13),  # DST_MASK
+    (2, 210),  # paddingOctets
+]
+
+
+def _array_typecode(code):
+    """Returns the array typecode matching a struct integer code"""
+    size = struct.calcsize(code)
+    for typecode in "BHILQ":
+        try:
+            if array.array(typecode).itemsize == size:
+                return typecode
+        except ValueError:
+            # 'Q' is not available on Python 2
+            pass
+    raise ValueError("No array typecode for %r" % code)
+
+
+_ARRAY_TYPECODES = dict((code, _array_typecode(code)) for code in "BHIQ")
+
+
+class NetflowBatch(object):
+    """Flow records, stored by column.
+
+    ``columns`` maps the name of each field to the sequence of its values:
+    an ``array.array`` for the integers, a list otherwise, or NumPy arrays
+    once to_numpy() was called. The ``exporter`` and ``time`` columns hold
+    the address of the exporter, and the reception time, of each record.
+    """
+    __slots__ = ["columns", "count"]
+
+    def __init__(self, columns):
+        self.count = 0
+        self.columns = OrderedDict()
+        self.columns["exporter"] = []
+        self.columns["time"] = array.array("d")
+        for name, code, _ in columns:
+            if code is None:
+                self.columns[name] = []
+            else:
+                self.columns[name] = array.array(_ARRAY_TYPECODES[code])
+
+    def extend(self, count, columns, exporter, now):
+        """Adds <count> records, decoded by unpack_columns()"""
+        self.count += count
+        self.columns["exporter"].extend([exporter] * count)
+        self.columns["time"].extend([now] * count)
+        for name, _, values in columns:
+            self.columns[name].extend(values)
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return "<NetflowBatch: %d records, %d columns>" % (
+            self.count, len(self.columns)
+        )
+
+    def to_numpy(self):
+        """Converts the columns to NumPy arrays. The integer columns are not
+        copied."""
+        if not NUMPY:
+            raise Scapy_Exception("NumPy is not available !")
+        for name, values in six.iteritems(self.columns):
+            if isinstance(values, array.array):
+                self.columns[name] = numpy.frombuffer(
+                    values, dtype=numpy.dtype(values.typecode)
+                )
+            elif not isinstance(values, numpy.ndarray):
+                self.columns[name] = numpy.array(values)
+        return self
+
+    @staticmethod
+    def read_file(filename):
+        """Iterates over the batches stored in a file by NetflowCollector"""
+        with open(filename, "rb") as fd:
+            while True:
+                try:
+                    yield pickle.load(fd)
+                except EOFError:
+                    return
+
+    def __getstate__(self):
+        return self.count, self.columns
+
+    def __setstate__(self, state):
+        self.count, self.columns = state
+
+
+class NetflowCollector(NetflowSession):
+    """Session that decodes the records of NetflowV5/V9/10 (IPFix) packets
+    into columnar batches, rather than into packets.
+
+    The records are grouped by template in NetflowBatch objects, that are
+    flushed every ``batch_size`` records, or every ``flush_interval``
+    seconds (compared to the timestamps of the packets, when they are
+    received). The batches are given to ``callback``, and/or appended to
+    ``filename`` (see NetflowBatch.read_file()).
+
+    As ``flush_interval`` is only checked when a packet is received, an
+    idle collector keeps its pending records until it is closed (which
+    sniff() does when it stops).
+
+    The packets are also stored, as with any session, unless ``store`` is
+    False: sniff() stores them by default.
+
+    >>> sniff(offline="netflow.pcap", session=NetflowCollector, store=False,
+    ...       session_kwargs={"callback": print})
+
+    See netflow_collect() to listen on a UDP port.
+
+    :param callback: a function called with each NetflowBatch
+    :param filename: a file where the batches are appended (pickled)
+    :param batch_size: the number of records that triggers a flush
+    :param flush_interval: the time (in s) after which the records are
+                           flushed. None to disable.
+    :param use_numpy: convert the batches to NumPy arrays before flushing
+                      them. Default: if NumPy is available.
+    """
+
+    def __init__(self, *args, **kwargs):
+        callback = kwargs.pop("callback", None)
+        filename = kwargs.pop("filename", None)
+        batch_size = kwargs.pop("batch_size", 65536)
+        flush_interval = kwargs.pop("flush_interval", 10)
+        use_numpy = kwargs.pop("use_numpy", None)
+        NetflowSession.__init__(self, *args, **kwargs)
+        self.callback = callback
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        if use_numpy is None:
+            use_numpy = NUMPY
+        elif use_numpy and not NUMPY:
+            raise Scapy_Exception("NumPy is not available !")
+        self.use_numpy = use_numpy
+        # The batches being filled, by template
+        self.batches = OrderedDict()
+        self.pending = 0
+        self.last_flush = None
+        # The number of records that were flushed
+        self.records = 0
+        self._fd = None
+
+    def _add_records(self, tmpl, data, exporter, now):
+        count, columns = tmpl.unpack_columns(data)
+        if not count:
+            return
+        batch = self.batches.get(tmpl)
+        if batch is None:
+            batch = self.batches[tmpl] = NetflowBatch(columns)
+        batch.extend(count, columns, exporter, now)
+        self.pending += count
+
+    def _process_packet(self, pkt):
+        if UDP not in pkt:
+            return pkt
+        data = raw(pkt[UDP].payload)
+        if len(data) < 4:
+            return pkt
+        if IP in pkt:
+            exporter = pkt[IP].src
+        elif IPv6 in pkt:
+            exporter = pkt[IPv6].src
+        else:
+            exporter = None
+        now = float(pkt.time)
+        if self.last_flush is None:
+            self.last_flush = now
+        version, count = struct.unpack("!HH", data[:4])
+        if version == 5:
+            self._add_records(_NETFLOW_V5_TEMPLATE,
+                              data[24:24 + count * 48], exporter, now)
+        elif version in [9, 10]:
+            pkt = NetflowHeader(data)
+            _netflowv9_defragment_packet(
+                pkt, self.definitions, self.definitions_opts, self.ignored,
+                source=(exporter, _netflowv9_source(pkt)[1]),
+                decoder=lambda tmpl, records: self._add_records(
+                    tmpl, records, exporter, now
+                )
+            )
+        if self.pending >= self.batch_size or (
+                self.flush_interval is not None and
+                now - self.last_flush >= self.flush_interval):
+            self.flush(now)
+        return pkt
+
+    def on_packet_received(self, pkt):
+        if not pkt:
+            return
+        # First, defragment IP if necessary
+        pkt = self._ip_process_packet(pkt)
+        if pkt is None:
+            return
+        self._process_packet(pkt)
+        DefaultSession.on_packet_received(self, pkt)
+
+    def flush(self, now=None):
+        """Flushes the pending batches"""
+        batches = list(six.itervalues(self.batches))
+        self.batches.clear()
+        self.records += self.pending
+        self.pending = 0
+        self.last_flush = time.time() if now is None else now
+        for batch in batches:
+            if self.use_numpy:
+                batch.to_numpy()
+            if self.filename is not None:
+                if self._fd is None:
+                    self._fd = open(self.filename, "ab")
+                pickle.dump(batch, self._fd, 2)
+            if self.callback is not None:
+                self.callback(batch)
+
+    def close(self):
+        """Flushes the pending batches and closes the file"""
+        self.flush()
+        if self._fd is not None:
+            self._fd.close()
+            self._fd = None
+
+    def toPacketList(self):
+        self.close()
+        return NetflowSession.toPacketList(self)
+
+
+_NETFLOW_V5_TEMPLATE = _GetNetflowTemplateV9(NetflowRecordV9,
+                                             _NETFLOW_V5_LAYOUT)
+
+
+class NetflowSocket(SimpleSocket):
+    """A UDP socket that receives NetflowV5/V9/10 exports. The packets are
+    returned as IP/UDP/Raw, the IP and UDP layers being rebuilt from the
+    address of the exporter."""
+    desc = "receives Netflow exports on a UDP socket"
+
+    def __init__(self, port=2055, address=""):
+        self.family = socket.AF_INET6 if ":" in address else socket.AF_INET
+        self.port = port
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        sock.bind((address, port))
+        SimpleSocket.__init__(self, sock)
+
+    def recv(self, x=65535):
+        data, addr = self.ins.recvfrom(x)
+        ip = IPv6 if self.family == socket.AF_INET6 else IP
+        pkt = ip(src=addr[0]) / UDP(sport=addr[1], dport=self.port) / \
+            conf.raw_layer(load=data)
+        pkt.time = time.time()
+        return pkt
+
+
+@conf.commands.register
+def netflow_collect(port=2055, address="", callback=None, filename=None,
+                    batch_size=65536, flush_interval=10, use_numpy=None,
+                    **kargs):
+    """Listens for NetflowV5/V9/10 (IPFix) exports on a UDP port, and
+    decodes their records into columnar batches.
+
+    :param port: the UDP port to listen on
+    :param address: the address to bind to
+    :param callback: a function called with each NetflowBatch
+    :param filename: a file where the batches are appended
+    :param batch_size: the number of records that triggers a flush
+    :param flush_interval: the time (in s) after which the records are
+                           flushed
+    :param use_numpy: convert the batches to NumPy arrays
+    :param kargs: the other arguments are passed to sniff() (count,
+                  timeout, stop_filter...)
+    :returns: the NetflowCollector
+
+    >>> netflow_collect(callback=lambda b: print(b.columns["IN_BYTES"]))
+    """
+    collector = NetflowCollector(callback=callback, filename=filename,
+                                 batch_size=batch_size,
+                                 flush_interval=flush_interval,
+                                 use_numpy=use_numpy)
+    sock = NetflowSocket(port=port, address=address)
+    try:
+        sniff(opened_socket=sock, session=collector, store=False, **kargs)
+    finally:
+        sock.close()
+    return collector
@@ -20,5 +20,6 @@ from scapy.layers.tls.record import *  # noqa: F401
 from scapy.layers.tls.record_sslv2 import *  # noqa: F401
 from scapy.layers.tls.record_tls13 import *  # noqa: F401
 from scapy.layers.tls.session import *  # noqa: F401
+from scapy.layers.tls.offline import *  # noqa: F401
 
 from scapy.layers.tls.crypto.all import *  # noqa: F401
@@ -0,0 +1,456 @@
+# This file is part of Scapy
+# See http://www.secdev.org/projects/scapy for more information
+# This program is published under a GPLv2 license
+
+"""
+Offline decryption of the TLS application data found in captures.
+
+Unlike TLSSession, which dissects every record of every packet, only the
+handshake records are dissected here: the application data records are
+split from the reassembled TCP streams and decrypted directly with the
+cipher of the reading connState.
+"""
+
+import socket
+import struct
+import zlib
+from collections import OrderedDict
+
+from scapy.compat import orb
+from scapy.config import conf
+from scapy.error import log_runtime
+from scapy.modules import six
+from scapy.packet import Packet
+from scapy.pton_ntop import inet_ntop, inet_pton
+from scapy.utils import RawPcapReader
+from scapy.layers.inet import IP, TCP
+from scapy.layers.inet6 import IPv6
+from scapy.layers.tls.crypto.cipher_aead import AEADTagError
+from scapy.layers.tls.crypto.common import CipherError
+from scapy.layers.tls.session import tlsSession, load_nss_keys
+
+
+def tls_decrypt_fragment(tls_session, rec):
+    """
+    Decrypts the TLSCiphertext rec (header included) using the current
+    reading state of tls_session, and returns the TLSPlaintext fragment,
+    or None if it could not be decrypted (e.g. the keys are missing).
+
+    This is the logic of TLS.pre_dissect() without the dissection: the
+    cipher of the connState is reused from one record to the next, and the
+    MAC of block and stream ciphers is not verified (AEAD ciphers still
+    check their tag, and a failure is logged as in TLS.pre_dissect()).
+    """
+    rcs = tls_session.rcs
+    cipher = rcs.cipher
+    mac_len = rcs.mac_len
+    hdr, efrag = rec[:5], rec[5:]
+    seq_num = struct.pack("!Q", rcs.seq_num)
+    rcs.seq_num += 1
+    try:
+        if cipher.type == "aead":
+            try:
+                frag = cipher.auth_decrypt(seq_num + hdr[:3], efrag,
+                                           seq_num)[-2]
+            except AEADTagError as e:
+                log_runtime.info("TLS: record integrity check failed")
+                frag = e.args[-2]
+        elif cipher.type == "block":
+            if tls_session.encrypt_then_mac and mac_len:
+                efrag = efrag[:-mac_len]
+            if struct.unpack("!H", hdr[1:3])[0] >= 0x0302:
+                # Explicit IV for TLS 1.1 and 1.2
+                cipher.iv = efrag[:cipher.block_size]
+                efrag = efrag[cipher.block_size:]
+            pfrag = cipher.decrypt(efrag)
+            frag = pfrag[:-orb(pfrag[-1]) - 1]
+            if not tls_session.encrypt_then_mac and mac_len:
+                frag = frag[:-mac_len]
+        else:
+            frag = cipher.decrypt(efrag)
+            if mac_len:
+                frag = frag[:-mac_len]
+    except CipherError:
+        return None
+    return rcs.compression.decompress(frag)
+
+
+class _TLSHalfStream(object):
+    """The reassembly of one direction of a TCP connection"""
+    __slots__ = ["seq", "segments", "buf", "closed"]
+
+    def __init__(self):
+        self.seq = None
+        # {seq: payload} of the segments received out of order
+        self.segments = {}
+        self.buf = b""
+        self.closed = False
+
+    def feed(self, seq, data):
+        """Returns the payload made contiguous by the segment"""
+        if self.seq is None:
+            self.seq = seq
+        delta = (seq - self.seq) & 0xffffffff
+        if delta & 0x80000000:
+            # Retransmitted, at least partially
+            delta -= 1 << 32
+            if len(data) <= -delta:
+                return b""
+            data, delta = data[-delta:], 0
+        if delta:
+            if len(data) > len(self.segments.get(seq, b"")):
+                self.segments[seq] = data
+            return b""
+        res = [data]
+        self.seq = (self.seq + len(data)) & 0xffffffff
+        while self.segments:
+            for seq, data in list(self.segments.items()):
+                delta = (seq - self.seq) & 0xffffffff
+                if delta & 0x80000000:
+                    del self.segments[seq]
+                    delta = (1 << 32) - delta
+                    if len(data) > delta:
+                        break
+                elif delta == 0:
+                    del self.segments[seq]
+                    break
+            else:
+                break
+            res.append(data[delta:])
+            self.seq = (self.seq + len(data) - delta) & 0xffffffff
+        return b"".join(res)
+
+
+class _TLSConnection(object):
+    __slots__ = ["name", "client", "session", "reading", "halves"]
+
+    def __init__(self, name, client, keys):
+        # name is (client IP, client port, server IP, server port)
+        self.name = name
+        # The raw (address, port) of the client
+        self.client = client
+        self.session = tlsSession(ipsrc=name[0], sport=name[1],
+                                  ipdst=name[2], dport=name[3])
+        self.session.nss_keys = keys
+        # A fresh session reads what the client writes
+        self.reading = "client"
+        self.halves = {"client": _TLSHalfStream(),
+                       "server": _TLSHalfStream()}
+
+
+def _tls_tcp_segment(linktype, data):
+    """
+    Returns (src, dst, sport, dport, seq, flags, payload) from the raw
+    frame data, without dissecting it, or None if it is not a TCP segment.
+    The addresses are returned as bytes.
+    """
+    off = 0
+    if linktype == 1:  # Ethernet
+        if len(data) < 14:
+            return None
+        off, etype = 14, struct.unpack_from("!H", data, 12)[0]
+        while etype in (0x8100, 0x88a8) and len(data) >= off + 4:
+            etype = struct.unpack_from("!H", data, off + 2)[0]
+            off += 4
+        if etype not in (0x0800, 0x86dd):
+            return None
+    elif linktype == 113:  # Linux cooked capture
+        off = 16
+    elif linktype in (0, 108):  # Null/loopback
+        off = 4
+    elif linktype not in (12, 14, 101):  # Raw IP
+        return _tls_tcp_segment_slow(linktype, data)
+    if len(data) < off + 20:
+        return None
+    version = orb(data[off]) >> 4
+    if version == 4:
+        ihl = (orb(data[off]) & 0xf) * 4
+        tot_len, frag, proto = struct.unpack_from("!H2xHxB", data, off + 2)
+        if proto != 6 or frag & 0x3fff:
+            # Not TCP, or a fragment
+            return None
+        src = bytes(data[off + 12:off + 16])
+        dst = bytes(data[off + 16:off + 20])
+        end = off + tot_len
+        off += ihl
+    elif version == 6:
+        if len(data) < off + 40:
+            return None
+        plen, nh = struct.unpack_from("!HB", data, off + 4)
+        src = bytes(data[off + 8:off + 24])
+        dst = bytes(data[off + 24:off + 40])
+        end = off + 40 + plen
+        off += 40
+        # Hop-by-hop, routing and destination options headers
+        while nh in (0, 43, 60) and len(data) >= off + 8:
+            nh, hlen = orb(data[off]), orb(data[off + 1])
+            off += (hlen + 1) * 8
+        if nh != 6:
+            return None
+    else:
+        return None
+    if len(data) < off + 20:
+        return None
+    sport, dport, seq = struct.unpack_from("!HHI", data, off)
+    flags = orb(data[off + 13])
+    payload = bytes(data[off + (orb(data[off + 12]) >> 4) * 4:end])
+    return src, dst, sport, dport, seq, flags, payload
+
+
+def _tls_tcp_segment_slow(linktype, data):
+    """_tls_tcp_segment() for the link types it does not know about"""
+    cls = conf.l2types.num2layer.get(linktype)
+    if cls is None:
+        return None
+    return _tls_tcp_segment_pkt(cls(bytes(data)))
+
+
+def _tls_tcp_segment_pkt(pkt):
+    """_tls_tcp_segment() for a dissected packet"""
+    if TCP not in pkt:
+        return None
+    if IP in pkt:
+        ip = pkt[IP]
+        if ip.flags.MF or ip.frag:
+            return None
+        src, dst = socket.inet_aton(ip.src), socket.inet_aton(ip.dst)
+    elif IPv6 in pkt:
+        ip = pkt[IPv6]
+        src = inet_pton(socket.AF_INET6, ip.src)
+        dst = inet_pton(socket.AF_INET6, ip.dst)
+    else:
+        return None
+    tcp = pkt[TCP]
+    # Building the payload again could encrypt the TLS records with another
+    # state: use the dissected bytes when available
+    payload = getattr(tcp.payload, "original", None) or bytes(tcp.payload)
+    return (src, dst, tcp.sport, tcp.dport, tcp.seq, int(tcp.flags),
+            payload)
+
+
+def _tls_ntop(addr):
+    if len(addr) == 4:
+        return socket.inet_ntoa(addr)
+    return inet_ntop(socket.AF_INET6, addr)
+
+
+class TLSDecryptor(object):
+    """
+    Decrypts the application data of the TLS (SSLv3 to TLS 1.2) connections
+    of a capture, using the master secrets of a NSS Keys Log.
+
+    The TCP segments of each connection are reassembled, then split into
+    records. The handshake records are dissected, in order to negotiate the
+    keys, while the application data records are decrypted directly.
+
+    >>> d = TLSDecryptor("keys.txt")
+    >>> for pkt in PcapReader("capture.pcap"):
+    ...     for conn, direction, data in d.process(pkt):
+    ...         print(conn, direction, data)
+
+    :param keys: a NSSKeyLog, or the name of a NSS Keys Log. Default:
+        conf.tls_nss_keys or conf.tls_nss_filename
+    :param max_connections: the number of connections kept at the same time.
+        The least recently active connections are dropped beyond.
+    :param partition: (index, count). Only handle the connections for which
+        the hash of the endpoints is index, modulo count.
+    """
+
+    def __init__(self, keys=None, max_connections=10000, partition=None):
+        if isinstance(keys, six.string_types):
+            keys = load_nss_keys(keys)
+        self.keys = keys
+        self.max_connections = max_connections
+        self.partition = partition
+        # {sorted endpoints: _TLSConnection or None}
+        # None marks the connections that are not handled
+        self.connections = OrderedDict()
+        self.dropped = 0
+
+    def _get_keys(self):
+        if self.keys is None:
+            if conf.tls_nss_keys is None and \
+                    conf.tls_nss_filename is not None:
+                conf.tls_nss_keys = load_nss_keys(conf.tls_nss_filename)
+            return conf.tls_nss_keys
+        return self.keys
+
+    def _connection(self, key, src, dst, sport, dport, flags):
+        if key in self.connections:
+            conn = self.connections.pop(key)
+            self.connections[key] = conn
+            return conn
+        if self.partition is not None:
+            index, count = self.partition
+            if zlib.crc32(b"".join(key[0] + key[1])) % count != index:
+                self.connections[key] = None
+                return None
+        # The client sends the SYN, or else the first data
+        if flags & 0x12 == 0x12:
+            src, dst, sport, dport = dst, src, dport, sport
+        conn = _TLSConnection((_tls_ntop(src), sport, _tls_ntop(dst), dport),
+                              (src, struct.pack("!H", sport)),
+                              self._get_keys())
+        self.connections[key] = conn
+        if self.max_connections is not None:
+            while len(self.connections) > self.max_connections:
+                self.connections.popitem(last=False)
+                self.dropped += 1
+        return conn
+
+    def process_segment(self, src, dst, sport, dport, seq, flags, payload):
+        """
+        Handles a TCP segment. The addresses are given as bytes.
+
+        :returns: a list of (connection, direction, data), where connection
+            is (client IP, client port, server IP, server port), direction
+            is "client" or "server" and data is the decrypted application
+            data sent in that direction.
+        """
+        end = (src, struct.pack("!H", sport))
+        ends = [end, (dst, struct.pack("!H", dport))]
+        ends.sort()
+        key = tuple(ends)
+        if flags & 0x04:  # RST
+            self.connections.pop(key, None)
+            return []
+        if not payload and not flags & 0x03 and key not in self.connections:
+            # Neither data, nor SYN or FIN
+            return []
+        conn = self._connection(key, src, dst, sport, dport, flags)
+        if conn is None:
+            return []
+        direction = "client" if conn.client == end else "server"
+        half = conn.halves[direction]
+        if flags & 0x02:  # SYN
+            half.seq = (seq + 1) & 0xffffffff
+            return []
+        res = []
+        if payload and not half.closed:
+            half.buf += half.feed(seq, payload)
+            self._records(conn, direction, half, res)
+        if flags & 0x01:  # FIN
+            half.closed = True
+            if all(h.closed for h in conn.halves.values()):
+                del self.connections[key]
+        return res
+
+    def _records(self, conn, direction, half, res):
+        """Splits the records of a half stream and handles them"""
+        buf = half.buf
+        off = 0
+        while len(buf) >= off + 5:
+            ctype = orb(buf[off])
+            if not 20 <= ctype <= 24:
+                # Not TLS (or SSLv2): give up on this direction
+                log_runtime.info("TLS: %s sent a non TLS record", conn.name)
+                half.closed = True
+                buf = b""
+                off = 0
+                break
+            end = off + 5 + struct.unpack("!H", buf[off + 3:off + 5])[0]
+            if len(buf) < end:
+                break
+            data = self._record(conn, direction, ctype, buf[off:end])
+            if data:
+                if res and res[-1][0] == conn.name and \
+                        res[-1][1] == direction:
+                    res[-1] = (conn.name, direction, res[-1][2] + data)
+                else:
+                    res.append((conn.name, direction, data))
+            off = end
+        half.buf = buf[off:]
+
+    def _record(self, conn, direction, ctype, rec):
+        """Handles a record, returns the decrypted application data"""
+        s = conn.session
+        if conn.reading != direction:
+            s.mirror()
+            conn.reading = direction
+        if ctype == 23:
+            if s.tls_version is None or s.tls_version > 0x0303:
+                # Unknown state, or TLS 1.3
+                return None
+            return tls_decrypt_fragment(s, rec)
+        from scapy.layers.tls.record import TLS
+        TLS(rec, tls_session=s)
+        return None
+
+    def process(self, pkt):
+        """
+        Handles a packet, either a Packet or (linktype, raw data). See
+        process_segment().
+        """
+        if isinstance(pkt, Packet):
+            seg = _tls_tcp_segment_pkt(pkt)
+        else:
+            seg = _tls_tcp_segment(*pkt)
+        if seg is None:
+            return []
+        return self.process_segment(*seg)
+
+    def process_file(self, filename):
+        """Yields the decrypted application data of a capture file"""
+        reader = RawPcapReader(filename)
+        try:
+            for data, metadata in reader:
+                linktype = getattr(metadata, "linktype", None)
+                if linktype is None:
+                    linktype = reader.linktype
+                seg = _tls_tcp_segment(linktype, data)
+                if seg is not None:
+                    for res in self.process_segment(*seg):
+                        yield res
+        finally:
+            reader.close()
+
+
+def _tls_decrypt_partition(args):
+    """Decrypts a partition of the connections (in a worker process)"""
+    filename, keys, index, count = args
+    decryptor = TLSDecryptor(keys, max_connections=None,
+                             partition=(index, count))
+    streams = OrderedDict()
+    for conn, direction, data in decryptor.process_file(filename):
+        streams.setdefault((conn, direction), []).append(data)
+    return [(conn, direction, b"".join(data))
+            for (conn, direction), data in streams.items()]
+
+
+@conf.commands.register
+def tls_decrypt_pcap(filename, keys=None, workers=1):
+    """
+    Decrypts the TLS (SSLv3 to TLS 1.2) application data of a capture, using
+    the master secrets of a NSS Keys Log.
+
+    >>> for conn, direction, data in tls_decrypt_pcap("capture.pcap", "keys.txt"):  # noqa: E501
+    ...     print(conn, direction, len(data))
+
+    :param filename: a pcap or pcapng file
+    :param keys: a NSSKeyLog, or the name of a NSS Keys Log. Default:
+        conf.tls_nss_keys or conf.tls_nss_filename (e.g. set by a pcapng
+        Decryption Secrets Block)
+    :param workers: the number of processes. When it is greater than 1, the
+        connections are shared between the processes, which all read the
+        capture, and the application data of each connection is yielded
+        once, as one chunk per direction, when its process is over.
+    :returns: a generator of (connection, direction, data), where connection
+        is (client IP, client port, server IP, server port) and direction
+        is "client" or "server"
+    """
+    if workers <= 1:
+        for res in TLSDecryptor(keys).process_file(filename):
+            yield res
+        return
+    import multiprocessing
+    if keys is None:
+        keys = conf.tls_nss_keys or conf.tls_nss_filename
+    pool = multiprocessing.Pool(workers)
+    try:
+        tasks = [(filename, keys, i, workers) for i in range(workers)]
+        for chunk in pool.imap_unordered(_tls_decrypt_partition, tasks):
+            for res in chunk:
+                yield res
+    finally:
+        pool.terminate()
+        pool.join()
@@ -11,9 +11,11 @@ TLS session handler.
 import binascii
 import socket
 import struct
+import time
+from collections import OrderedDict
 
 from scapy.config import conf
-from scapy.compat import raw
+from scapy.compat import plain_str, raw
 import scapy.modules.six as six
 from scapy.error import log_runtime, warning
 from scapy.packet import Packet
@@ -26,51 +28,129 @@ from scapy.layers.tls.crypto.hkdf import TLS13_HKDF
 from scapy.layers.tls.crypto.prf import PRF
 
 # Typing imports
-from scapy.compat import Dict
+from scapy.compat import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+class NSSKeyLog(object):
+    """
+    The secrets of a NSS Keys Log, indexed by client random.
+
+    The file is read incrementally: update() parses the lines that were
+    appended since its last call. It is called automatically when the
+    secret of a client random is not found, so that the keys of the new
+    connections can be found while the file grows.
+    """
+
+    def __init__(self, filename=None):
+        # type: (Optional[str]) -> None
+        self.filename = filename
+        # {client random: {label: secret}}
+        self.keys = {}  # type: Dict[bytes, Dict[str, bytes]]
+        self._offset = 0
+        self._partial = b""
+        if filename is not None:
+            self.update()
+
+    def _parse_line(self, line):
+        # type: (bytes) -> None
+        line = line.strip()
+        if not line or line.startswith(b"#"):
+            return
+        data = line.split(b" ")
+        if len(data) != 3 or data[0] != data[0].upper():
+            warning("Invalid NSS Key Log Entry: %s", plain_str(line))
+            return
+        try:
+            client_random = binascii.unhexlify(data[1])
+        except (binascii.Error, TypeError, ValueError):
+            warning("Invalid ClientRandom: %s", plain_str(data[1]))
+            return
+        try:
+            secret = binascii.unhexlify(data[2])
+        except (binascii.Error, TypeError, ValueError):
+            warning("Invalid Secret: %s", plain_str(data[2]))
+            return
+        label = plain_str(data[0])
+        entry = self.keys.setdefault(client_random, {})
+        # Warn that a duplicated entry was detected. The latest one
+        # will be kept.
+        if label in entry:
+            warning("Duplicated entry for %s %s !", label,
+                    plain_str(data[1]))
+        entry[label] = secret
+
+    def parse(self, data):
+        # type: (bytes) -> None
+        """Parses the lines of a NSS Keys Log"""
+        for line in data.split(b"\n"):
+            self._parse_line(line)
+
+    def update(self):
+        # type: () -> None
+        """Parses the lines appended to the file since the last call"""
+        if self.filename is None:
+            return
+        try:
+            fd = open(self.filename, "rb")
+        except (IOError, OSError):
+            warning("Cannot open NSS Key Log: %s", self.filename)
+            return
+        with fd:
+            fd.seek(0, 2)
+            size = fd.tell()
+            if size < self._offset:
+                # The file was truncated: read it again
+                self._offset = 0
+                self._partial = b""
+            fd.seek(self._offset)
+            data = self._partial + fd.read()
+            self._offset = fd.tell()
+        lines = data.split(b"\n")
+        # The last line may still be being written
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def get(self, client_random, label="CLIENT_RANDOM"):
+        # type: (Optional[bytes], str) -> Optional[bytes]
+        """Returns the secret of a client random, or None"""
+        if not client_random:
+            return None
+        entry = self.keys.get(client_random)
+        if entry is None or label not in entry:
+            self.update()
+            entry = self.keys.get(client_random)
+            if entry is None:
+                return None
+        return entry.get(label)
+
+    def __contains__(self, client_random):
+        # type: (bytes) -> bool
+        return client_random in self.keys
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.keys)
+
+    def __repr__(self):
+        # type: () -> str
+        return "<NSSKeyLog %s: %d client randoms>" % (self.filename or "",
+                                                      len(self.keys))
 
 
 def load_nss_keys(filename):
-    # type: (str) -> Dict[str, bytes]
+    # type: (str) -> NSSKeyLog
     """
-    Parses a NSS Keys log and returns unpacked keys in a dictionary.
+    Parses a NSS Keys log and returns its keys, indexed by client random,
+    in a NSSKeyLog.
     """
-    keys = {}
-    try:
-        fd = open(filename)
-        fd.close()
-    except FileNotFoundError:
-        warning("Cannot open NSS Key Log: %s", filename)
-        return {}
-    else:
-        with open(filename) as fd:
-            for line in fd:
-                if line.startswith("#"):
-                    continue
-                data = line.strip().split(" ")
-                if len(data) != 3 or data[0] != data[0].upper():
-                    warning("Invalid NSS Key Log Entry: %s", line.strip())
-                    return {}
-
-                try:
-                    client_random = binascii.unhexlify(data[1])
-                except binascii.Error:
-                    warning("Invalid ClientRandom: %s", data[1])
-                    return {}
-
-                try:
-                    secret = binascii.unhexlify(data[2])
-                except binascii.Error:
-                    warning("Invalid Secret: %s", data[2])
-                    return {}
-
-                # Warn that a duplicated entry was detected. The latest one
-                # will be kept in the resulting dictionary.
-                if data[0] in keys:
-                    warning("Duplicated entry for %s !", data[0])
-
-                keys[data[0]] = {"ClientRandom": client_random,
-                                 "Secret": secret}
-        return keys
+    return NSSKeyLog(filename)
 
 
 # Note the following import may happen inside connState.__init__()
@@ -415,7 +495,7 @@ class tlsSession(object):
         self.server_rsa_key = None
         # self.server_ecdsa_key = None
 
-        # A dictionary containing keys extracted from a NSS Keys Log using
+        # A NSSKeyLog containing keys extracted from a NSS Keys Log using
         # the load_nss_keys() function.
         self.nss_keys = None
 
@@ -599,10 +679,11 @@ class tlsSession(object):
             log_runtime.debug("TLS: master secret: %s", repr_hex(ms))
 
     def compute_ms_and_derive_keys(self):
-        # Load the master secret from an NSS Key dictionary
-        if self.nss_keys and self.nss_keys.get("CLIENT_RANDOM", False) and \
-           self.nss_keys["CLIENT_RANDOM"].get("Secret", False):
-            self.master_secret = self.nss_keys["CLIENT_RANDOM"]["Secret"]
+        # Load the master secret from an NSS Key Log
+        if self.nss_keys is not None:
+            secret = self.nss_keys.get(self.client_random)
+            if secret:
+                self.master_secret = secret
 
         if not self.master_secret:
             self.compute_master_secret()
@@ -1108,38 +1189,92 @@ class _GenericTLSSessionInheritance(Packet):
 ###############################################################################
 
 class _tls_sessions(object):
-    def __init__(self):
-        self.sessions = {}
+    """
+    The TLS sessions, indexed by their endpoints.
+
+    The sessions are kept from the least to the most recently used: when
+    there are more than max_sessions, the least recently used ones are
+    dropped, as are the ones unused for more than timeout seconds.
+    """
+
+    def __init__(self, max_sessions=10000, timeout=3600):
+        # type: (Optional[int], Optional[float]) -> None
+        self.max_sessions = max_sessions
+        self.timeout = timeout
+        # {endpoints: [session, ...]}
+        self.sessions = OrderedDict()  # type: Dict[Any, List[tlsSession]]
+        self.last_seen = {}  # type: Dict[Any, float]
+        self.count = 0
         self.server_rsa_key = None
 
+    @staticmethod
+    def _key(session):
+        # type: (tlsSession) -> Optional[Tuple[Any, ...]]
+        """Returns the endpoints of a session, in any direction"""
+        if session.ipsrc is None or session.sport is None or \
+                session.ipdst is None or session.dport is None:
+            return None
+        ends = [(session.ipsrc, session.sport), (session.ipdst, session.dport)]
+        ends.sort()
+        return tuple(ends)
+
+    def _drop(self, key):
+        # type: (Tuple[Any, ...]) -> None
+        self.count -= len(self.sessions.pop(key))
+        del self.last_seen[key]
+
+    def _expire(self, now):
+        # type: (float) -> None
+        """Drops the sessions unused for too long, or in excess"""
+        if self.timeout is not None:
+            limit = now - self.timeout
+            while self.sessions:
+                key = next(iter(self.sessions))
+                if self.last_seen[key] >= limit:
+                    break
+                self._drop(key)
+        if self.max_sessions is not None:
+            while self.sessions and self.count > self.max_sessions:
+                self._drop(next(iter(self.sessions)))
+
     def add(self, session):
+        # type: (tlsSession) -> None
         s = self.find(session)
         if s:
             log_runtime.info("TLS: previous session shall not be overwritten")
             return
 
-        h = session.hash()
-        if h in self.sessions:
-            self.sessions[h].append(session)
-        else:
-            self.sessions[h] = [session]
+        key = self._key(session)
+        if key is None:
+            return
+        now = time.time()
+        self.sessions.setdefault(key, []).append(session)
+        self.last_seen[key] = now
+        self.count += 1
+        self._expire(now)
 
     def rem(self, session):
-        s = self.find(session)
-        if s:
-            log_runtime.info("TLS: previous session shall not be overwritten")
+        # type: (tlsSession) -> None
+        key = self._key(session)
+        if key is None or key not in self.sessions:
             return
-
-        h = session.hash()
-        self.sessions[h].remove(session)
+        sessions = self.sessions[key]
+        if session in sessions:
+            sessions.remove(session)
+            self.count -= 1
+            if not sessions:
+                del self.sessions[key]
+                del self.last_seen[key]
 
     def find(self, session):
-        try:
-            h = session.hash()
-        except Exception:
-            return None
-        if h in self.sessions:
-            for k in self.sessions[h]:
+        # type: (tlsSession) -> Optional[tlsSession]
+        key = self._key(session)
+        if key is not None and key in self.sessions:
+            # Mark the sessions as the most recently used
+            sessions = self.sessions.pop(key)
+            self.sessions[key] = sessions
+            self.last_seen[key] = time.time()
+            for k in sessions:
                 if k.eq(session):
                     if conf.tls_verbose:
                         log_runtime.info("TLS: found session matching %s", k)
@@ -1148,7 +1283,12 @@ class _tls_sessions(object):
             log_runtime.info("TLS: did not find session matching %s", session)
         return None
 
+    def __len__(self):
+        # type: () -> int
+        return self.count
+
     def __repr__(self):
+        # type: () -> str
         res = [("First endpoint", "Second endpoint", "Session ID")]
         for li in six.itervalues(self.sessions):
             for s in li:
@@ -1182,5 +1322,5 @@ conf.tls_session_enable = False
 conf.tls_verbose = False
 # Filename containing NSS Keys Log
 conf.tls_nss_filename = None
-# Dictionary containing parsed NSS Keys
+# NSSKeyLog containing parsed NSS Keys
 conf.tls_nss_keys = None
@@ -27,3 +27,26 @@ class sock_fprog(ctypes.Structure):
     """"Structure for SO_ATTACH_FILTER"""
     _fields_ = [('len', ctypes.c_ushort),
                 ('filter', ctypes.POINTER(bpf_insn))]
+
+
+class iovec(ctypes.Structure):
+    """"Structure for the scatter/gather I/O functions"""
+    _fields_ = [('iov_base', ctypes.c_char_p),
+                ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    """"Structure for sendmsg()"""
+    _fields_ = [('msg_name', ctypes.c_void_p),
+                ('msg_namelen', ctypes.c_uint),
+                ('msg_iov', ctypes.c_void_p),
+                ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p),
+                ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    """"Structure for sendmmsg()"""
+    _fields_ = [('msg_hdr', msghdr),
+                ('msg_len', ctypes.c_uint)]
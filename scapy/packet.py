@@ -20,6 +20,7 @@ import re
 import time
 import itertools
 import copy
+import struct
 import types
 import warnings
 
@@ -36,11 +37,12 @@ from scapy.fields import (
     PacketListField,
     RawVal,
     StrField,
+    _FixedLayout,
 )
 from scapy.config import conf, _version_checker
 from scapy.compat import raw, orb, bytes_encode
 from scapy.base_classes import BasePacket, Gen, SetGen, Packet_metaclass, \
-    _CanvasDumpExtended
+    _CanvasDumpExtended, _get_values
 from scapy.interfaces import _GlobInterfaceType
 from scapy.volatile import RandField, VolatileValue
 from scapy.utils import import_hexcap, tex_escape, colgen, issubtype, \
@@ -48,12 +50,14 @@ from scapy.utils import import_hexcap, tex_escape, colgen, issubtype, \
 from scapy.error import Scapy_Exception, log_runtime, warning
 from scapy.extlib import PYX
 import scapy.modules.six as six
+from scapy.modules.six.moves import range
 
 # Typing imports
 from scapy.compat import (
     Any,
     Callable,
     Dict,
+    Iterable,
     Iterator,
     List,
     NoReturn,
@@ -87,6 +91,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         "raw_packet_cache_fields", "_pkt", "post_transforms",
         # then payload and underlayer
         "payload", "underlayer",
+        # raw payload waiting to be dissected, when conf.lazy_dissect is set
+        "_lazy_payload",
         "name",
         # used for sr()
         "_answered",
@@ -108,6 +114,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     class_default_fields = {}  # type: Dict[Type[Packet], Dict[str, Any]]
     class_default_fields_ref = {}  # type: Dict[Type[Packet], List[str]]
     class_fieldtype = {}  # type: Dict[Type[Packet], Dict[str, AnyField]]  # noqa: E501
+    _fixed_layout = None  # type: Optional[_FixedLayout]
+    class_payload_guess_index = {}  # type: Dict[Type[Packet], _PayloadGuessIndex]  # noqa: E501
 
     @classmethod
     def from_hexcap(cls):
@@ -146,6 +154,7 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         self.fieldtype = {}  # type: Dict[str, AnyField]
         self.packetfields = []  # type: List[AnyField]
         self.payload = NoPayload()
+        self._lazy_payload = None  # type: Optional[List[Any]]
         self.init_fields()
         self.underlayer = _underlayer
         self.original = _pkt
@@ -322,6 +331,11 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     def dissection_done(self, pkt):
         # type: (Packet) -> None
         """DEV: will be called after a dissection is completed"""
+        if self._lazy_payload is not None:
+            # The payload will be notified once it has been dissected
+            self._lazy_payload[2] = pkt
+            self.post_dissection(pkt)
+            return
         self.post_dissection(pkt)
         self.payload.dissection_done(pkt)
 
@@ -356,7 +370,11 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
     def remove_payload(self):
         # type: () -> None
-        self.payload.remove_underlayer(self)
+        if self._lazy_payload is not None:
+            # No need to dissect a payload that is about to be dropped
+            self._lazy_payload = None
+        else:
+            self.payload.remove_underlayer(self)
         self.payload = NoPayload()
         self.overloaded_fields = {}
 
@@ -427,6 +445,10 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         try:
             fld, v = self.getfield_and_val(attr)
         except ValueError:
+            if attr == "payload":
+                # The payload slot is only unset when the dissection of
+                # the payload has been delayed (see conf.lazy_dissect)
+                return self.dissect_lazy_payload()
             return self.payload.__getattr__(attr)
         if fld is not None:
             return fld.i2h(self, v)
@@ -456,6 +478,9 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
     def __setattr__(self, attr, val):
         # type: (str, Any) -> None
         if attr in self.__all_slots__:
+            if attr == "payload":
+                # Drop the payload that has not been dissected yet
+                self._lazy_payload = None
             return object.__setattr__(self, attr, val)
         try:
             return self.setfieldval(attr, val)
@@ -644,7 +669,14 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
             if self.raw_packet_cache is not None:
                 return self.raw_packet_cache
         p = b""
-        for f in self.fields_desc:
+        flist = self.fields_desc
+        layout = self._fixed_layout
+        # fields_desc may have been replaced after the class creation
+        if layout is not None and layout.fields_desc is flist:
+            p = layout.build(self) or b""
+            if p:
+                flist = flist[layout.count:]
+        for f in flist:
             val = self.getfieldval(f.name)
             if isinstance(val, RawVal):
                 p += bytes(val)
@@ -669,8 +701,66 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
         :return: a string of payload layer
         """
+        if self._lazy_payload is not None:
+            return self._lazy_payload[0]  # type: ignore
         return self.payload.do_build()
 
+    def _resolve_fields(self):
+        # type: () -> Optional[Dict[str, Any]]
+        """
+        Resolve the fields values the way next(iter(self)) would, but
+        without cloning the layer: volatile values are fixed.
+
+        :return: the fields to build the layer with, or None if the layer
+            expands to several packets
+        """
+        fields = self.fields.copy()
+        if self.raw_packet_cache is not None:
+            return fields
+        for fname, fval in six.iteritems(self.fields):
+            if isinstance(fval, VolatileValue):
+                fields[fname] = fval._fix()
+            elif isinstance(fval, BasePacket):
+                continue
+            elif _get_values(fval) is not fval or isinstance(
+                    fval, (Gen, range, types.GeneratorType)):
+                return None
+            elif isinstance(fval, list):
+                fld = self.get_field(fname)
+                if fld is None or not fld.islist:
+                    return None
+        for fname, fval in itertools.chain(
+                six.iteritems(self.default_fields),
+                six.iteritems(self.overloaded_fields)):
+            if isinstance(fval, VolatileValue) and fname not in fields:
+                fval = self.getfieldval(fname)
+                if isinstance(fval, VolatileValue):
+                    fields[fname] = fval._fix()
+        return fields
+
+    def _resolve_layers(self):
+        # type: () -> Optional[List[Tuple[Packet, Dict[str, Any]]]]
+        """
+        Resolve the fields values of this layer and of all its payloads:
+        a layer may read its payload while being built (e.g. Ether uses
+        the destination of its IP payload to find its own).
+
+        :return: the non-explicit layers with the fields to build them
+            with, or None if one of the layers expands to several packets
+        """
+        layers = []
+        layer = self  # type: Packet
+        while True:
+            if not layer.explicit:
+                fields = layer._resolve_fields()
+                if fields is None:
+                    return None
+                layers.append((layer, fields))
+            if layer._lazy_payload is not None or \
+                    isinstance(layer.payload, NoPayload):
+                return layers
+            layer = layer.payload
+
     def do_build(self):
         # type: () -> bytes
         """
@@ -679,7 +769,27 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         :return: a string of the packet with the payload
         """
         if not self.explicit:
-            self = next(iter(self))
+            layers = self._resolve_layers()
+            if layers is None:
+                self = next(iter(self))
+            else:
+                # Build every layer with its resolved values, as explicit
+                # clones would be, then restore the fields: changes made
+                # while building are discarded.
+                orig_fields = [layer.fields for layer, _ in layers]
+                for layer, fields in layers:
+                    layer.fields = fields
+                    layer.explicit = 1
+                try:
+                    return self._do_build()
+                finally:
+                    for (layer, _), fields in zip(layers, orig_fields):
+                        layer.fields = fields
+                        layer.explicit = 0
+        return self._do_build()
+
+    def _do_build(self):
+        # type: () -> bytes
         pkt = self.self_build()
         for t in self.post_transforms:
             pkt = t(pkt)
@@ -691,6 +801,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
     def build_padding(self):
         # type: () -> bytes
+        if self._lazy_payload is not None:
+            return self._lazy_payload[1] or b""
         return self.payload.build_padding()
 
     def build(self):
@@ -718,6 +830,8 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
 
     def build_done(self, p):
         # type: (bytes) -> bytes
+        if self._lazy_payload is not None:
+            return p
         return self.payload.build_done(p)
 
     def do_build_ps(self):
@@ -953,7 +1067,15 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         # type: (bytes) -> bytes
         _raw = s
         self.raw_packet_cache_fields = {}
-        for f in self.fields_desc:
+        flist = self.fields_desc
+        layout = self._fixed_layout
+        # Dissect the fixed-width fields at once, when there is enough data
+        if layout is not None and layout.fields_desc is flist and \
+                len(s) >= layout.size:
+            layout.dissect(self, s)
+            s = s[layout.size:]
+            flist = flist[layout.count:]
+        for f in flist:
             if not s:
                 break
             s, fval = f.getfield(self, s)
@@ -1004,10 +1126,34 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         s = self.post_dissect(s)
 
         payl, pad = self.extract_padding(s)
+        if conf.lazy_dissect and payl and \
+                isinstance(self.payload, NoPayload):
+            # Keep the raw payload: it will be dissected on first access
+            self._lazy_payload = [payl, pad if conf.padding else None, None]
+            object.__delattr__(self, "payload")
+            return
         self.do_dissect_payload(payl)
         if pad and conf.padding:
             self.add_payload(conf.padding_layer(pad))
 
+    def dissect_lazy_payload(self):
+        # type: () -> Packet
+        """
+        Perform the dissection of a payload that was delayed because of
+        conf.lazy_dissect, and return it.
+        """
+        if self._lazy_payload is None:
+            return self.payload
+        payl, pad, pkt = self._lazy_payload
+        self._lazy_payload = None
+        self.payload = NoPayload()
+        self.do_dissect_payload(payl)
+        if pad:
+            self.add_payload(conf.padding_layer(pad))
+        if pkt is not None:
+            self.payload.dissection_done(pkt)
+        return self.payload
+
     def guess_payload_class(self, payload):
         # type: (bytes) -> Type[Packet]
         """
@@ -1018,13 +1164,14 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
         :return: the payload class
         """
         for t in self.aliastypes:
-            for fval, cls in t.payload_guess:
-                try:
-                    if all(v == self.getfieldval(k)
-                           for k, v in six.iteritems(fval)):
-                        return cls  # type: ignore
-                except AttributeError:
-                    pass
+            index = Packet.class_payload_guess_index.get(t)
+            # payload_guess is replaced by bind_layers() / split_layers()
+            if index is None or index.payload_guess is not t.payload_guess:
+                index = _PayloadGuessIndex(t.payload_guess)
+                Packet.class_payload_guess_index[t] = index
+            cls = index.lookup(self)
+            if cls is not None:
+                return cls
         return self.default_payload_class(payload)
 
     def default_payload_class(self, payload):
@@ -1172,6 +1319,19 @@ class Packet(six.with_metaclass(Packet_metaclass,  # type: ignore
             return self.payload.answers(other.payload)
         return 0
 
+    def template_checksums(self, offsets):
+        # type: (Dict[int, Tuple[int, int, int]]) -> Optional[List[Tuple[int, List[Tuple[int, int]], bool]]]  # noqa: E501
+        """DEV: returns the checksums computed by this layer, that
+        PacketTemplate must update, as (checksum offset, covered ranges,
+        zero_as_ffff) tuples. The ranges are (start, end) offsets in the
+        built packet; 16-bit words are aligned on their start. Returns None
+        if the layer can't be used in a template.
+
+        :param offsets: maps the id() of each layer of the packet to its
+            (start, payload start, end) offsets in the built packet
+        """
+        return []
+
     def layers(self):
         # type: () -> List[Type[Packet]]
         """returns a list of layer classes (including subclasses) in this packet"""  # noqa: E501
@@ -1853,11 +2013,409 @@ conf.padding_layer = Padding
 if conf.default_l2 is None:
     conf.default_l2 = Raw
 
+######################
+#  Packet templates  #
+######################
+
+
+def _ones_sum(data, odd):
+    # type: (bytes, int) -> int
+    """16-bit one's complement sum of data, not folded. If odd is set, data
+    starts at an odd offset of the summed range."""
+    if odd:
+        data = b"\x00" + data
+    if len(data) % 2:
+        data += b"\x00"
+    return sum(struct.unpack("!%dH" % (len(data) // 2), data))
+
+
+class PacketTemplate(Gen[bytes]):
+    """
+    Compiled version of a packet holding generators (Net, lists, ranges...)
+    or volatile values (RandField...), that produces the raw packets it
+    expands to much faster than iterating over it and building each packet.
+
+    The packet is built once. Each variant is then produced by patching the
+    bytes of the fields that change, and by updating the checksums
+    incrementally (RFC 1624). The layers tell which checksums they compute
+    with Packet.template_checksums().
+
+    Only fields of a fixed size can be patched. The template is checked
+    against regular builds when it is created: if a varying field can't be
+    patched, or changes other bytes than its own and the known checksums,
+    each packet is built (``compiled`` is False). Values computed when the
+    packet is built (e.g. the source IP address or the destination MAC
+    address) are computed once, for the first packet.
+
+    The template yields bytes: send it with sendp(), or a layer 2 socket.
+
+        >>> t = PacketTemplate(Ether()/IP(dst="10.0.0.0/24")/TCP(dport=80))
+        >>> sendp(t, batch=64)
+
+    :param pkt: the packet to compile
+    """
+    # Number of encoded values kept per varying field
+    cache_size = 65536
+
+    def __init__(self, pkt):
+        # type: (Packet) -> None
+        self.pkt = pkt
+        self.compiled = False
+        # The varying fields: (layer index, field, values or VolatileValue)
+        self.axes = []  # type: List[Tuple[int, AnyField, Any]]
+        self._base = b""
+        self._layers = []  # type: List[Packet]
+        # The (offset, size) of each varying field in the built packet
+        self._pos = []  # type: List[Tuple[int, int]]
+        # The checksums, the inner ones first: (offset, zero_as_ffff)
+        self._checksums = []  # type: List[Tuple[int, bool]]
+        # The parts of a varying field (or of a checksum) covered by each
+        # checksum: (checksum index, start, end, odd)
+        self._covered = []  # type: List[List[Tuple[int, int, int, int]]]
+        self._ck_covered = []  # type: List[List[Tuple[int, int, int, int]]]
+        axes = self._find_axes()
+        if axes is None:
+            log_runtime.info("PacketTemplate: unsupported field value")
+            return
+        self.axes = axes
+        try:
+            self.compiled = self._compile()
+        except StopIteration:
+            # An empty generator: no packet
+            return
+        if not self.compiled:
+            log_runtime.info("PacketTemplate: can't patch the varying "
+                             "fields. Falling back to regular builds")
+
+    def _find_axes(self):
+        # type: () -> Optional[List[Tuple[int, AnyField, Any]]]
+        """Lists the varying fields, in the order Packet.__iter__()
+        iterates over them."""
+        axes = []  # type: List[Tuple[int, AnyField, Any]]
+        for i, layer in enumerate(self.pkt.iterpayloads()):
+            if layer.raw_packet_cache is not None:
+                continue
+            names = [
+                k for k, v in itertools.chain(
+                    six.iteritems(layer.default_fields),
+                    six.iteritems(layer.overloaded_fields)
+                ) if isinstance(v, VolatileValue) and k not in layer.fields
+            ] + list(layer.fields)
+            for fname in reversed(names):
+                val = layer.getfieldval(fname)
+                fld = layer.get_field(fname)
+                if isinstance(val, VolatileValue):
+                    axes.append((i, fld, val))
+                elif layer.explicit:
+                    continue
+                elif isinstance(val, BasePacket):
+                    # Nested packets are built once
+                    if any(lay.fields
+                           for lay in cast(Packet, val).iterpayloads()
+                           if not lay.explicit):
+                        return None
+                elif isinstance(val, types.GeneratorType):
+                    # Can't be iterated several times
+                    return None
+                elif isinstance(val, Gen):
+                    axes.append((i, fld, val))
+                elif _get_values(val) is not val or isinstance(val, range):
+                    axes.append((i, fld, SetGen(val)))
+                elif isinstance(val, list) and not fld.islist:
+                    axes.append((i, fld, SetGen(val)))
+        return axes
+
+    def _variant(self, values):
+        # type: (List[Any]) -> Packet
+        """Returns a copy of the packet, with the given values of the
+        varying fields"""
+        pkt = self.pkt.copy()
+        layers = list(pkt.iterpayloads())
+        for (i, fld, _), val in zip(self.axes, values):
+            layers[i].fields[fld.name] = val
+        return pkt
+
+    @staticmethod
+    def _cover(pos, end, ranges, k):
+        # type: (int, int, List[Tuple[int, int]], int) -> List[Tuple[int, int, int, int]]  # noqa: E501
+        """The parts of [pos, end) covered by the ranges of the k-th
+        checksum, relative to pos"""
+        parts = []
+        for start, stop in ranges:
+            lo, hi = max(pos, start), min(end, stop)
+            if lo < hi:
+                parts.append((k, lo - pos, hi - pos, (lo - start) % 2))
+        return parts
+
+    def _compile(self):
+        # type: () -> bool
+        values = [
+            val._fix() if isinstance(val, VolatileValue) else next(iter(val))
+            for _, _, val in self.axes
+        ]
+        pkt = self._variant(values)
+        self._base = base = raw(pkt)
+        self._layers = layers = list(pkt.iterpayloads())
+        # Offsets of the layers: each one must end with its payload
+        builds = [layer.do_build() for layer in layers]
+        lengths = [len(b) for b in builds]
+        offsets = {}  # type: Dict[int, Tuple[int, int, int]]
+        for i, layer in enumerate(layers):
+            start = lengths[0] - lengths[i]
+            if base[start:lengths[0]] != builds[i]:
+                return False
+            if i + 1 < len(layers):
+                pay = lengths[0] - lengths[i + 1]
+            else:
+                pay = lengths[0]
+            offsets[id(layer)] = (start, pay, lengths[0])
+        # Offsets of the varying fields
+        for (i, fld, _), val in zip(self.axes, values):
+            layer = layers[i]
+            p = b""  # type: Any
+            for f in layer.fields_desc:
+                if f.name == fld.name:
+                    break
+                fval = layer.getfieldval(f.name)
+                if isinstance(fval, RawVal):
+                    p += bytes(fval)
+                else:
+                    p = f.addfield(layer, p, fval)
+            data = fld.addfield(layer, b"", val)
+            if not isinstance(p, bytes) or not isinstance(data, bytes):
+                # e.g. a BitField
+                return False
+            pos = offsets[id(layer)][0] + len(p)
+            if base[pos:pos + len(data)] != data:
+                return False
+            self._pos.append((pos, len(data)))
+        # Checksums, the ones of the upper layers first
+        ranges = []
+        for layer in reversed(layers):
+            checksums = layer.template_checksums(offsets)
+            if checksums is None:
+                return False
+            for cpos, cranges, zero_as_ffff in checksums:
+                self._checksums.append((cpos, zero_as_ffff))
+                ranges.append(cranges)
+        for pos, size in self._pos:
+            self._covered.append([
+                part for k, cranges in enumerate(ranges)
+                for part in self._cover(pos, pos + size, cranges, k)
+                # A varying checksum isn't computed
+                if not (pos < self._checksums[k][0] + 2 and
+                        self._checksums[k][0] < pos + size)
+            ])
+        for n, (cpos, _) in enumerate(self._checksums):
+            # Only the outer checksums cover this one
+            self._ck_covered.append([
+                part for k, cranges in enumerate(ranges) if k > n
+                for part in self._cover(cpos, cpos + 2, cranges, k)
+            ])
+        # Check the second value of each varying field, then of all of
+        # them, against regular builds
+        seconds = []
+        for _, _, val in self.axes:
+            if isinstance(val, VolatileValue):
+                seconds.append(val._fix())
+            else:
+                gen = iter(val)
+                next(gen)
+                seconds.append(next(gen, None))
+        checks = []
+        for n, val in enumerate(seconds):
+            if val is not None:
+                checks.append(values[:n] + [val] + values[n + 1:])
+        checks.append([val if val is not None else values[n]
+                       for n, val in enumerate(seconds)])
+        for check in checks:
+            buf = bytearray(base)
+            caches = [{} for _ in check]  # type: List[Dict[Any, bytes]]
+            if not self._patch(buf, check, range(len(check)), caches):
+                return False
+            if raw(self._variant(check)) != bytes(buf):
+                return False
+        return True
+
+    def _patch(self, buf, values, changed, caches):
+        # type: (bytearray, List[Any], Iterable[int], List[Dict[Any, bytes]]) -> bool  # noqa: E501
+        """Writes the values of the changed fields, and updates the
+        checksums. Returns False if the size of a value doesn't match."""
+        deltas = [0] * len(self._checksums)
+        for n in changed:
+            val = values[n]
+            cache = caches[n]
+            try:
+                data = cache[val]
+            except KeyError:
+                i, fld, _ = self.axes[n]
+                data = fld.addfield(self._layers[i], b"", val)
+                if len(cache) < self.cache_size:
+                    cache[val] = data
+            except TypeError:
+                # Not hashable
+                i, fld, _ = self.axes[n]
+                data = fld.addfield(self._layers[i], b"", val)
+            pos, size = self._pos[n]
+            if not isinstance(data, bytes) or len(data) != size:
+                return False
+            old = buf[pos:pos + size]
+            if old == data:
+                continue
+            buf[pos:pos + size] = data
+            # RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m')
+            for k, lo, hi, odd in self._covered[n]:
+                deltas[k] += ((~_ones_sum(bytes(old[lo:hi]), odd) & 0xffff) +
+                              _ones_sum(data[lo:hi], odd))
+        for k, (cpos, zero_as_ffff) in enumerate(self._checksums):
+            if not deltas[k]:
+                continue
+            old_ck = bytes(buf[cpos:cpos + 2])
+            ck = (~struct.unpack("!H", old_ck)[0] & 0xffff) + deltas[k]
+            while ck >> 16:
+                ck = (ck & 0xffff) + (ck >> 16)
+            ck = ~ck & 0xffff
+            if ck == 0 and zero_as_ffff:
+                ck = 0xffff
+            data = struct.pack("!H", ck)
+            buf[cpos:cpos + 2] = data
+            for j, lo, hi, odd in self._ck_covered[k]:
+                deltas[j] += ((~_ones_sum(old_ck[lo:hi], odd) & 0xffff) +
+                              _ones_sum(data[lo:hi], odd))
+        return True
+
+    def __iter__(self):
+        # type: () -> Iterator[bytes]
+        if not self.compiled:
+            for pkt in self.pkt:
+                yield raw(pkt)
+            return
+        axes = self.axes
+        gens = [n for n, (_, _, val) in enumerate(axes)
+                if not isinstance(val, VolatileValue)]
+        volatiles = [n for n, (_, _, val) in enumerate(axes)
+                     if isinstance(val, VolatileValue)]
+        caches = [{} for _ in axes]  # type: List[Dict[Any, bytes]]
+        iters = {}  # type: Dict[int, Iterator[Any]]
+        values = [None] * len(axes)  # type: List[Any]
+        for n in gens:
+            iters[n] = iter(axes[n][2])
+            values[n] = next(iters[n])
+        changed = list(range(len(axes)))
+        buf = bytearray(self._base)
+        while True:
+            for n in volatiles:
+                values[n] = axes[n][2]._fix()
+            if self._patch(buf, values, changed, caches):
+                yield bytes(buf)
+            else:
+                # A value of another size: build this packet
+                yield raw(self._variant(values))
+            # The next values, the last generator changing first
+            changed = volatiles[:]
+            for n in reversed(gens):
+                changed.append(n)
+                try:
+                    values[n] = next(iters[n])
+                    break
+                except StopIteration:
+                    iters[n] = iter(axes[n][2])
+                    values[n] = next(iters[n])
+            else:
+                return
+
+    def __len__(self):
+        # type: () -> int
+        if not self.compiled:
+            return sum(1 for _ in self.pkt)
+        n = 1
+        for _, _, val in self.axes:
+            if not isinstance(val, VolatileValue):
+                n *= len(val) if hasattr(val, "__len__") else \
+                    val.__iterlen__()
+        return n
+
+    def __repr__(self):
+        # type: () -> str
+        return "<PacketTemplate %s%s>" % (
+            self.pkt.summary(), "" if self.compiled else " (not compiled)"
+        )
+
+
 #################
 #  Bind layers  #
 #################
 
 
+class _PayloadGuessIndex(object):
+    """
+    Index of the payload_guess list of a layer, used by
+    Packet.guess_payload_class().
+
+    The bindings are grouped by the names of the fields they test, and each
+    group maps the tuple of bound values to the first matching binding, so
+    that guessing the payload class only costs one dict lookup per group
+    instead of a scan of all the bindings. Bindings (or field values) that
+    are not of a plain hashable type are compared one by one.
+
+    bind_layers() and split_layers() replace the payload_guess list of the
+    layer, which invalidates its index.
+    """
+    __slots__ = ["payload_guess", "groups"]
+
+    _PLAIN_TYPES = frozenset(six.integer_types + (str, bytes, float,
+                                                  type(None)))
+
+    def __init__(self, payload_guess):
+        # type: (List[Tuple[Dict[str, Any], Type[Packet]]]) -> None
+        self.payload_guess = payload_guess
+        groups = {}  # type: Dict[Any, Tuple[int, Any, Dict[Tuple[Any, ...], Tuple[int, Type[Packet]]], List[Tuple[int, Any, Type[Packet]]]]]  # noqa: E501
+        for i, (fval, cls) in enumerate(payload_guess):
+            keys = tuple(sorted(fval))
+            values = tuple(fval[k] for k in keys)
+            if not self._is_plain(values):
+                # compared one by one, in their own group
+                groups[i] = (i, keys, {}, [(i, values, cls)])
+                continue
+            group = groups.setdefault(keys, (i, keys, {}, []))
+            group[2].setdefault(values, (i, cls))
+            group[3].append((i, values, cls))
+        # (position of the first binding, fields names, values -> (position,
+        # class), bindings), sorted by position
+        self.groups = sorted(groups.values(), key=lambda x: x[0])
+
+    @classmethod
+    def _is_plain(cls, values):
+        # type: (Tuple[Any, ...]) -> bool
+        for v in values:
+            if type(v) not in cls._PLAIN_TYPES:
+                return False
+        return True
+
+    def lookup(self, pkt):
+        # type: (Packet) -> Optional[Type[Packet]]
+        """Return the class of the first binding matching pkt, if any"""
+        best = None  # type: Optional[Tuple[int, Type[Packet]]]
+        for first, keys, table, bindings in self.groups:
+            if best is not None and best[0] < first:
+                break
+            try:
+                values = tuple([pkt.getfieldval(k) for k in keys])
+            except AttributeError:
+                continue
+            match = None
+            if table and self._is_plain(values):
+                match = table.get(values)
+            else:
+                for i, bvalues, cls in bindings:
+                    if bvalues == values:
+                        match = (i, cls)
+                        break
+            if match is not None and (best is None or match[0] < best[0]):
+                best = match
+        return None if best is None else best[1]
+
+
 def bind_bottom_up(lower,  # type: Type[Packet]
                    upper,  # type: Type[Packet]
                    __fval=None,  # type: Optional[Any]
@@ -13,7 +13,7 @@ from threading import Lock, Thread
 from scapy.automaton import (
     Message,
     ObjectPipe,
-    select_objects,
+    ObjectSelector,
 )
 from scapy.consts import WINDOWS
 from scapy.error import log_runtime, warning
@@ -127,16 +127,18 @@ class PipeEngine(ObjectPipe[str]):
     def run(self):
         # type: () -> None
         log_runtime.debug("Pipe engine thread started.")
+        selector = ObjectSelector()
         try:
             for p in self.active_pipes:
                 p.start()
             sources = self.active_sources
             sources.add(self)
+            selector.update(sources)
             exhausted = set([])  # type: Set[Pipe]
             RUN = True
             STOP_IF_EXHAUSTED = False
             while RUN and (not STOP_IF_EXHAUSTED or len(sources) > 1):
-                fds = select_objects(sources, 0.5)
+                fds = selector.select(0.5)
                 for fd in fds:
                     if fd is self:
                         cmd = self._read_cmd()
@@ -148,6 +150,7 @@ class PipeEngine(ObjectPipe[str]):
                         elif cmd == "A":
                             sources = self.active_sources - exhausted
                             sources.add(self)
+                            selector.update(sources)
                         else:
                             warning("Unknown internal pipe engine command: %r."
                                     " Ignoring.", cmd)
@@ -161,9 +164,11 @@ class PipeEngine(ObjectPipe[str]):
                             if fd.exhausted():
                                 exhausted.add(fd)
                                 sources.remove(fd)
+                                selector.unregister(fd)
         except KeyboardInterrupt:
             pass
         finally:
+            selector.close()
             try:
                 for p in self.active_pipes:
                     p.stop()
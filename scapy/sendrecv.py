@@ -9,7 +9,7 @@ Functions to send and receive packets.
 
 from __future__ import absolute_import, print_function
 import itertools
-from threading import Thread, Event
+from threading import Condition, Thread, Event
 import os
 import re
 import subprocess
@@ -35,6 +35,7 @@ from scapy.plist import (
 from scapy.error import log_runtime, log_interactive, Scapy_Exception
 from scapy.base_classes import Gen, SetGen
 from scapy.modules import six
+from scapy.modules.six.moves.queue import Queue
 from scapy.sessions import DefaultSession
 from scapy.supersocket import SuperSocket, IterSocket
 
@@ -46,6 +47,7 @@ from scapy.compat import (
     Iterator,
     List,
     Optional,
+    Set,
     Tuple,
     Type,
     Union,
@@ -121,7 +123,8 @@ class SndRcvHandler(object):
                  prebuild=False,  # type: bool
                  _flood=None,  # type: Optional[_FloodGenerator]
                  threaded=False,  # type: bool
-                 session=None  # type: Optional[_GlobSessionType]
+                 session=None,  # type: Optional[_GlobSessionType]
+                 batch=0,  # type: int
                  ):
         # type: (...) -> None
         # Instantiate all arguments
@@ -136,6 +139,9 @@ class SndRcvHandler(object):
         self.pks = pks
         self.rcv_pks = rcv_pks or pks
         self.inter = inter
+        # Packets are sent in batches only when there is no delay to
+        # respect between them
+        self.batch = 0 if inter else batch
         self.verbose = verbose
         self.chainCC = chainCC
         self.multi = multi
@@ -229,6 +235,7 @@ class SndRcvHandler(object):
         """Function used in the sending thread of sndrcv()"""
         i = 0
         p = None
+        pending = []  # type: List[Packet]
         try:
             if self.verbose:
                 print("Begin emission:")
@@ -237,10 +244,18 @@ class SndRcvHandler(object):
                 # _sndrcv_rcv won't miss the answer of a packet that
                 # has not been sent
                 self.hsent.setdefault(p.hashret(), []).append(p)
+                if self.batch:
+                    pending.append(p)
+                    if len(pending) >= self.batch:
+                        i += self.pks.send_many(pending)
+                        pending = []
+                    continue
                 # Send packet
                 self.pks.send(p)
                 time.sleep(self.inter)
                 i += 1
+            if pending:
+                i += self.pks.send_many(pending)
             if self.verbose:
                 print("Finished sending %i packets." % i)
         except SystemExit:
@@ -329,6 +344,7 @@ def __gen_send(s,  # type: SuperSocket
                verbose=None,  # type: Optional[int]
                realtime=False,  # type: bool
                return_packets=False,  # type: bool
+               batch=0,  # type: int
                *args,  # type: Any
                **kargs  # type: Any
                ):
@@ -351,11 +367,31 @@ def __gen_send(s,  # type: SuperSocket
     elif not loop:
         loop = -1
     sent_packets = PacketList() if return_packets else None
+    if inter or realtime:
+        batch = 0
+    pending = []  # type: List[Packet]
+
+    def send_pending():
+        # type: () -> int
+        s.send_many(pending)
+        if sent_packets is not None:
+            sent_packets.extend(pending)
+        if verbose:
+            os.write(1, b"." * len(pending))
+        sent = len(pending)
+        del pending[:]
+        return sent
+
     p = None
     try:
         while loop:
             dt0 = None
             for p in x:
+                if batch:
+                    pending.append(p)
+                    if len(pending) >= batch:
+                        n += send_pending()
+                    continue
                 if realtime:
                     ct = time.time()
                     if dt0:
@@ -371,6 +407,8 @@ def __gen_send(s,  # type: SuperSocket
                 if verbose:
                     os.write(1, b".")
                 time.sleep(inter)
+            if pending:
+                n += send_pending()
             if loop < 0:
                 loop += 1
     except KeyboardInterrupt:
@@ -395,6 +433,7 @@ def _send(x,  # type: _PacketIterable
           realtime=False,  # type: bool
           return_packets=False,  # type: bool
           socket=None,  # type: Optional[SuperSocket]
+          batch=0,  # type: int
           **kargs  # type: Any
           ):
     # type: (...) -> Optional[PacketList]
@@ -404,7 +443,8 @@ def _send(x,  # type: _PacketIterable
     socket = socket or _func(iface)(iface=iface, **kargs)
     results = __gen_send(socket, x, inter=inter, loop=loop,
                          count=count, verbose=verbose,
-                         realtime=realtime, return_packets=return_packets)
+                         realtime=realtime, return_packets=return_packets,
+                         batch=batch)
     if need_closing:
         socket.close()
     return results
@@ -429,6 +469,8 @@ def send(x,  # type: _PacketIterable
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
+    :param batch: send the packets by groups of <batch> packets, with
+        SuperSocket.send_many(). Ignored if inter or realtime are set
     :returns: None
     """
     iface = _interface_selection(iface, x)
@@ -461,6 +503,8 @@ def sendp(x,  # type: _PacketIterable
     :param socket: the socket to use (default is conf.L3socket(kargs))
     :param iface: the interface to send the packets on
     :param monitor: (not on linux) send in monitor mode
+    :param batch: send the packets by groups of <batch> packets, with
+        SuperSocket.send_many(). Ignored if inter or realtime are set
     :returns: None
     """
     if iface is None and iface_hint is not None and socket is None:
@@ -848,17 +892,22 @@ def sndrcvflood(pks,  # type: SuperSocket
                 maxretries=None,  # type: Optional[int]
                 verbose=None,  # type: Optional[int]
                 chainCC=False,  # type: bool
-                timeout=None  # type: Optional[int]
+                timeout=None,  # type: Optional[int]
+                batch=64,  # type: int
                 ):
     # type: (...) -> Tuple[SndRcvList, PacketList]
-    """sndrcv equivalent for flooding."""
+    """sndrcv equivalent for flooding.
+
+    The packets are sent by groups of <batch> packets (see
+    SuperSocket.send_many()), unless inter is set.
+    """
 
     flood_gen = _FloodGenerator(pkt, maxretries)
     return sndrcv(
         pks, flood_gen,
         inter=inter, verbose=verbose,
         chainCC=chainCC, timeout=timeout,
-        _flood=flood_gen
+        _flood=flood_gen, batch=batch
     )
 
 
@@ -971,6 +1020,86 @@ def srp1flood(x,  # type: _PacketIterable
 # SNIFF METHODS
 
 
+class _DissectorPool(object):
+    """Dissects the packets received by sniff() in worker threads.
+
+    The dissected packets are handed to the handler one at a time, in the
+    order in which they were received. The threads share the GIL: they
+    let the sniffing loop go on receiving while packets are dissected,
+    but they do not speed up the dissection itself.
+    """
+
+    def __init__(self,
+                 workers,  # type: int
+                 maxsize,  # type: int
+                 handler,  # type: Callable[[Packet], None]
+                 ):
+        # type: (...) -> None
+        self.handler = handler
+        self.queue = Queue(maxsize)  # type: Queue[Optional[Tuple[int, Any, Any, Optional[float], Any]]]  # noqa: E501
+        self.cond = Condition()
+        self.seq = 0
+        self.next_seq = 0
+        self.threads = [
+            Thread(target=self._worker, name="AsyncSniffer dissector %d" % i)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def put(self, cls, val, ts, sniffed_on):
+        # type: (Type[Packet], bytes, Optional[float], Any) -> None
+        """Queues data returned by recv_raw(). Blocks when the queue is
+        full."""
+        self.queue.put((self.seq, cls, val, ts, sniffed_on))
+        self.seq += 1
+
+    def put_packet(self, pkt):
+        # type: (Packet) -> None
+        """Queues an already dissected packet, to keep the order"""
+        self.queue.put((self.seq, None, pkt, None, None))
+        self.seq += 1
+
+    def _worker(self):
+        # type: () -> None
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            seq, cls, val, ts, sniffed_on = item
+            pkt = None  # type: Optional[Packet]
+            try:
+                if cls is None:
+                    pkt = val
+                else:
+                    pkt = SuperSocket.dissect(cls, val, ts)
+                    pkt.sniffed_on = sniffed_on
+            except Exception:
+                # Raised with conf.debug_dissector: the sequence number
+                # must still be handed over to the other workers
+                log_runtime.exception("--- Error dissecting a packet")
+            with self.cond:
+                while self.next_seq != seq:
+                    self.cond.wait()
+                try:
+                    if pkt is not None:
+                        self.handler(pkt)
+                except Exception:
+                    log_runtime.exception("--- Error handling a packet")
+                finally:
+                    self.next_seq += 1
+                    self.cond.notify_all()
+
+    def close(self):
+        # type: () -> None
+        """Waits for the queued packets to be handled"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
 class AsyncSniffer(object):
     """
     Sniff packets and return a list of packets.
@@ -1004,6 +1133,19 @@ class AsyncSniffer(object):
         monitor: use monitor mode. May not be available on all OS
         started_callback: called as soon as the sniffer starts sniffing
                           (default: None).
+        rawfilter: Python function applied to the raw data of each packet,
+                   called with (data, timestamp, sniffed_on). Only the
+                   packets for which it returns True are dissected.
+        dissect_workers: number of threads used to dissect the packets
+                         (default: 0, the packets are dissected in the
+                         sniffing loop). The packets are still handed to
+                         lfilter, prn and the session in order. Because of
+                         the GIL, this does not dissect packets in
+                         parallel: it only decouples the capture from the
+                         dissection, so that the sockets are drained while
+                         a burst of packets is dissected.
+        dissect_queue: maximum number of packets waiting to be dissected
+                       (default: 1000) when dissect_workers is set.
 
     The iface, offline and opened_socket parameters can be either an
     element, a list of elements, or a dict object mapping an element to a
@@ -1069,6 +1211,9 @@ class AsyncSniffer(object):
              started_callback=None,  # type: Optional[Callable[[], Any]]
              session=None,  # type: Optional[_GlobSessionType]
              session_kwargs={},  # type: Dict[str, Any]
+             rawfilter=None,  # type: Optional[Callable[[bytes, Optional[float], Any], bool]]  # noqa: E501
+             dissect_workers=0,  # type: int
+             dissect_queue=1000,  # type: int
              **karg  # type: Any
              ):
         # type: (...) -> None
@@ -1174,10 +1319,10 @@ class AsyncSniffer(object):
                     "The used select function "
                     "will be the one of the first socket")
 
+        from scapy.automaton import ObjectPipe, ObjectSelector
         close_pipe = None  # type: Optional[ObjectPipe[None]]
         if not nonblocking_socket:
             # select is blocking: Add special control socket
-            from scapy.automaton import ObjectPipe
             close_pipe = ObjectPipe[None]()
             sniff_sockets[close_pipe] = "control_socket"  # type: ignore
 
@@ -1194,6 +1339,40 @@ class AsyncSniffer(object):
                 self.continue_sniff = False
             self.stop_cb = stop_cb
 
+        sniff_session = session  # type: DefaultSession
+
+        def handle_packet(p):
+            # type: (Packet) -> None
+            if not self.continue_sniff:
+                # Packets dissected after the end of the capture
+                return
+            if lfilter and not lfilter(p):
+                return
+            # on_packet_received handles the prn/storage
+            sniff_session.on_packet_received(p)
+            # check
+            if (stop_filter and stop_filter(p)) or \
+                    (0 < count <= sniff_session.count):
+                if dissector:
+                    # Called from a worker: wake up the sniffing loop
+                    self.stop_cb()
+                else:
+                    self.continue_sniff = False
+
+        # Sockets whose recv() is recv_raw() followed by a dissection:
+        # their packets can be filtered, or dissected, elsewhere
+        raw_sockets = set()  # type: Set[SuperSocket]
+        if rawfilter or dissect_workers:
+            raw_sockets.update(
+                s for s in sniff_sockets
+                if getattr(type(s), "recv", None) == SuperSocket.recv
+            )
+        dissector = None  # type: Optional[_DissectorPool]
+        selector = None  # type: Optional[ObjectSelector]
+        if dissect_workers:
+            dissector = _DissectorPool(dissect_workers, dissect_queue,
+                                       handle_packet)
+
         try:
             if started_callback:
                 started_callback()
@@ -1204,18 +1383,44 @@ class AsyncSniffer(object):
                 stoptime = time.time() + timeout
             remain = None
 
+            # The sockets that use the default select() are registered
+            # once in a selector, instead of being selected again on
+            # each iteration
+            if select_func is SuperSocket.select:
+                selector = ObjectSelector(sniff_sockets)
+            sockets_list = list(sniff_sockets)
+
             while sniff_sockets and self.continue_sniff:
                 if timeout is not None:
                     remain = stoptime - time.time()
                     if remain <= 0:
                         break
-                sockets = select_func(list(sniff_sockets.keys()), remain)
+                if selector is not None:
+                    sockets = selector.select(remain)
+                else:
+                    sockets = select_func(sockets_list, remain)
                 dead_sockets = []
                 for s in sockets:
-                    if s is close_pipe:  # type: ignore
+                    if s is close_pipe:
                         break
                     try:
-                        p = s.recv()
+                        if s in raw_sockets:
+                            cls, val, ts = s.recv_raw()
+                            if not val or not cls:
+                                continue
+                            if rawfilter and \
+                                    not rawfilter(val, ts, sniff_sockets[s]):
+                                continue
+                            if dissector:
+                                dissector.put(cls, val, ts, sniff_sockets[s])
+                                continue
+                            p = s.dissect(cls, val, ts)  # type: Optional[Packet]  # noqa: E501
+                        else:
+                            p = s.recv()
+                            if p is not None and rawfilter and \
+                                    not rawfilter(bytes(p), float(p.time),
+                                                  sniff_sockets[s]):
+                                continue
                     except EOFError:
                         # End of stream
                         try:
@@ -1240,21 +1445,27 @@ class AsyncSniffer(object):
                         continue
                     if p is None:
                         continue
-                    if lfilter and not lfilter(p):
-                        continue
                     p.sniffed_on = sniff_sockets[s]
-                    # on_packet_received handles the prn/storage
-                    session.on_packet_received(p)
-                    # check
-                    if (stop_filter and stop_filter(p)) or \
-                            (0 < count <= session.count):
-                        self.continue_sniff = False
+                    if dissector:
+                        dissector.put_packet(p)
+                        continue
+                    handle_packet(p)
+                    if not self.continue_sniff:
                         break
                 # Removed dead sockets
                 for s in dead_sockets:
                     del sniff_sockets[s]
+                    if selector is not None:
+                        selector.unregister(s)
+                if dead_sockets:
+                    sockets_list = list(sniff_sockets)
         except KeyboardInterrupt:
             pass
+        finally:
+            if selector is not None:
+                selector.close()
+        if dissector:
+            dissector.close()
         self.running = False
         if opened_socket is None:
             for s in sniff_sockets:
@@ -7,9 +7,9 @@
 Sessions: decode flow of packets when sniffing
 """
 
-from collections import defaultdict
-from scapy.compat import raw
+from collections import OrderedDict
 from scapy.config import conf
+from scapy.modules import six
 from scapy.packet import NoPayload, Packet
 from scapy.plist import PacketList
 
@@ -17,7 +17,6 @@ from scapy.plist import PacketList
 from scapy.compat import (
     Any,
     Callable,
-    DefaultDict,
     Dict,
     List,
     Optional,
@@ -113,39 +112,28 @@ class IPSession(DefaultSession):
 
     Usage:
     >>> sniff(session=IPSession)
+
+    The fragments are reassembled by an
+    :class:`~scapy.layers.inet.IPDefragmenter`, which bounds the time and
+    memory spent on incomplete datagrams. A custom one can be provided:
+
+    >>> sniff(session=IPSession(
+    ...     defragmenter=IPDefragmenter(timeout=10, max_bytes=1 << 20)
+    ... ))
     """
 
     def __init__(self, *args, **kwargs):
         # type: (*Any, **Any) -> None
+        defragmenter = kwargs.pop("defragmenter", None)
         DefaultSession.__init__(self, *args, **kwargs)
-        self.fragments = defaultdict(list)  # type: DefaultDict[Tuple[Any, ...], List[Packet]]  # noqa: E501
+        if defragmenter is None:
+            from scapy.layers.inet import IPDefragmenter
+            defragmenter = IPDefragmenter()
+        self.defragmenter = defragmenter
 
     def _ip_process_packet(self, packet):
         # type: (Packet) -> Optional[Packet]
-        from scapy.layers.inet import _defrag_list, IP
-        if IP not in packet:
-            return packet
-        ip = packet[IP]
-        packet._defrag_pos = 0
-        if ip.frag != 0 or ip.flags.MF:
-            uniq = (ip.id, ip.src, ip.dst, ip.proto)
-            self.fragments[uniq].append(packet)
-            if not ip.flags.MF:  # end of frag
-                try:
-                    if self.fragments[uniq][0].frag == 0:
-                        # Has first fragment (otherwise ignore)
-                        defrag = []  # type: List[Packet]
-                        _defrag_list(self.fragments[uniq], defrag, [])
-                        defragmented_packet = defrag[0]
-                        defragmented_packet = defragmented_packet.__class__(
-                            raw(defragmented_packet)
-                        )
-                        return defragmented_packet
-                finally:
-                    del self.fragments[uniq]
-            return None
-        else:
-            return packet
+        return cast(Optional[Packet], self.defragmenter.process(packet))
 
     def on_packet_received(self, pkt):
         # type: (Optional[Packet]) -> None
@@ -163,7 +151,8 @@ class StringBuffer(object):
     in the fragment.
 
     If a TCP fragment is missed, this class will fill the missing space with
-    zeros.
+    zeros, and keep track of the missing (start, end) ranges in
+    ``incomplete`` until they are received.
     """
     def __init__(self):
         # type: () -> None
@@ -173,25 +162,43 @@ class StringBuffer(object):
 
     def append(self, data, seq):
         # type: (bytes, int) -> None
-        data_len = len(data)
         seq = seq - 1
-        if seq + data_len > self.content_len:
-            self.content += b"\x00" * (seq - self.content_len + data_len)
-            # If data was missing, mark it.
-            self.incomplete.append((self.content_len, seq))
-            self.content_len = seq + data_len
+        if seq < 0:
+            # Data before the start of the buffer
+            data = data[-seq:]
+            seq = 0
+        data_len = len(data)
+        end = seq + data_len
+        if self.incomplete:
+            self._fill(seq, end)
+        if end > self.content_len:
+            self.content += b"\x00" * (end - self.content_len)
+            if seq > self.content_len:
+                # If data was missing, mark it.
+                self.incomplete.append((self.content_len, seq))
+            self.content_len = end
             assert len(self.content) == self.content_len
-        # XXX removes empty space marker.
-        # for ifrag in self.incomplete:
-        #     if [???]:
-        #         self.incomplete.remove([???])
-        memoryview(self.content)[seq:seq + data_len] = data  # type: ignore
+        memoryview(self.content)[seq:end] = data  # type: ignore
+
+    def _fill(self, start, end):
+        # type: (int, int) -> None
+        """Removes [start, end[ from the missing ranges"""
+        incomplete = []
+        for hole_start, hole_end in self.incomplete:
+            if hole_end <= start or hole_start >= end:
+                incomplete.append((hole_start, hole_end))
+                continue
+            if hole_start < start:
+                incomplete.append((hole_start, start))
+            if hole_end > end:
+                incomplete.append((end, hole_end))
+        self.incomplete = incomplete
 
     def full(self):
         # type: () -> bool
-        # Should only be true when all missing data was filled up,
+        # Only true when all missing data was filled up,
         # (or there never was missing data)
-        return True  # XXX
+        return not self.incomplete
 
     def clear(self):
         # type: () -> None
@@ -215,6 +222,17 @@ class StringBuffer(object):
         return cast(str, self.__bytes__())
 
 
+class _TCPFlow(object):
+    """A TCP flow (one direction) being reassembled by TCPSession"""
+    __slots__ = ["data", "metadata", "last_seen"]
+
+    def __init__(self, metadata, last_seen):
+        # type: (Dict[str, Any], float) -> None
+        self.data = StringBuffer()
+        self.metadata = metadata
+        self.last_seen = last_seen
+
+
 class TCPSession(IPSession):
     """A Session that matches seq/ack packets together to dissect
     special protocols, such as HTTP.
@@ -236,9 +254,24 @@ class TCPSession(IPSession):
     For more details and a real example, see:
     https://scapy.readthedocs.io/en/latest/usage.html#how-to-use-tcpsession-to-defragment-tcp-packets
 
+    The flows are identified by their (src, dst, sport, dport) tuple, and
+    stored in a table that is bounded in number of flows and buffered bytes:
+    the least recently used flows are evicted when it is full. Flows also
+    expire when they are idle, and shortly after a FIN or a RST. The
+    timeouts are compared to the timestamps of the packets, so that they
+    also apply to offline captures.
+
     :param app: Whether the socket is on application layer = has no TCP
                 layer. This is used for instance if you are using a native
                 TCP socket. Default to False
+    :param max_flows: the maximum number of flows being reassembled
+    :param max_bytes: the maximum number of bytes buffered in all the flows
+    :param idle_timeout: the time (in s) after which an idle flow expires
+    :param end_timeout: the time (in s) after which a flow expires once a
+                        FIN or a RST was seen
+
+    The numbers of flows that were evicted, or expired, are kept in the
+    ``evicted`` and ``expired`` attributes.
     """
 
     fmt = ('TCP {IP:%IP.src%}{IPv6:%IPv6.src%}:%r,TCP.sport% > ' +
@@ -246,17 +279,62 @@ class TCPSession(IPSession):
 
     def __init__(self, app=False, *args, **kwargs):
         # type: (bool, *Any, **Any) -> None
+        max_flows = kwargs.pop("max_flows", 10000)  # type: int
+        max_bytes = kwargs.pop("max_bytes", 1 << 26)  # type: int
+        idle_timeout = kwargs.pop("idle_timeout", 120)  # type: Optional[float]
+        end_timeout = kwargs.pop("end_timeout", 10)  # type: Optional[float]
         super(TCPSession, self).__init__(*args, **kwargs)
         self.app = app
         if app:
             self.data = b""
             self.metadata = {}  # type: Dict[str, Any]
         else:
-            # The StringBuffer() is used to build a global
-            # string from fragments and their seq nulber
-            self.tcp_frags = defaultdict(
-                lambda: (StringBuffer(), {})
-            )  # type: DefaultDict[str, Tuple[StringBuffer, Dict[str, Any]]]
+            self.max_flows = max_flows
+            self.max_bytes = max_bytes
+            self.idle_timeout = idle_timeout
+            self.end_timeout = end_timeout
+            self.evicted = 0
+            self.expired = 0
+            # The flows, from the least to the most recently used
+            self.tcp_frags = OrderedDict()  # type: Dict[Tuple[Any, ...], _TCPFlow]  # noqa: E501
+            # The flows that saw a FIN or a RST, and their deadline
+            self.tcp_ends = OrderedDict()  # type: Dict[Tuple[Any, ...], float]  # noqa: E501
+            # The bytes buffered in all the flows
+            self.tcp_bytes = 0
+
+    def _drop_flow(self, ident):
+        # type: (Tuple[Any, ...]) -> None
+        flow = self.tcp_frags.pop(ident)
+        self.tcp_bytes -= len(flow.data)
+        self.tcp_ends.pop(ident, None)
+
+    def _expire_flows(self, now):
+        # type: (float) -> None
+        """Drops the flows that are idle, or ended, at the time <now>"""
+        if self.idle_timeout is not None:
+            limit = now - self.idle_timeout
+            while self.tcp_frags:
+                ident, flow = next(six.iteritems(self.tcp_frags))
+                if flow.last_seen >= limit:
+                    break
+                self._drop_flow(ident)
+                self.expired += 1
+        while self.tcp_ends:
+            ident, deadline = next(six.iteritems(self.tcp_ends))
+            if deadline > now:
+                break
+            self._drop_flow(ident)
+            self.expired += 1
+
+    def _evict_flows(self):
+        # type: () -> None
+        """Drops the least recently used flows, until the table fits in
+        the limits. The most recent flow is kept."""
+        while len(self.tcp_frags) > 1 and (
+                len(self.tcp_frags) > self.max_flows or
+                self.tcp_bytes > self.max_bytes):
+            self._drop_flow(next(iter(self.tcp_frags)))
+            self.evicted += 1
 
     def _process_packet(self, pkt):
         # type: (Packet) -> Optional[Packet]
@@ -281,28 +359,39 @@ class TCPSession(IPSession):
         from scapy.layers.inet import IP, TCP
         if not pkt or TCP not in pkt:
             return pkt
-        pay = pkt[TCP].payload
+        tcp = pkt[TCP]
+        pay = tcp.payload
         if isinstance(pay, (NoPayload, conf.padding_layer)):
             return pkt
         new_data = pay.original
-        # Match packets by a uniqute TCP identifier
-        seq = pkt[TCP].seq
-        ident = pkt.sprintf(self.fmt)
-        data, metadata = self.tcp_frags[ident]
-        # Let's guess which class is going to be used
-        if "pay_class" not in metadata:
+        now = float(pkt.time)
+        self._expire_flows(now)
+        # Match packets by a unique TCP identifier
+        seq = tcp.seq
+        try:
+            ident = (tcp.underlayer.src, tcp.underlayer.dst,
+                     tcp.sport, tcp.dport)  # type: Tuple[Any, ...]
+        except AttributeError:
+            ident = (None, None, tcp.sport, tcp.dport)
+        # Pop, then re-insert, the flow to keep the table sorted from
+        # the least to the most recently used
+        flow = self.tcp_frags.pop(ident, None)
+        if flow is None:
+            # Let's guess which class is going to be used
             pay_class = pay.__class__
-            if hasattr(pay_class, "tcp_reassemble"):
-                tcp_reassemble = pay_class.tcp_reassemble
-            else:
+            if not hasattr(pay_class, "tcp_reassemble"):
                 # We can't know for sure when a packet ends.
                 # Ignore.
                 return pkt
-            metadata["pay_class"] = pay_class
-            metadata["tcp_reassemble"] = tcp_reassemble
-            metadata["seq"] = seq
-        else:
-            tcp_reassemble = metadata["tcp_reassemble"]
+            flow = _TCPFlow({
+                "pay_class": pay_class,
+                "tcp_reassemble": pay_class.tcp_reassemble,
+                "seq": seq,
+            }, now)
+        self.tcp_frags[ident] = flow
+        flow.last_seen = now
+        data, metadata = flow.data, flow.metadata
+        tcp_reassemble = metadata["tcp_reassemble"]
         # Get a relative sequence number for a storage purpose
         relative_seq = metadata.get("relative_seq", None)
         if relative_seq is None:
@@ -310,36 +399,43 @@ class TCPSession(IPSession):
         seq = seq - relative_seq
         # Add the data to the buffer
         # Note that this take care of retransmission packets.
+        data_len = len(data)
         data.append(new_data, seq)
+        self.tcp_bytes += len(data) - data_len
         # Check TCP FIN or TCP RESET
-        if pkt[TCP].flags.F or pkt[TCP].flags.R:
+        if tcp.flags.F or tcp.flags.R:
             metadata["tcp_end"] = True
+            if self.end_timeout is not None:
+                ends = [ident]
+                if tcp.flags.R:
+                    # Both directions are over
+                    ends.append((ident[1], ident[0], ident[3], ident[2]))
+                for end in ends:
+                    if end in self.tcp_frags and end not in self.tcp_ends:
+                        self.tcp_ends[end] = now + self.end_timeout
 
         # In case any app layer protocol requires it,
         # allow the parser to inspect TCP PSH flag
-        if pkt[TCP].flags.P:
+        if tcp.flags.P:
             metadata["tcp_psh"] = True
-        # XXX TODO: check that no empty space is missing in the buffer.
-        # XXX Currently, if a TCP fragment was missing, we won't notice it.
         packet = None  # type: Optional[Packet]
         if data.full():
             # Reassemble using all previous packets
             packet = tcp_reassemble(bytes(data), metadata)
+        if not packet:
+            self._evict_flows()
+            return None
         # Stack the result on top of the previous frames
-        if packet:
-            if "seq" in metadata:
-                pkt[TCP].seq = metadata["seq"]
-            data.clear()
-            metadata.clear()
-            del self.tcp_frags[ident]
-            pay.underlayer.remove_payload()
-            if IP in pkt:
-                pkt[IP].len = None
-                pkt[IP].chksum = None
-            pkt = pkt / packet
-            pkt.wirelen = None
-            return pkt
-        return None
+        if "seq" in metadata:
+            tcp.seq = metadata["seq"]
+        self._drop_flow(ident)
+        pay.underlayer.remove_payload()
+        if IP in pkt:
+            pkt[IP].len = None
+            pkt[IP].chksum = None
+        pkt = pkt / packet
+        pkt.wirelen = None
+        return pkt
 
     def on_packet_received(self, pkt):
         # type: (Optional[Packet]) -> None
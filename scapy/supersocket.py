@@ -16,7 +16,7 @@ import struct
 import time
 
 from scapy.config import conf
-from scapy.consts import DARWIN, WINDOWS
+from scapy.consts import DARWIN, LINUX, WINDOWS
 from scapy.data import MTU, ETH_P_IP, SOL_PACKET, SO_TIMESTAMPNS
 from scapy.compat import raw
 from scapy.error import warning, log_runtime
@@ -35,6 +35,7 @@ from scapy.utils import PcapReader, tcpdump
 from scapy.interfaces import _GlobInterfaceType
 from scapy.compat import (
     Any,
+    Iterable,
     Iterator,
     List,
     Optional,
@@ -111,6 +112,19 @@ class SuperSocket:
         else:
             return 0
 
+    def send_many(self, pkts):
+        # type: (Iterable[Packet]) -> int
+        """Send several packets, and return the number of packets sent.
+
+        Some sockets override this method to send them in batches, using
+        fewer syscalls.
+        """
+        n = 0
+        for p in pkts:
+            self.send(p)
+            n += 1
+        return n
+
     if six.PY2:
         def _recv_raw(self, sock, x):
             # type: (socket.socket, int) -> Tuple[bytes, Any, Optional[float]]
@@ -178,6 +192,12 @@ class SuperSocket:
         cls, val, ts = self.recv_raw(x)
         if not val or not cls:
             return None
+        return self.dissect(cls, val, ts)
+
+    @staticmethod
+    def dissect(cls, val, ts):
+        # type: (Type[Packet], bytes, Optional[float]) -> Packet
+        """Dissects the data returned by recv_raw()"""
         try:
             pkt = cls(val)  # type: Packet
         except KeyboardInterrupt:
@@ -260,6 +280,10 @@ class SuperSocket:
         :returns: an array of sockets that were selected and
             the function to be called next to get the packets (i.g. recv)
         """
+        if LINUX:
+            # poll() is not limited to 1024 file descriptors
+            from scapy.automaton import select_objects
+            return select_objects(sockets, remain)
         try:
             inp, _, _ = select(sockets, [], [], remain)
         except (IOError, select_error) as exc:
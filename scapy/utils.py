@@ -13,10 +13,13 @@ from __future__ import print_function
 from decimal import Decimal
 
 import array
+import bisect
 import collections
 import decimal
 import difflib
+import functools
 import gzip
+import mmap
 import os
 import random
 import re
@@ -36,8 +39,9 @@ from scapy.config import conf
 from scapy.consts import DARWIN, OPENBSD, WINDOWS
 from scapy.data import MTU, DLT_EN10MB
 from scapy.compat import orb, plain_str, chb, bytes_base64,\
-    base64_bytes, hex_bytes, lambda_tuple_converter, bytes_encode
+    base64_bytes, hex_bytes, lambda_tuple_converter, bytes_encode, bytes_int
 from scapy.error import log_runtime, Scapy_Exception, warning
+from scapy.extlib import NUMPY, numpy
 from scapy.pton_ntop import inet_pton
 
 # Typing imports
@@ -48,6 +52,7 @@ from scapy.compat import (
     Callable,
     Dict,
     IO,
+    Iterable,
     Iterator,
     List,
     Literal,
@@ -490,15 +495,72 @@ else:
     checksum_endian_transform = lambda chk: ((chk >> 8) & 0xff) | chk << 8
 
 
+# Buffers from this size are summed with NumPy, when it is available
+CHECKSUM_NUMPY_MIN_LEN = 1024
+
+
 def checksum(pkt):
     # type: (bytes) -> int
+    """Computes the Internet checksum (RFC 1071) of a buffer.
+
+    As 2**16 is 1 modulo 0xffff, the one's complement sum of the 16-bit
+    words is the buffer read as a big integer, modulo 0xffff.
+    """
     if len(pkt) % 2 == 1:
         pkt += b"\0"
-    s = sum(array.array("H", pkt))
-    s = (s >> 16) + (s & 0xffff)
-    s += s >> 16
-    s = ~s
-    return checksum_endian_transform(s) & 0xffff
+    if NUMPY and len(pkt) >= CHECKSUM_NUMPY_MIN_LEN:
+        s = int(numpy.frombuffer(pkt, dtype=">u2").sum(dtype=numpy.uint64))
+        s %= 0xffff
+    elif pkt:
+        s = bytes_int(pkt) % 0xffff
+    else:
+        s = 0
+    if s == 0 and pkt.count(b"\0") != len(pkt):
+        # The sum of a non-null buffer is never a null value
+        s = 0xffff
+    return ~s & 0xffff
+
+
+def checksum_many(bufs):
+    # type: (Iterable[bytes]) -> List[int]
+    """Computes the Internet checksums of several buffers.
+
+    When NumPy is available, all the buffers are summed at once.
+    """
+    bufs = [b + b"\0" if len(b) % 2 else b for b in bufs]
+    if not NUMPY or len(bufs) < 2:
+        return [checksum(b) for b in bufs]
+    lengths = numpy.array([len(b) for b in bufs], dtype=numpy.int64) // 2
+    ends = numpy.cumsum(lengths)
+    nonempty = lengths > 0
+    starts = (ends - lengths)[nonempty]
+    sums = numpy.zeros(len(bufs), dtype=numpy.uint64)
+    nonnull = numpy.zeros(len(bufs), dtype=bool)
+    if starts.size:
+        words = numpy.frombuffer(b"".join(bufs), dtype=">u2")
+        sums[nonempty] = numpy.add.reduceat(
+            words.astype(numpy.uint64), starts
+        ) % 0xffff
+        nonnull[nonempty] = numpy.maximum.reduceat(words, starts) > 0
+    sums[(sums == 0) & nonnull] = 0xffff
+    return [0xffff - int(s) for s in sums]
+
+
+class _ChecksumOffload(threading.local):
+    """Per-thread state of the upper layer checksum offload.
+
+    While ``enabled`` is set, TCP and UDP only store the sum of their
+    pseudo-header in their checksum, for the kernel or the NIC to complete
+    it, and append it to ``partial``.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self.enabled = False
+        self.partial = []  # type: List[int]
+
+
+checksum_offload = _ChecksumOffload()
 
 
 def _fletcher16(charbuf):
@@ -1117,6 +1179,66 @@ def rdpcap(filename, count=-1):
         return fdesc.read_all(count=count)
 
 
+class _MmapFile(object):
+    """A read-only file-like object over a memory-mapped capture file.
+
+    read() returns memoryview slices of the mapping, so that the capture
+    readers can walk the records without any syscall or copy. The data is
+    only copied when it is converted to bytes (e.g. to build a Packet).
+    """
+
+    def __init__(self, fdesc):
+        # type: (IO[bytes]) -> None
+        self.fdesc = fdesc
+        self.name = getattr(fdesc, "name", "No name")
+        self.map = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.view = memoryview(self.map)
+        except TypeError:
+            # Python 2 mmap objects do not support memoryview()
+            self.map.close()
+            raise
+        self.size = len(self.view)
+        self.pos = fdesc.tell()
+
+    def read(self, size=-1):
+        # type: (int) -> memoryview
+        pos = self.pos
+        end = self.size
+        if 0 <= size < end - pos:
+            end = pos + size
+        self.pos = end
+        return self.view[pos:end]
+
+    def tell(self):
+        # type: () -> int
+        return self.pos
+
+    def seek(self, offset, whence=0):
+        # type: (int, int) -> int
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += self.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def fileno(self):
+        # type: () -> int
+        return self.fdesc.fileno()
+
+    def close(self):
+        # type: () -> None
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Some packets still reference the mapping: it will be
+            # unmapped once they are garbage collected.
+            pass
+        self.fdesc.close()
+
+
 # NOTE: Type hinting
 # Mypy doesn't understand the following metaclass, and thinks each
 # constructor (PcapReader...) needs 3 arguments each. To avoid this,
@@ -1141,14 +1263,17 @@ class PcapReader_metaclass(type):
             dct['alternative'].alternative = newcls
         return newcls
 
-    def __call__(cls, filename):  # type: ignore
-        # type: (Union[IO[bytes], str]) -> Any
+    def __call__(cls, filename, use_mmap=False):
+        # type: (Union[IO[bytes], str], bool) -> Any
         """Creates a cls instance, use the `alternative` if that
         fails.
 
+        :param use_mmap: memory-map the capture file, when possible (i.e.
+            not compressed), instead of reading it. The Raw readers then
+            return memoryview objects instead of bytes.
         """
         i = cls.__new__(cls, cls.__name__, cls.__bases__, cls.__dict__)
-        filename, fdesc, magic = cls.open(filename)
+        filename, fdesc, magic = cls.open(filename, use_mmap=use_mmap)
         if not magic:
             raise Scapy_Exception(
                 "No data could be read!"
@@ -1171,7 +1296,8 @@ class PcapReader_metaclass(type):
         raise Scapy_Exception("Not a supported capture file")
 
     @staticmethod
-    def open(fname  # type: Union[IO[bytes], str]
+    def open(fname,  # type: Union[IO[bytes], str]
+             use_mmap=False,  # type: bool
              ):
         # type: (...) -> Tuple[str, _ByteStream, bytes]
         """Open (if necessary) filename, and read the magic."""
@@ -1187,6 +1313,13 @@ class PcapReader_metaclass(type):
             fdesc = fname
             filename = getattr(fdesc, "name", "No name")
             magic = fdesc.read(4)
+        if use_mmap and magic and not isinstance(fdesc, gzip.GzipFile):
+            try:
+                fdesc = _MmapFile(fdesc)  # type: ignore
+            except (AttributeError, IOError, OSError, TypeError, ValueError):
+                # Not a regular file, or no memoryview support: read it
+                # as usual
+                pass
         return filename, fdesc, magic
 
 
@@ -1230,6 +1363,7 @@ class RawPcapReader:
         )
         self.linktype = linktype
         self.snaplen = snaplen
+        self._rec_hdr = struct.Struct(self.endian + "IIII")
 
     def __iter__(self):
         # type: () -> RawPcapReader
@@ -1256,11 +1390,24 @@ class RawPcapReader:
 
         raise EOFError when no more packets are available
         """
-        hdr = self.f.read(16)
+        f = self.f
+        if isinstance(f, _MmapFile):
+            # Walk the record headers directly over the mapped file
+            pos = f.pos
+            if pos + 16 > f.size:
+                raise EOFError
+            sec, usec, caplen, wirelen = self._rec_hdr.unpack_from(
+                f.view, pos
+            )
+            pos += 16
+            f.pos = pos + caplen
+            return (f.view[pos:pos + min(caplen, size)],
+                    RawPcapReader.PacketMetadata(sec, usec, wirelen, caplen))
+        hdr = f.read(16)
         if len(hdr) < 16:
             raise EOFError
         sec, usec, caplen, wirelen = struct.unpack(self.endian + "IIII", hdr)
-        return (self.f.read(caplen)[:size],
+        return (f.read(caplen)[:size],
                 RawPcapReader.PacketMetadata(sec=sec, usec=usec,
                                              wirelen=wirelen, caplen=caplen))
 
@@ -1350,6 +1497,9 @@ class PcapReader(RawPcapReader, _SuperSocket):
         if rp is None:
             raise EOFError
         s, pkt_info = rp
+        if not isinstance(s, bytes):
+            # memoryview from a memory-mapped file
+            s = s.tobytes()
 
         try:
             p = self.LLcls(s)  # type: Packet
@@ -1641,15 +1791,10 @@ class RawPcapNgReader(RawPcapReader):
                         "the TLS layer is not loaded! Scapy won't be able "
                         "to decrypt the packets.")
             else:
-                from scapy.layers.tls.session import load_nss_keys
+                from scapy.layers.tls.session import NSSKeyLog
 
-                # Write Key Log to a file and parse it
-                filename = get_temp_file()
-                with open(filename, "wb") as fd:
-                    fd.write(secrets_data)
-                    fd.close()
-
-                keys = load_nss_keys(filename)
+                keys = NSSKeyLog()
+                keys.parse(secrets_data)
                 if not keys:
                     warning("PcapNg: invalid TLS Key Log in DSB!")
                 else:
@@ -1679,6 +1824,9 @@ class PcapNgReader(RawPcapNgReader, PcapReader, _SuperSocket):
         if rp is None:
             raise EOFError
         s, (linktype, tsresol, tshigh, tslow, wirelen) = rp
+        if not isinstance(s, bytes):
+            # memoryview from a memory-mapped file
+            s = s.tobytes()
         try:
             cls = conf.l2types.num2layer[linktype]  # type: Type[Packet]
             p = cls(s)  # type: Packet
@@ -1701,6 +1849,311 @@ class PcapNgReader(RawPcapNgReader, PcapReader, _SuperSocket):
         return self.read_packet()
 
 
+# Python 2 has no array of unsigned long long
+_OFFSET_TYPECODE = "d" if six.PY2 else "Q"
+
+
+class IndexedPcapReader(object):
+    """Random access to the packets of a pcap or pcapng file.
+
+    The offset and the timestamp of every record are indexed when the
+    file is opened. The index is cached in a sidecar file (by default
+    ``<filename>.idx``) so that it only has to be built once.
+
+    >>> r = IndexedPcapReader("big.pcap")
+    >>> len(r)
+    >>> r[5000000]
+    >>> r[r.seek_time(t0):r.seek_time(t1)]  # all packets in [t0, t1[
+
+    :param filename: the name of the capture file, or a seekable file-like
+        object (whose index is not cached)
+    :param index_file: the name of the sidecar index file. False disables
+        the cache.
+    :param use_mmap: memory-map the capture file (see PcapReader)
+    """
+
+    INDEX_MAGIC = b"SCAPYIDX"
+    INDEX_VERSION = 1
+    # magic, version, byte order, file size, file mtime, nb of records,
+    # nb of setup blocks
+    _index_hdr = struct.Struct("<8sHcxQdQQ")
+
+    def __init__(self,
+                 filename,  # type: Union[IO[bytes], str]
+                 index_file=None,  # type: Optional[Union[str, bool]]
+                 use_mmap=False,  # type: bool
+                 ):
+        # type: (...) -> None
+        self.reader = PcapReader(filename, use_mmap=use_mmap)  # type: ignore  # noqa: E501
+        self.f = self.reader.f
+        path = filename if isinstance(filename, str) else None
+        if path is None or index_file is False:
+            index_file = None
+        elif not isinstance(index_file, str):
+            index_file = path + ".idx"
+        self.index_file = index_file
+        self._reset_index()
+        if not (path and index_file and self._load_index(path, index_file)):
+            self._build_index()
+            if path and index_file:
+                self._save_index(path, index_file)
+
+    def _reset_index(self):
+        # type: () -> None
+        # records offsets and timestamps
+        self.offsets = array.array(_OFFSET_TYPECODE)
+        self.times = array.array("d")
+        # offsets of the pcapng blocks that are needed to read the
+        # packets (section headers, interfaces descriptions, ...)
+        self.setup_offsets = array.array(_OFFSET_TYPECODE)
+
+    def _build_index(self):
+        # type: () -> None
+        """Walk the whole file and index its records"""
+        reader, f = self.reader, self.f
+        last_time = 0.
+        while True:
+            pos = f.tell()
+            try:
+                if isinstance(reader, RawPcapNgReader):
+                    res = reader._read_block(size=0)
+                    if res is None:
+                        self.setup_offsets.append(pos)
+                        continue
+                    meta_ng = res[1]
+                    if meta_ng.tshigh is not None:
+                        last_time = float(
+                            (meta_ng.tshigh << 32) + meta_ng.tslow
+                        ) / meta_ng.tsresol
+                else:
+                    meta = reader._read_packet(size=0)[1]
+                    last_time = meta.sec + meta.usec * (
+                        1e-9 if reader.nano else 1e-6
+                    )
+            except EOFError:
+                break
+            self.offsets.append(pos)
+            self.times.append(last_time)
+
+    @staticmethod
+    def _file_stat(filename):
+        # type: (str) -> Tuple[int, float]
+        stat = os.stat(filename)
+        return stat.st_size, stat.st_mtime
+
+    def _load_index(self, filename, index_file):
+        # type: (str, str) -> bool
+        """Load the index from the sidecar file, if it is still valid"""
+        try:
+            with open(index_file, "rb") as fd:
+                hdr = fd.read(self._index_hdr.size)
+                magic, version, order, size, mtime, count, nsetup = \
+                    self._index_hdr.unpack(hdr)
+                if magic != self.INDEX_MAGIC or \
+                        version != self.INDEX_VERSION or \
+                        order != sys.byteorder[:1].encode() or \
+                        (size, mtime) != self._file_stat(filename):
+                    return False
+                self.offsets.fromfile(fd, count)
+                self.times.fromfile(fd, count)
+                self.setup_offsets.fromfile(fd, nsetup)
+        except (IOError, OSError, EOFError, struct.error):
+            self._reset_index()
+            return False
+        # Replay the blocks describing the pcapng interfaces
+        reader = self.reader
+        if isinstance(reader, RawPcapNgReader):
+            reader.interfaces = []
+            for pos in self.setup_offsets:
+                self.f.seek(int(pos))
+                reader._read_block(size=0)
+        return True
+
+    def _save_index(self, filename, index_file):
+        # type: (str, str) -> None
+        """Store the index in the sidecar file"""
+        size, mtime = self._file_stat(filename)
+        try:
+            with open(index_file, "wb") as fd:
+                fd.write(self._index_hdr.pack(
+                    self.INDEX_MAGIC, self.INDEX_VERSION,
+                    sys.byteorder[:1].encode(), size, mtime,
+                    len(self.offsets), len(self.setup_offsets)
+                ))
+                self.offsets.tofile(fd)
+                self.times.tofile(fd)
+                self.setup_offsets.tofile(fd)
+        except (IOError, OSError):
+            log_runtime.info("Could not write the pcap index to %s",
+                             index_file)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.offsets)
+
+    def read_packet_at(self, i):
+        # type: (int) -> Packet
+        """Return the i-th packet of the file"""
+        self.f.seek(int(self.offsets[i]))
+        return self.reader.read_packet()
+
+    def __getitem__(self, item):
+        # type: (Union[int, slice]) -> Union[Packet, PacketList]
+        if isinstance(item, slice):
+            from scapy import plist
+            return plist.PacketList(
+                [self.read_packet_at(i)
+                 for i in range(*item.indices(len(self)))],
+                name=os.path.basename(self.reader.filename)
+            )
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("packet index out of range")
+        return self.read_packet_at(item)
+
+    def __iter__(self):
+        # type: () -> Iterator[Packet]
+        for i in range(len(self)):
+            yield self.read_packet_at(i)
+
+    def seek_time(self, ts):
+        # type: (float) -> int
+        """Return the index of the first packet whose timestamp is
+        greater or equal to ts. The packets are expected to be sorted by
+        time, as they usually are in captures.
+        """
+        return bisect.bisect_left(self.times, float(ts))
+
+    def close(self):
+        # type: () -> None
+        self.reader.close()
+
+    def __enter__(self):
+        # type: () -> IndexedPcapReader
+        return self
+
+    def __exit__(self, exc_type, exc_value, tracback):
+        # type: (Optional[Any], Optional[Any], Optional[Any]) -> None
+        self.close()
+
+
+# func and reducer of parallel_rdpcap(), set in the workers by the pool
+# initializer. With the "fork" start method they are inherited rather than
+# pickled, so that lambdas can be used.
+_parallel_rdpcap_funcs = (None, None)  # type: Tuple[Optional[Callable[[Packet], Any]], Optional[Callable[[Any, Any], Any]]]  # noqa: E501
+
+
+def _parallel_rdpcap_init(func, reducer):
+    # type: (Optional[Callable[[Packet], Any]], Optional[Callable[[Any, Any], Any]]) -> None  # noqa: E501
+    global _parallel_rdpcap_funcs
+    _parallel_rdpcap_funcs = (func, reducer)
+
+
+def _parallel_rdpcap_chunk(args):
+    # type: (Tuple[str, List[int], int, int]) -> Tuple[bool, Any]
+    """Dissect <count> packets starting at <offset> (in a worker process)"""
+    filename, setup_offsets, offset, count = args
+    func, reducer = _parallel_rdpcap_funcs
+    results = []  # type: List[Any]
+    with PcapReader(filename) as reader:
+        if isinstance(reader, RawPcapNgReader):
+            reader.interfaces = []
+            for pos in setup_offsets:
+                reader.f.seek(pos)
+                reader._read_block(size=0)
+        reader.f.seek(offset)
+        for _ in range(count):
+            pkt = reader.read_packet()
+            if func is not None:
+                pkt = func(pkt)
+                if pkt is None:
+                    continue
+            results.append(pkt)
+    if reducer is None:
+        return True, results
+    if not results:
+        return False, None
+    return True, functools.reduce(reducer, results)
+
+
+def parallel_rdpcap(filename,  # type: str
+                    workers=None,  # type: Optional[int]
+                    func=None,  # type: Optional[Callable[[Packet], Any]]
+                    reducer=None,  # type: Optional[Callable[[Any, Any], Any]]  # noqa: E501
+                    chunksize=None,  # type: Optional[int]
+                    index_file=None,  # type: Optional[Union[str, bool]]
+                    ):
+    # type: (...) -> Any
+    """Read a pcap or pcapng file using a pool of processes.
+
+    The file is indexed (see IndexedPcapReader) and split on record
+    boundaries into chunks, which are dissected in parallel. ``func`` is
+    called, in the workers, on each packet: its result replaces the packet,
+    and packets for which it returns None are dropped. The results are
+    returned in capture order.
+
+    Packets are sent back to the main process as bytes, and dissected again
+    there: this function is most useful when ``func`` extracts a few
+    values from each packet, or when ``reducer`` aggregates them.
+
+    >>> parallel_rdpcap("big.pcap", func=lambda p: p[IP].src if IP in p else None)  # noqa: E501
+
+    :param workers: the number of processes (default: the number of CPUs)
+    :param func: a function called on each packet
+    :param reducer: a function of two arguments, used to reduce the
+        results (like functools.reduce()). It is applied in the workers on
+        each chunk, then in the main process on the results of the chunks.
+        parallel_rdpcap() then returns the reduced value (None if there is
+        no result).
+    :param chunksize: the number of packets per chunk
+    :param index_file: see IndexedPcapReader
+    :returns: a PacketList when func and reducer are None, a list of the
+        results of func otherwise, or the reduced value.
+
+    Note that, when the multiprocessing start method is not "fork", func
+    and reducer must be picklable (e.g. module-level functions).
+    """
+    import multiprocessing
+    with IndexedPcapReader(filename, index_file=index_file) as idx:
+        offsets = idx.offsets
+        setup_offsets = idx.setup_offsets
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if chunksize is None:
+        chunksize = max(1, -(-len(offsets) // (workers * 4)))
+    tasks = [
+        (filename,
+         [int(pos) for pos in setup_offsets if pos < offsets[i]],
+         int(offsets[i]),
+         min(chunksize, len(offsets) - i))
+        for i in range(0, len(offsets), chunksize)
+    ]
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)),
+                                    initializer=_parallel_rdpcap_init,
+                                    initargs=(func, reducer))
+        try:
+            chunks = pool.map(_parallel_rdpcap_chunk, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        _parallel_rdpcap_init(func, reducer)
+        try:
+            chunks = [_parallel_rdpcap_chunk(task) for task in tasks]
+        finally:
+            _parallel_rdpcap_init(None, None)
+    if reducer is not None:
+        values = [value for ok, value in chunks if ok]
+        return functools.reduce(reducer, values) if values else None
+    results = [res for _, chunk in chunks for res in chunk]
+    if func is None:
+        from scapy import plist
+        return plist.PacketList(results, name=os.path.basename(filename))
+    return results
+
+
 class RawPcapWriter:
     """A stream PCAP writer with more control than wrpcap()"""
 
@@ -1713,6 +2166,7 @@ class RawPcapWriter:
                  sync=False,  # type: bool
                  nano=False,  # type: bool
                  snaplen=MTU,  # type: int
+                 batch=0,  # type: int
                  ):
         # type: (...) -> None
         """
@@ -1727,6 +2181,10 @@ class RawPcapWriter:
             truncating it
         :param sync: do not bufferize writes to the capture file
         :param nano: use nanosecond-precision (requires libpcap >= 1.5.0)
+        :param batch: coalesce the records in a buffer, written to the file
+            once it holds at least <batch> bytes (0: write each record
+            directly). With sync, the file is flushed after each of these
+            writes.
 
         """
 
@@ -1738,8 +2196,11 @@ class RawPcapWriter:
         self.endian = endianness
         self.sync = sync
         self.nano = nano
+        self.batch = batch
+        self._buffer = bytearray()
+        self._rec_hdr = struct.Struct(self.endian + "IIII")
         bufsz = 4096
-        if sync:
+        if sync and not batch:
             bufsz = 0
 
         if isinstance(filename, str):
@@ -1878,20 +2339,68 @@ class RawPcapWriter:
             elif usec is None:
                 usec = 0
 
-        self.f.write(struct.pack(self.endian + "IIII",
-                                 sec, usec, caplen, wirelen))
+        if self.batch:
+            buf = self._buffer
+            buf += self._rec_hdr.pack(sec, usec, caplen, wirelen)
+            buf += packet
+            if len(buf) >= self.batch:
+                self._write_buffer()
+            return
+        self.f.write(self._rec_hdr.pack(sec, usec, caplen, wirelen))
         self.f.write(packet)
         if self.sync:
             self.f.flush()
 
+    def write_many(self, records):
+        # type: (Iterable[Tuple[bytes, Optional[float]]]) -> None
+        """
+        Writes raw records to the pcap file, without building any Packet.
+
+        The record headers are packed in a buffer that is written to the
+        file in large chunks (of at least ``batch`` bytes, or 1MB if the
+        writer is not in batched mode).
+
+        :param records: an iterable of (bytes, timestamp) tuples. The
+                        timestamp is a number of seconds since epoch; None
+                        means now.
+        """
+        batch = self.batch or 1048576
+        scale = 1000000000 if self.nano else 1000000
+        pack = self._rec_hdr.pack
+        buf = self._buffer
+        for data, ts in records:
+            if not self.header_present:
+                self.write_header(data)
+            if ts is None:
+                ts = time.time()
+            sec = int(ts)
+            caplen = len(data)
+            buf += pack(sec, int(round((ts - sec) * scale)), caplen, caplen)
+            buf += data
+            if len(buf) >= batch:
+                self._write_buffer()
+        if not self.batch:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        # type: () -> None
+        """Writes the coalesced records to the file"""
+        if self._buffer:
+            self.f.write(self._buffer)
+            del self._buffer[:]
+            if self.sync:
+                self.f.flush()
+
     def flush(self):
         # type: () -> Optional[Any]
+        self._write_buffer()
         return self.f.flush()
 
     def close(self):
         # type: () -> Optional[Any]
         if not self.header_present:
             self.write_header(None)
+        self._write_buffer()
         return self.f.close()
 
     def __enter__(self):